@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Benchmark de memoria al encolar campañas con audiencias grandes.
+Crea una base de prueba temporal con N destinatarios en una campaña y mide el pico
+de memoria (RSS) y el tiempo de `encolar_campana`, comparado con cargar toda la
+audiencia de una vez como se hacía antes. Cada medición corre en un proceso aparte
+(el pico de RSS de un proceso nunca baja).
+
+python benchmark_audiencia.py --destinatarios 1000000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp_project.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.models import Estudiante, Plantilla, Campana, MensajeSaliente
+from core.services import encolar_campana, repartir_lineas
+
+RUTA_DB = str(settings.BASE_DIR / 'benchmark_audiencia.sqlite3')
+BLOQUE = 20000
+
+
+def rss_pico_mb() -> float:
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def encolar_en_memoria(campana) -> int:
+    """Versión anterior de encolar_campana: toda la audiencia y sus mensajes en listas."""
+    estudiantes = list(campana.destinatarios.filter(activo=True))
+    lineas = repartir_lineas(campana.lineas_envio())
+    MensajeSaliente.objects.bulk_create(
+        [MensajeSaliente(campana=campana, estudiante_id=e.id, linea=next(lineas)) for e in estudiantes],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    return MensajeSaliente.objects.filter(campana=campana).count()
+
+
+def poblar(destinatarios: int) -> int:
+    plantilla = Plantilla.objects.create(nombre_interno='Benchmark', cuerpo_mensaje='Hola {nombre}')
+    campana = Campana.objects.create(nombre='Audiencia grande', plantilla=plantilla)
+    Relacion = Campana.destinatarios.through
+    for inicio in range(0, destinatarios, BLOQUE):
+        fin = min(inicio + BLOQUE, destinatarios)
+        with transaction.atomic():
+            Estudiante.objects.bulk_create(
+                [Estudiante(id=i + 1, nombre=f'Estudiante {i}', telefono=f'57{i:010d}') for i in range(inicio, fin)],
+                batch_size=1000,
+            )
+            Relacion.objects.bulk_create(
+                [Relacion(campana_id=campana.pk, estudiante_id=i + 1) for i in range(inicio, fin)],
+                batch_size=1000,
+            )
+        print(f"\r   {fin}/{destinatarios} destinatarios creados", end='', flush=True)
+    print()
+    return campana.pk
+
+
+def medir(modo: str, campana_id: int):
+    """Corre en el proceso hijo: imprime un JSON con el RSS base, el pico y la duración."""
+    connection.settings_dict['NAME'] = RUTA_DB
+    campana = Campana.objects.get(pk=campana_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {MensajeSaliente._meta.db_table} WHERE campana_id = %s', [campana_id])
+    base = rss_pico_mb()
+
+    inicio = time.perf_counter()
+    encolados = encolar_campana(campana) if modo == 'paginado' else encolar_en_memoria(campana)
+    duracion = time.perf_counter() - inicio
+
+    print(json.dumps({'base_mb': base, 'pico_mb': rss_pico_mb(), 'segundos': duracion, 'encolados': encolados}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--destinatarios', type=int, default=1000000)
+    parser.add_argument('--medir', choices=('en_memoria', 'paginado'), help=argparse.SUPPRESS)
+    parser.add_argument('--campana', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        return medir(args.medir, args.campana)
+
+    if os.path.exists(RUTA_DB):
+        os.remove(RUTA_DB)
+    connection.settings_dict['NAME'] = RUTA_DB
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+    try:
+        print(f"📦 Creando {args.destinatarios} destinatarios en {os.path.basename(RUTA_DB)}...")
+        campana_id = poblar(args.destinatarios)
+        connection.close()
+
+        print(f"\n{'Método':<24} | {'Segundos':>9} | {'RSS base MB':>11} | {'RSS pico MB':>11} | {'Extra MB':>9}")
+        print('-' * 76)
+        for modo, titulo in (('en_memoria', 'audiencia completa'), ('paginado', 'páginas por id')):
+            salida = subprocess.run(
+                [sys.executable, __file__, '--medir', modo, '--campana', str(campana_id)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            datos = json.loads(salida.strip().splitlines()[-1])
+            assert datos['encolados'] == args.destinatarios, datos
+            print(f"{titulo:<24} | {datos['segundos']:>9.1f} | {datos['base_mb']:>11.0f} | "
+                  f"{datos['pico_mb']:>11.0f} | {datos['pico_mb'] - datos['base_mb']:>9.0f}")
+    finally:
+        connection.close()
+        if os.path.exists(RUTA_DB):
+            os.remove(RUTA_DB)
+
+
+if __name__ == '__main__':
+    main()
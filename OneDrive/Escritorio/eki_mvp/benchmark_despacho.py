@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark del despachador de campañas.
+Levanta un mock local de la Graph API (con latencia simulada) y mide mensajes/seg
+de `ejecutar_campana_servicio` con concurrencia 1, 8, 32 y 128.
+Usa una base de datos de prueba temporal: no toca db.sqlite3 ni la API real.
+
+python benchmark_despacho.py --mensajes 300 --latencia-ms 50
+"""
+import os
+import io
+import time
+import argparse
+import contextlib
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp_project.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core.models import Estudiante, Plantilla, Campana
+from core.services import ejecutar_campana_servicio
+from core.whatsapp_client import obtener_cliente
+from core import rate_limiter
+from core.mock_graph_api import MockGraphAPI, ConfigMock, DISTRIBUCIONES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mensajes', type=int, default=300, help='Destinatarios por corrida')
+    parser.add_argument('--latencia-ms', type=float, default=50, help='Latencia simulada de la API')
+    parser.add_argument('--distribucion', choices=DISTRIBUCIONES, default='fija', help='Distribución de la latencia')
+    parser.add_argument('--concurrencias', default='1,8,32,128')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='Mensajes/seg por línea (0 = sin límite: se mide solo el despachador)')
+    args = parser.parse_args()
+
+    mock = MockGraphAPI(ConfigMock(latencia_ms=args.latencia_ms, distribucion=args.distribucion)).iniciar()
+    settings.WHATSAPP_API_URL = mock.url
+    settings.WHATSAPP_TOKEN = 'token-benchmark'
+    settings.WHATSAPP_PHONE_ID = '000000000000000'
+    # Con el WHATSAPP_RATE_LIMIT del entorno (80) las concurrencias altas medirían el limitador
+    settings.WHATSAPP_RATE_LIMIT = args.rate_limit
+
+    # BD de prueba en archivo (no en memoria) para que los hilos compartan la misma base con bloqueo normal
+    connection.settings_dict['TEST']['NAME'] = str(settings.BASE_DIR / 'benchmark_despacho.sqlite3')
+    setup_test_environment()
+    nombre_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        plantilla = Plantilla.objects.create(nombre_interno='Benchmark', cuerpo_mensaje='Hola {nombre}, esto es una prueba.')
+        Estudiante.objects.bulk_create([
+            Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}') for i in range(args.mensajes)
+        ])
+        estudiantes = list(Estudiante.objects.all())
+
+        limite = f"{args.rate_limit:.0f} msg/s" if args.rate_limit else "sin rate limit"
+        print(f"📊 {args.mensajes} mensajes por corrida, latencia simulada {args.latencia_ms:.0f} ms "
+              f"({args.distribucion}), {limite}\n")
+        print(f"{'Concurrencia':>12} | {'Segundos':>9} | {'Mensajes/seg':>12} | Exitosos")
+        print('-' * 52)
+        for concurrencia in [int(c) for c in args.concurrencias.split(',')]:
+            campana = Campana.objects.create(nombre=f'Benchmark x{concurrencia}', plantilla=plantilla)
+            campana.destinatarios.set(estudiantes)
+
+            inicio = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                resultados = ejecutar_campana_servicio(campana, concurrencia=concurrencia)
+            duracion = time.perf_counter() - inicio
+
+            print(f"{concurrencia:>12} | {duracion:>9.2f} | {resultados['procesados'] / duracion:>12.1f} | "
+                  f"{resultados['exitosos']}/{resultados['total']}")
+
+        for phone_id, stats in obtener_cliente().estadisticas().items():
+            print(f"\n🔌 Conexiones ({phone_id}): {stats['peticiones']} peticiones, "
+                  f"{stats['conexiones']} conexiones abiertas, {stats['reutilizadas']} reutilizadas")
+            if args.rate_limit:
+                frenado = rate_limiter.metricas(f'whatsapp:{phone_id}')['proceso']
+                print(f"⏱️  Rate limit ({limite}): {frenado['esperas']} envíos frenados, "
+                      f"{frenado['segundos_esperando']:.1f} s en espera acumulada")
+    finally:
+        connection.creation.destroy_test_db(nombre_db, verbosity=0)
+        teardown_test_environment()
+        mock.detener()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Benchmark de la ingesta de estados de entrega (recibos sent/delivered/read).
+Tras una campaña Meta manda tres recibos por mensaje, cada uno en su propio POST
+y no siempre en orden. Compara recibos/seg aplicando un UPDATE por recibo (como
+antes) contra el consumidor de la cola (procesar_eventos), que junta los recibos
+del lote y los aplica con un UPDATE por cada TAMANO_LOTE_ESTADOS mensajes, y
+cuenta los mensajes que terminan en un estado distinto de "read" porque un
+recibo atrasado lo hizo retroceder.
+Usa una base de datos de prueba temporal: no toca db.sqlite3.
+
+python benchmark_estados.py --mensajes 5000 --desorden 0.1 --lotes 50,500
+"""
+import os
+import io
+import json
+import time
+import random
+import argparse
+import contextlib
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp_project.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core.models import WhatsappLog, WebhookEvento
+from core.webhook import reclamar_eventos, procesar_eventos
+
+
+def recibos(mensajes: int, desorden: float) -> list:
+    """(mensaje_id, estado) de sent/delivered/read de cada mensaje; una fracción `desorden` llega con el read antes del delivered."""
+    lista = []
+    for i in range(mensajes):
+        orden = ['sent', 'delivered', 'read']
+        if random.random() < desorden:
+            orden = ['sent', 'read', 'delivered']
+        # Los recibos de distintos mensajes se intercalan; los de cada mensaje conservan su orden
+        lista.extend((i + paso * 20 + random.random() * 10, f'wamid.bench{i}', estado) for paso, estado in enumerate(orden))
+    return [(mensaje_id, estado) for _, mensaje_id, estado in sorted(lista)]
+
+
+def preparar(mensajes: int):
+    WhatsappLog.objects.all().delete()
+    WebhookEvento.objects.all().delete()
+    WhatsappLog.objects.bulk_create([
+        WhatsappLog(telefono=f'57300{i:07d}', mensaje='Hola', mensaje_id=f'wamid.bench{i}', estado='SENT')
+        for i in range(mensajes)
+    ], batch_size=1000)
+
+
+def no_leidos() -> int:
+    return WhatsappLog.objects.exclude(estado='read').count()
+
+
+def por_recibo(lista: list) -> float:
+    inicio = time.perf_counter()
+    for mensaje_id, estado in lista:
+        WhatsappLog.objects.filter(mensaje_id=mensaje_id).update(estado=estado)
+    return time.perf_counter() - inicio
+
+
+def por_lotes(lista: list, tamano: int, hilos: int) -> float:
+    WebhookEvento.objects.bulk_create([
+        WebhookEvento(cuerpo=json.dumps({'entry': [{'changes': [{'value': {
+            'statuses': [{'id': mensaje_id, 'status': estado}]}}]}]}))
+        for mensaje_id, estado in lista
+    ], batch_size=1000)
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while eventos := reclamar_eventos(tamano=tamano):
+            procesar_eventos(eventos, hilos)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mensajes', type=int, default=5000, help='Mensajes enviados (3 recibos cada uno)')
+    parser.add_argument('--desorden', type=float, default=0.1, help='Fracción de mensajes con el read antes del delivered')
+    parser.add_argument('--lotes', default='50,500', help='Eventos reclamados por lote en el consumidor')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos del consumidor de la cola')
+    args = parser.parse_args()
+
+    random.seed(7)
+    lista = recibos(args.mensajes, args.desorden)
+
+    # BD de prueba en archivo (no en memoria) para que los hilos compartan la misma base con bloqueo normal
+    connection.settings_dict['TEST']['NAME'] = str(settings.BASE_DIR / 'benchmark_estados.sqlite3')
+    setup_test_environment()
+    nombre_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        print(f"📊 {len(lista)} recibos de {args.mensajes} mensajes ({args.desorden:.0%} con el read antes del delivered)\n")
+        print(f"{'Modo':<22} | {'Segundos':>9} | {'Recibos/seg':>11} | Sin read")
+        print('-' * 60)
+
+        preparar(args.mensajes)
+        segundos = por_recibo(lista)
+        print(f"{'UPDATE por recibo':<22} | {segundos:>9.2f} | {len(lista) / segundos:>11.0f} | {no_leidos()}")
+
+        for tamano in [int(t) for t in args.lotes.split(',')]:
+            preparar(args.mensajes)
+            segundos = por_lotes(lista, tamano, args.hilos)
+            modo = f'cola, lote de {tamano}'
+            print(f"{modo:<22} | {segundos:>9.2f} | {len(lista) / segundos:>11.0f} | {no_leidos()}")
+    finally:
+        connection.creation.destroy_test_db(nombre_db, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    main()
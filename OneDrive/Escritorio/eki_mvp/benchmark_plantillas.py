@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark del motor de plantillas (core/plantillas.py).
+Compara el `str.replace("{nombre}", ...)` por destinatario que se usaba antes
+con la plantilla compilada renderizada en lote. No usa la base de datos.
+
+python benchmark_plantillas.py --destinatarios 100000
+"""
+import os
+import time
+import argparse
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp_project.settings')
+django.setup()
+
+from core.models import Estudiante, Plantilla
+from core.plantillas import compilar
+
+
+def medir(funcion, repeticiones: int) -> float:
+    """Mejor tiempo (segundos) de `repeticiones` corridas."""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--destinatarios', type=int, default=100000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    estudiantes = [
+        Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}', email=f'e{i}@prueba.local',
+                   datos_extra={'curso': f'Curso {i % 7}'})
+        for i in range(args.destinatarios)
+    ]
+    casos = [
+        ('Solo {nombre}', 'Hola {nombre}, recuerda tu clase de hoy.'),
+        ('Varios campos', 'Hola {primer_nombre}, tu curso {curso} empieza hoy. Dudas: {email|sin correo}'),
+    ]
+
+    print(f"📊 {args.destinatarios} destinatarios, mejor de {args.repeticiones} corridas\n")
+    print(f"{'Plantilla':<15} | {'Método':<22} | {'ms':>8} | {'Mensajes/ms':>11}")
+    print('-' * 66)
+    for titulo, cuerpo in casos:
+        plantilla = Plantilla(pk=1, nombre_interno=titulo, cuerpo_mensaje=cuerpo)
+
+        if cuerpo.count('{') == 1:
+            # Lo que hacía procesar_lote antes: un replace por destinatario
+            antes = medir(lambda: [cuerpo.replace("{nombre}", e.nombre) for e in estudiantes], args.repeticiones)
+        else:
+            # El mismo enfoque extendido a varios campos: un replace por campo y destinatario
+            antes = medir(lambda: [
+                cuerpo.replace("{primer_nombre}", e.nombre.split(' ', 1)[0])
+                .replace("{curso}", e.datos_extra.get('curso', ''))
+                .replace("{email|sin correo}", e.email or 'sin correo')
+                for e in estudiantes
+            ], args.repeticiones)
+        print(f"{titulo:<15} | {'replace por mensaje':<22} | {antes * 1000:>8.1f} | "
+              f"{args.destinatarios / (antes * 1000):>11.0f}")
+
+        compilacion = medir(lambda: compilar(Plantilla(pk=None, cuerpo_mensaje=cuerpo)), args.repeticiones)
+        compilada = compilar(plantilla)
+        uno_a_uno = medir(lambda: [compilada.renderizar(e) for e in estudiantes], args.repeticiones)
+        lote = medir(lambda: compilada.renderizar_lote(estudiantes), args.repeticiones)
+        print(f"{titulo:<15} | {'compilada, uno a uno':<22} | {uno_a_uno * 1000:>8.1f} | "
+              f"{args.destinatarios / (uno_a_uno * 1000):>11.0f}")
+        print(f"{titulo:<15} | {'compilada, en lote':<22} | {lote * 1000:>8.1f} | "
+              f"{args.destinatarios / (lote * 1000):>11.0f}")
+        print(f"{'':<15} | {'(compilar una vez)':<22} | {compilacion * 1000:>8.3f} |")
+        print(f"\n   Ejemplo: {compilada.renderizar(estudiantes[1])!r}\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Benchmark del webhook de WhatsApp bajo una ráfaga de mensajes entrantes.
+Levanta gunicorn (como en el Procfile) sobre una base de prueba temporal y
+reproduce N POSTs a /webhook/whatsapp/ desde varios clientes HTTP a la vez.
+Mide la latencia de respuesta (p50/p95/p99) procesando dentro de la petición
+(WEBHOOK_EN_LINEA) y con la cola de eventos (WebhookEvento), y cuánto tarda
+el consumidor (procesar_webhooks) en vaciar la cola. Las respuestas del bot
+van a un mock local de la Graph API.
+
+python benchmark_webhook.py --posts 1000 --clientes 16 --workers 4 --latencia-ms 150
+"""
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import contextlib
+import statistics
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mvp_project.settings')
+django.setup()
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from core.models import Estudiante, MensajeRecibido, WhatsappLog, WebhookEvento
+from core.webhook import reclamar_eventos, procesar_eventos
+from core.mock_graph_api import MockGraphAPI, ConfigMock, DISTRIBUCIONES
+
+RUTA_DB = str(settings.BASE_DIR / 'benchmark_webhook.sqlite3')
+ESTUDIANTES = 1000
+PHONE_ID = '000000000000000'
+
+
+def aplicacion_wsgi():
+    """La app que sirve gunicorn en el benchmark: Django sobre la base temporal."""
+    from django.core.wsgi import get_wsgi_application
+    connection.settings_dict['NAME'] = RUTA_DB
+    return get_wsgi_application()
+
+
+def payload_entrante(i: int) -> bytes:
+    return json.dumps({'entry': [{'changes': [{'value': {
+        'metadata': {'phone_number_id': PHONE_ID},
+        'messages': [{'from': f'57300{i % ESTUDIANTES:07d}', 'id': f'wamid.bench{i}',
+                      'text': {'body': '¿Cuál es mi progreso?'}}],
+        'statuses': [],
+    }}]}]}).encode()
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def servidor(workers: int, en_linea: bool, mock_url: str):
+    puerto = puerto_libre()
+    entorno = dict(os.environ, WEBHOOK_EN_LINEA=str(en_linea), WHATSAPP_API_URL=mock_url,
+                   WHATSAPP_TOKEN='token-benchmark', WHATSAPP_PHONE_ID=PHONE_ID)
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'benchmark_webhook:aplicacion_wsgi()', '--workers', str(workers), '--preload',
+         '--bind', f'127.0.0.1:{puerto}', '--log-level', 'warning'],
+        cwd=settings.BASE_DIR, env=entorno, stdout=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', puerto), timeout=0.1):
+                break
+            time.sleep(0.1)
+        yield puerto
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+
+def rafaga(puerto: int, posts: int, clientes: int) -> list:
+    """Envía `posts` POSTs desde `clientes` hilos y devuelve la latencia de cada uno en ms."""
+    def cliente(indices):
+        latencias = []
+        for i in indices:
+            inicio = time.perf_counter()
+            conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=60)
+            conexion.request('POST', '/webhook/whatsapp/', body=payload_entrante(i),
+                             headers={'Content-Type': 'application/json'})
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            conexion.close()
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            assert respuesta.status == 200, respuesta.status
+        return latencias
+
+    with ThreadPoolExecutor(max_workers=clientes) as pool:
+        partes = pool.map(cliente, [range(c, posts, clientes) for c in range(clientes)])
+        return [latencia for parte in partes for latencia in parte]
+
+
+def percentil(valores, p: int) -> float:
+    return statistics.quantiles(valores, n=100, method='inclusive')[p - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=1000, help='POSTs de la ráfaga')
+    parser.add_argument('--clientes', type=int, default=16, help='Conexiones simultáneas (como los reintentos de Meta)')
+    parser.add_argument('--workers', type=int, default=4, help='Workers de gunicorn')
+    parser.add_argument('--hilos', type=int, default=16, help='Hilos del consumidor de la cola')
+    parser.add_argument('--latencia-ms', type=float, default=150, help='Latencia simulada de la API')
+    parser.add_argument('--distribucion', choices=DISTRIBUCIONES, default='lognormal')
+    args = parser.parse_args()
+
+    mock = MockGraphAPI(ConfigMock(latencia_ms=args.latencia_ms, distribucion=args.distribucion)).iniciar()
+    settings.WHATSAPP_API_URL = mock.url
+    settings.WHATSAPP_TOKEN = 'token-benchmark'
+    settings.WHATSAPP_PHONE_ID = PHONE_ID
+
+    if os.path.exists(RUTA_DB):
+        os.remove(RUTA_DB)
+    connection.settings_dict['NAME'] = RUTA_DB
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+    try:
+        Estudiante.objects.bulk_create([
+            Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}') for i in range(ESTUDIANTES)
+        ])
+
+        print(f"📊 Ráfaga de {args.posts} POSTs desde {args.clientes} clientes contra gunicorn ({args.workers} workers), "
+              f"latencia simulada de la API {args.latencia_ms:.0f} ms ({args.distribucion})\n")
+        print(f"{'Modo':<18} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'Ráfaga s':>8} | Respuestas")
+        print('-' * 72)
+        for modo, en_linea in (('en la petición', True), ('cola de eventos', False)):
+            WhatsappLog.objects.all().delete()
+            WebhookEvento.objects.all().delete()
+            # Los dos modos reciben los mismos ids: que la deduplicación no descarte la segunda ráfaga
+            MensajeRecibido.objects.all().delete()
+            caches['webhook'].clear()
+            respuestas = mock.estadisticas().get('peticiones', 0)
+
+            with servidor(args.workers, en_linea, mock.url) as puerto:
+                inicio = time.perf_counter()
+                latencias = rafaga(puerto, args.posts, args.clientes)
+                duracion = time.perf_counter() - inicio
+
+            print(f"{modo:<18} | {statistics.median(latencias):>8.1f} | {percentil(latencias, 95):>8.1f} | "
+                  f"{percentil(latencias, 99):>8.1f} | {duracion:>8.2f} | "
+                  f"{mock.estadisticas().get('peticiones', 0) - respuestas}")
+
+        # Lo que la cola dejó pendiente lo vacía el consumidor (como `procesar_webhooks`)
+        respuestas = mock.estadisticas().get('peticiones', 0)
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            while eventos := reclamar_eventos(tamano=args.hilos * 2):
+                procesar_eventos(eventos, args.hilos)
+        drenado = time.perf_counter() - inicio
+        print(f"\n📨 Consumidor ({args.hilos} hilos): {WebhookEvento.objects.filter(estado='PROCESADO').count()} "
+              f"eventos en {drenado:.2f} s, {mock.estadisticas().get('peticiones', 0) - respuestas} respuestas enviadas")
+    finally:
+        connection.close()
+        mock.detener()
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(RUTA_DB + sufijo):
+                os.remove(RUTA_DB + sufijo)
+
+
+if __name__ == '__main__':
+    main()
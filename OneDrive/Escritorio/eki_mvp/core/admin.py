@@ -5,8 +5,15 @@ from django.shortcuts import render, redirect
 from django.urls import path
 import openpyxl
 from django.http import HttpResponse, JsonResponse
-from .models import Estudiante, Plantilla, Campana, EnvioLog, Linea, WhatsappLog
-from .services import ejecutar_campana_servicio
+from datetime import timedelta
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Estudiante, Plantilla, Campana, EnvioLog, Linea, WhatsappLog, MensajeSaliente, MediaWhatsapp, WebhookEvento
+from .services import encolar_campana, reencolar_agotados, pausar_campana, reanudar_envio, cancelar_campana
+from . import rate_limiter, progreso, contexto
+from .circuito import obtener_circuito, CERRADO, ABIERTO
+from .plantillas import renderizar as renderizar_plantilla
 
 # =================================================
 # 1. ACCIÓN: EXPORTAR A EXCEL (Estilo Andrés)
@@ -129,8 +136,8 @@ def importar_estudiantes_desde_logs(modeladmin, request, queryset):
 
 @admin.register(Estudiante)
 class EstudianteAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'telefono', 'activo', 'fecha_registro')
-    search_fields = ('nombre', 'telefono')
+    list_display = ('nombre', 'telefono', 'email', 'activo', 'fecha_registro')
+    search_fields = ('nombre', 'telefono', 'email')
     list_per_page = 20
     actions = ['exportar_estudiantes_excel']
     
@@ -275,7 +282,9 @@ class PlantillaAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Información Básica', {
-            'fields': ('nombre_interno', 'cuerpo_mensaje')
+            'fields': ('nombre_interno', 'cuerpo_mensaje'),
+            'description': 'Marcadores: {nombre}, {primer_nombre}, {telefono}, {email} y las columnas extra del Excel '
+                           '(p.ej. {curso}). Valor por defecto: {curso|sin asignar}. Llaves literales: {{ }}.'
         }),
         ('Configuración de Imagen', {
             'fields': ('tiene_imagen', 'url_imagen'),
@@ -296,18 +305,36 @@ class PlantillaAdmin(admin.ModelAdmin):
         return "-"
     preview_imagen.short_description = "URL Imagen"
 
+def texto_progreso(datos) -> str:
+    texto = f"{datos['enviados'] + datos['fallidos']}/{datos['encolados']} ({datos['porcentaje']}%)"
+    if datos['fallidos']:
+        texto += f" · {datos['fallidos']} fallidos"
+    if datos['reintentando']:
+        texto += f" · {datos['reintentando']} en reintento"
+    if datos['mensajes_por_segundo']:
+        texto += f" · {datos['mensajes_por_segundo']} msg/s"
+    if datos['eta_segundos'] is not None:
+        minutos, segundos = divmod(datos['eta_segundos'], 60)
+        texto += f" · ETA {minutos}m {segundos:02d}s"
+    return texto
+
+
 @admin.register(Campana)
 class CampanaAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'estado_visual', 'conteo_destinatarios', 'fecha_creacion')
-    list_filter = ('ejecutada', 'fecha_creacion')
+    list_display = ('nombre', 'estado_visual', 'progreso_visual', 'conteo_destinatarios', 'fecha_creacion')
+    list_filter = ('estado', 'fecha_creacion')
     search_fields = ('nombre',)
-    filter_horizontal = ('destinatarios',)
+    filter_horizontal = ('destinatarios', 'lineas')
     
     # Configuramos para que el formulario de crear sea limpio
     fieldsets = (
         ('📝 Datos Básicos', {
             'fields': ('nombre', 'plantilla', 'canal_envio', 'linea_origen')
         }),
+        ('📱 Reparto entre líneas (Opcional)', {
+            'fields': ('lineas',),
+            'description': 'Con varias líneas, los destinatarios se reparten según los mensajes/seg de cada una.'
+        }),
         ('📂 Importar (Opcional)', {
             'fields': ('archivo_excel',),
             'description': 'Sube un Excel con columnas A (Nombre) y B (Teléfono).'
@@ -315,10 +342,24 @@ class CampanaAdmin(admin.ModelAdmin):
         ('👥 Audiencia', {
             'fields': ('destinatarios',)
         }),
+        ('⏰ Programación', {
+            'fields': ('fecha_programada',),
+            'description': 'Déjalo vacío para enviar a mano. Con fecha, el programador (programador_campanas) la lanza solo.'
+        }),
+        ('🕗 Ritmo de envío (Opcional)', {
+            'fields': (('ventana_inicio', 'ventana_fin'), 'duracion_objetivo'),
+            'description': 'Envía solo dentro del horario y reparte los mensajes de forma pareja en la duración indicada; '
+                           'lo que no alcance a salir en el día sigue en la ventana del día siguiente.'
+        }),
+        ('🏁 Resultado', {
+            'fields': ('estado', 'fecha_finalizacion', 'resumen_visual'),
+            'description': 'Lo escribe el último worker al terminar la campaña.'
+        }),
     )
+    readonly_fields = ('estado', 'fecha_finalizacion', 'resumen_visual')
 
-    # Botón para enviar desde la lista
-    actions = ['enviar_campana_accion']
+    # Botones para enviar, pausar, reanudar o cancelar desde la lista
+    actions = ['enviar_campana_accion', 'pausar_campana_accion', 'reanudar_campana_accion', 'cancelar_campana_accion']
 
     @admin.action(description='🚀 Ejecutar Campaña (Enviar Mensajes)')
     def enviar_campana_accion(self, request, queryset):
@@ -326,20 +367,82 @@ class CampanaAdmin(admin.ModelAdmin):
             if campana.ejecutada:
                 self.message_user(request, f"⚠️ '{campana.nombre}' ya fue enviada antes.", level=messages.WARNING)
                 continue
+            if campana.estado in ('PAUSADA', 'CANCELADA'):
+                self.message_user(request, f"⚠️ '{campana.nombre}' está {campana.get_estado_display().lower()}.", level=messages.WARNING)
+                continue
             
-            res = ejecutar_campana_servicio(campana)
-            self.message_user(request, f"✅ '{campana.nombre}': {res['exitosos']} enviados, {res['fallidos']} errores.", level=messages.SUCCESS)
+            # Solo encolamos: el comando `procesar_envios` hace el envío fuera de la petición HTTP
+            encolados = encolar_campana(campana)
+            self.message_user(request, f"📬 '{campana.nombre}': {encolados} mensajes en cola de envío.", level=messages.SUCCESS)
+
+    @admin.action(description='⏸️ Pausar envío')
+    def pausar_campana_accion(self, request, queryset):
+        pausadas = [campana.nombre for campana in queryset if pausar_campana(campana.pk)]
+        if pausadas:
+            self.message_user(request, f"⏸️ Pausadas: {', '.join(pausadas)}. Los lotes en curso terminan; el resto espera en la bandeja.", level=messages.SUCCESS)
+        else:
+            self.message_user(request, "⚠️ Ninguna de las campañas estaba en curso.", level=messages.WARNING)
+
+    @admin.action(description='▶️ Reanudar envío')
+    def reanudar_campana_accion(self, request, queryset):
+        reanudadas = [campana.nombre for campana in queryset if reanudar_envio(campana.pk)]
+        if reanudadas:
+            self.message_user(request, f"▶️ Reanudadas: {', '.join(reanudadas)}.", level=messages.SUCCESS)
+        else:
+            self.message_user(request, "⚠️ Ninguna de las campañas estaba pausada.", level=messages.WARNING)
+
+    @admin.action(description='🚫 Cancelar envío')
+    def cancelar_campana_accion(self, request, queryset):
+        for campana in queryset:
+            if campana.estado in ('CANCELADA', 'COMPLETADA'):
+                self.message_user(request, f"⚠️ '{campana.nombre}' ya está {campana.get_estado_display().lower()}.", level=messages.WARNING)
+                continue
+            cancelados = cancelar_campana(campana.pk)
+            self.message_user(request, f"🚫 '{campana.nombre}' cancelada: {cancelados} mensajes no se enviarán.", level=messages.SUCCESS)
 
     def estado_visual(self, obj):
-        if obj.ejecutada:
-            return format_html('<span style="color: green;">✅ Ejecutada</span>')
-        return format_html('<span style="color: orange;">⏳ Pendiente</span>')
+        estilos = {
+            'BORRADOR': ('orange', '⏳ Pendiente'),
+            'EN_CURSO': ('#007bff', '📬 En curso'),
+            'PAUSADA': ('#6c757d', '⏸️ Pausada'),
+            'CANCELADA': ('red', '🚫 Cancelada'),
+            'COMPLETADA': ('green', '✅ Ejecutada'),
+        }
+        color, texto = estilos[obj.estado]
+        return format_html('<span style="color: {};">{}</span>', color, texto)
     estado_visual.short_description = "Estado"
-    
+
+    def progreso_visual(self, obj):
+        # Solo lee el cache (core.progreso); el template change_list lo refresca mientras haya pendientes
+        datos = progreso.obtener(obj.pk)
+        if not datos['disponible']:
+            return "-"
+        return format_html(
+            '<div class="eki-progreso" data-campana="{}" data-activa="{}">'
+            '<div style="background:#e9ecef;width:160px;height:10px;border-radius:5px;overflow:hidden;">'
+            '<div class="eki-barra" style="background:#28a745;height:100%;width:{}%;"></div></div>'
+            '<small class="eki-texto">{}</small></div>',
+            obj.pk, 1 if datos['pendientes'] else 0, datos['porcentaje'], texto_progreso(datos)
+        )
+    progreso_visual.short_description = "Progreso"
+
     def conteo_destinatarios(self, obj):
         return obj.destinatarios.count()
     conteo_destinatarios.short_description = "# Destinatarios"
 
+    def resumen_visual(self, obj):
+        r = obj.resumen
+        if not r:
+            return "-"
+        lineas = ', '.join(f"{nombre}: {n}" for nombre, n in r['por_linea'].items()) or '-'
+        return format_html(
+            '✅ {} enviados · ❌ {} fallidos · ⏳ {} agotados · 🚫 {} cancelados de {}<br>'
+            '{} intentos · {} ms de latencia media · {} s ({} msg/s)<br>Por línea: {}',
+            r['enviados'], r['fallidos'], r['agotados'], r.get('cancelados', 0), r['total'],
+            r['intentos'], r['latencia_media_ms'], r['duracion_seg'], r['mensajes_por_segundo'] or '-', lineas,
+        )
+    resumen_visual.short_description = "Resumen"
+
 
 # ESTA ES LA TABLA QUE SE PARECE A LA IMAGEN
 @admin.register(EnvioLog)
@@ -348,16 +451,17 @@ class EnvioLogAdmin(admin.ModelAdmin):
     list_display = ('id', 'estudiante_nombre', 'estado_color', 'fecha_envio', 'nombre_plantilla', 'detalle_mensaje')
     
     # Filtros laterales (Simulan los tabs y fechas)
-    list_filter = ('estado', 'fecha_envio', 'campana__nombre')
+    list_filter = ('estado', 'fecha_envio', 'campana__nombre', 'linea')
     
     # Buscador general
     search_fields = ('estudiante__nombre', 'estudiante__telefono', 'campana__nombre')
+    list_select_related = ('estudiante', 'campana__plantilla')
     
     # Botones de exportar e importar
     actions = [exportar_logs_excel, importar_estudiantes_desde_logs]
     
     # Solo lectura (historial no se debe editar)
-    readonly_fields = ('campana', 'estudiante', 'estado', 'respuesta_api', 'fecha_envio')
+    readonly_fields = ('campana', 'estudiante', 'linea', 'estado', 'respuesta_api', 'fecha_envio')
 
     def estudiante_nombre(self, obj):
         return f"{obj.estudiante.nombre} ({obj.estudiante.telefono})"
@@ -369,7 +473,7 @@ class EnvioLogAdmin(admin.ModelAdmin):
 
     def detalle_mensaje(self, obj):
         # Mostramos el inicio del mensaje
-        msg = obj.campana.plantilla.cuerpo_mensaje.replace("{nombre}", obj.estudiante.nombre)
+        msg = renderizar_plantilla(obj.campana.plantilla, obj.estudiante)
         return msg[:40] + "..."
     detalle_mensaje.short_description = "Detalle"
 
@@ -381,6 +485,128 @@ class EnvioLogAdmin(admin.ModelAdmin):
         return obj.estado
     estado_color.short_description = "Estado"
 
+    # Borrar envíos cambia el progreso que el bot responde (core/contexto.py)
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        contexto.invalidar_estudiantes([obj.estudiante_id])
+
+    def delete_queryset(self, request, queryset):
+        estudiantes = list(queryset.values_list('estudiante_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        contexto.invalidar_estudiantes(estudiantes)
+
+
+# BANDEJA DE SALIDA (mensajes de campaña en cola)
+@admin.register(MensajeSaliente)
+class MensajeSalienteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'campana', 'estudiante', 'linea', 'estado', 'intentos', 'latencia_ms', 'proximo_intento', 'ultimo_error')
+    list_filter = ('estado', 'campana__nombre', 'linea')
+    search_fields = ('estudiante__nombre', 'estudiante__telefono', 'campana__nombre')
+    list_select_related = ('campana', 'estudiante', 'linea')
+    readonly_fields = ('campana', 'estudiante', 'linea', 'estado', 'intentos', 'proximo_intento', 'ultimo_error', 'latencia_ms',
+                       'particion', 'lote', 'reclamado_en', 'lease_hasta', 'fecha_creacion', 'fecha_actualizacion')
+    actions = ['reintentar_mensajes']
+
+    @admin.action(description='♻️ Reintentar mensajes agotados/fallidos')
+    def reintentar_mensajes(self, request, queryset):
+        reencolados = reencolar_agotados(queryset.filter(estado__in=['AGOTADO', 'FALLIDO']))
+        self.message_user(request, f"♻️ {reencolados} mensajes devueltos a la cola de envío.", level=messages.SUCCESS)
+
+
+# LÍNEAS DE ENVÍO con su rendimiento
+@admin.register(Linea)
+class LineaAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'numero', 'phone_id', 'mensajes_por_segundo', 'activa',
+                    'enviados', 'fallidos', 'tasa_error', 'ritmo_ultima_hora', 'en_cola', 'frenados_rate_limit',
+                    'espera_respuestas', 'estado_circuito')
+    list_editable = ('mensajes_por_segundo', 'activa')
+    search_fields = ('nombre', 'numero', 'phone_id')
+
+    fieldsets = (
+        ('📱 Línea', {
+            'fields': ('nombre', 'numero', 'activa')
+        }),
+        ('🔑 Credenciales Cloud API', {
+            'fields': ('phone_id', 'token'),
+            'description': 'Vacías = se usan WHATSAPP_PHONE_ID / WHATSAPP_TOKEN del servidor.'
+        }),
+        ('⚡ Capacidad', {
+            'fields': ('mensajes_por_segundo',)
+        }),
+    )
+
+    def get_queryset(self, request):
+        # Conteos en una sola consulta (un JOIN con EnvioLog) en lugar de uno por fila
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        return super().get_queryset(request).annotate(
+            n_enviados=Count('enviolog', filter=Q(enviolog__estado='ENVIADO')),
+            n_fallidos=Count('enviolog', filter=Q(enviolog__estado='FALLIDO')),
+            n_ultima_hora=Count('enviolog', filter=Q(enviolog__estado='ENVIADO', enviolog__fecha_envio__gte=hace_una_hora)),
+            # Subconsulta y no otro JOIN: multiplicaría las filas de EnvioLog y con ellas los conteos
+            n_en_cola=Coalesce(Subquery(
+                MensajeSaliente.objects.filter(linea=OuterRef('pk'), estado__in=['PENDIENTE', 'PROCESANDO'])
+                .values('linea').annotate(n=Count('id')).values('n')
+            ), 0),
+        )
+
+    def enviados(self, obj):
+        return obj.n_enviados
+    enviados.short_description = "Enviados"
+    enviados.admin_order_field = 'n_enviados'
+
+    def fallidos(self, obj):
+        return obj.n_fallidos
+    fallidos.short_description = "Fallidos"
+    fallidos.admin_order_field = 'n_fallidos'
+
+    def tasa_error(self, obj):
+        total = obj.n_enviados + obj.n_fallidos
+        if not total:
+            return "—"
+        porcentaje = obj.n_fallidos * 100 / total
+        color = 'red' if porcentaje >= 5 else 'green'
+        return format_html('<b style="color:{};">{}%</b>', color, f"{porcentaje:.1f}")
+    tasa_error.short_description = "% Error"
+
+    def ritmo_ultima_hora(self, obj):
+        return f"{obj.n_ultima_hora / 60:.1f} msg/min"
+    ritmo_ultima_hora.short_description = "Ritmo (última hora)"
+
+    def en_cola(self, obj):
+        return obj.n_en_cola
+    en_cola.short_description = "En cola"
+    en_cola.admin_order_field = 'n_en_cola'
+
+    def frenados_rate_limit(self, obj):
+        phone_id, _ = obj.credenciales()
+        return rate_limiter.metricas(f'whatsapp:{phone_id}')['global']['esperas']
+    frenados_rate_limit.short_description = "Frenados (rate limit)"
+
+    def espera_respuestas(self, obj):
+        phone_id, _ = obj.credenciales()
+        espera = rate_limiter.metricas(f'whatsapp:{phone_id}')['global']['espera_respuestas_ms']
+        return f"{espera:.0f} ms"
+    espera_respuestas.short_description = "Espera respuestas (prom.)"
+
+    def estado_circuito(self, obj):
+        circuito = obtener_circuito(obj.credenciales()[0])
+        estado = circuito.estado()
+        if estado == CERRADO:
+            return format_html('<span style="color: green;">🟢 Cerrado</span>')
+        if estado == ABIERTO:
+            return format_html('<span style="color: red;">🔴 Abierto ({}s)</span>', int(circuito.reanudar_en()))
+        return format_html('<span style="color: orange;">🟡 Probando</span>')
+    estado_circuito.short_description = "Circuito API"
+
+
+# IMÁGENES YA SUBIDAS A WHATSAPP (se reutilizan por media id)
+@admin.register(MediaWhatsapp)
+class MediaWhatsappAdmin(admin.ModelAdmin):
+    list_display = ('url', 'phone_id', 'media_id', 'mime_type', 'tamano_bytes', 'subido_en', 'expira')
+    list_filter = ('phone_id',)
+    search_fields = ('url', 'media_id')
+    readonly_fields = ('url', 'hash_contenido', 'phone_id', 'media_id', 'mime_type', 'tamano_bytes', 'subido_en', 'expira')
+
 
 # TABLA DE LOGS DE WHATSAPP
 @admin.register(WhatsappLog)
@@ -446,3 +672,20 @@ class WhatsappLogAdmin(admin.ModelAdmin):
     def get_ordering(self, request):
         # Ordenar por fecha descendente por defecto
         return ['-fecha']
+
+
+# EVENTOS DEL WEBHOOK (cola que procesa `procesar_webhooks`)
+@admin.register(WebhookEvento)
+class WebhookEventoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'estado', 'recibido_en', 'procesado_en', 'error')
+    list_filter = ('estado', 'recibido_en')
+    readonly_fields = ('cuerpo', 'estado', 'lote', 'reclamado_en', 'error', 'recibido_en', 'procesado_en')
+    actions = ['reprocesar_eventos']
+
+    @admin.action(description='♻️ Reprocesar eventos con error')
+    def reprocesar_eventos(self, request, queryset):
+        reencolados = queryset.filter(estado='ERROR').update(estado='PENDIENTE', lote=None, error=None)
+        self.message_user(request, f"♻️ {reencolados} eventos devueltos a la cola del webhook.", level=messages.SUCCESS)
+
+    def get_ordering(self, request):
+        return ['-id']
@@ -4,11 +4,14 @@ Endpoints:
 - GET /api/estudiante/{telefono}/ → datos del estudiante
 - GET /api/estudiante/{telefono}/progreso/ → progreso detallado
 - GET /api/estudiante/{telefono}/siguiente-tarea/ → siguiente tarea
+- GET /api/campanas/progreso/?ids=1,2 → progreso en vivo de campañas (staff)
 """
 from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from .models import Estudiante, Campana, EnvioLog
+from . import progreso
 
 
 @csrf_exempt
@@ -149,3 +152,25 @@ def api_estudiante_siguiente_tarea(request, telefono):
             'success': False,
             'error': str(e)
         }, status=500)
+
+
+@staff_member_required
+@require_http_methods(["GET"])
+def api_campanas_progreso(request):
+    """
+    GET /api/campanas/progreso/?ids=1,2,3
+    Progreso en vivo de las campañas (encolados, enviados, fallidos, reintentando,
+    mensajes/seg, ETA). Se lee del cache; solo consulta la base si los contadores
+    de una campaña no están en él.
+    """
+    try:
+        ids = [int(i) for i in request.GET.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'El parámetro ids debe ser una lista de números separados por coma'
+        }, status=400)
+    return JsonResponse({
+        'success': True,
+        'campanas': {campana_id: progreso.obtener(campana_id) for campana_id in ids[:200]}
+    })
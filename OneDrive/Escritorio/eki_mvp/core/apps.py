@@ -1,6 +1,19 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from .checks import revisar_cache_compartido
+
+        # Los comandos de manage.py se niegan a arrancar con un error de chequeo;
+        # gunicorn no corre los chequeos, así que al menos queda en el log
+        for problema in revisar_cache_compartido(None):
+            if problema.is_serious():
+                logger.error("%s %s", problema.msg, problema.hint)
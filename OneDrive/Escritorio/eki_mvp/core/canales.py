@@ -0,0 +1,308 @@
+"""
+Canales de envío de campañas (Campana.canal_envio).
+Cada canal recibe una tanda de (mensaje, texto) y produce (mensaje, resultado, error)
+con el mismo formato de resultado que `enviar_whatsapp`, así que los reintentos
+y los registros (EnvioLog) no dependen del canal. Cada backend agrupa los envíos
+como le conviene a su proveedor:
+
+- WhatsApp y voz: una petición HTTP por mensaje, en paralelo (las imágenes de
+  WhatsApp se suben una vez y se envían por media id, ver core.media)
+- Email: una conexión SMTP reutilizada para todo un grupo de correos
+- SMS: el endpoint masivo del proveedor, un grupo de mensajes por petición
+
+El backend de cada canal se elige en settings.CANALES_ENVIO.
+"""
+import time
+import smtplib
+import threading
+from email.utils import make_msgid
+from itertools import zip_longest
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils.module_loading import import_string
+
+from .dispatcher import despachar
+from .utils import enviar_whatsapp, credenciales_whatsapp
+from .media import obtener_media_id
+from .whatsapp_client import obtener_cliente
+from .rate_limiter import MASIVA
+
+CANAL_POR_DEFECTO = 'whatsapp'
+
+
+def _en_grupos(envios, tamano):
+    return [envios[i:i + tamano] for i in range(0, len(envios), max(1, tamano))]
+
+
+def _milisegundos(inicio):
+    return int((time.perf_counter() - inicio) * 1000)
+
+
+class Canal:
+    """
+    Interfaz de un backend de envío.
+
+    Las subclases implementan `enviar_lote`. `reintentable` en el resultado
+    (opcional) fuerza la clasificación del error cuando el canal conoce mejor
+    su protocolo que los códigos HTTP (p.ej. respuestas SMTP 4xx/5xx).
+    """
+    nombre = None
+
+    def concurrencia(self) -> int:
+        return getattr(settings, 'CANAL_CONCURRENCIA', {}).get(self.nombre, 1)
+
+    def enviar_lote(self, envios, buffer=None, concurrencia: int = None):
+        """
+        Args:
+            envios: lista de (MensajeSaliente, texto personalizado)
+            buffer: BufferLogs para los registros propios del canal (opcional)
+            concurrencia: envíos en paralelo (por defecto la del canal)
+
+        Produce (mensaje, resultado, error) en orden de finalización.
+        """
+        raise NotImplementedError
+
+
+class CanalWhatsapp(Canal):
+    nombre = 'whatsapp'
+
+    def enviar_lote(self, envios, buffer=None, concurrencia=None):
+        concurrencia = concurrencia or self.concurrencia()
+        if concurrencia > 1:
+            # Una conexión keep-alive por hilo: el pool debe ser al menos tan grande como la concurrencia
+            obtener_cliente().ajustar_pool(concurrencia)
+
+        # Cada imagen se sube una vez por línea (core.media) y se envía por media id
+        medias = {}
+        for mensaje, _ in envios:
+            url_imagen = self._url_imagen(mensaje)
+            if url_imagen:
+                phone_id, token = credenciales_whatsapp(mensaje.linea)
+                if phone_id and token and (url_imagen, phone_id) not in medias:
+                    medias[(url_imagen, phone_id)] = obtener_media_id(url_imagen, phone_id, token)
+
+        def enviar(envio):
+            mensaje, texto = envio
+            url_imagen = self._url_imagen(mensaje)
+            media_id = medias.get((url_imagen, credenciales_whatsapp(mensaje.linea)[0])) if url_imagen else None
+            inicio = time.perf_counter()
+            resultado = enviar_whatsapp(
+                telefono=mensaje.estudiante.telefono,
+                texto=texto,
+                url_imagen=url_imagen,
+                buffer_logs=buffer,
+                linea=mensaje.linea,
+                media_id=media_id,
+                prioridad=MASIVA
+            )
+            resultado['latencia_ms'] = _milisegundos(inicio)
+            return resultado
+
+        for (mensaje, _), resultado, error in despachar(envios, enviar, concurrencia):
+            yield mensaje, resultado, error
+
+    @staticmethod
+    def _url_imagen(mensaje):
+        plantilla = mensaje.campana.plantilla
+        return plantilla.url_imagen if plantilla.tiene_imagen and plantilla.url_imagen else None
+
+
+class CanalEmail(Canal):
+    """Correo por SMTP (settings EMAIL_*): abre una conexión por grupo de EMAIL_LOTE correos."""
+    nombre = 'email'
+
+    def enviar_lote(self, envios, buffer=None, concurrencia=None):
+        grupos = _en_grupos(envios, getattr(settings, 'EMAIL_LOTE', 100))
+        for grupo, resultados, error in despachar(grupos, self._enviar_grupo, concurrencia or self.concurrencia()):
+            if error is not None:
+                # No se pudo abrir la conexión: todo el grupo queda para reintento
+                for mensaje, _ in grupo:
+                    yield mensaje, None, error
+            else:
+                yield from resultados
+
+    def _enviar_grupo(self, grupo):
+        resultados = []
+        conexion = get_connection(fail_silently=False)
+        conexion.open()
+        try:
+            for mensaje, texto in grupo:
+                resultados.append((mensaje, *self._enviar_correo(conexion, mensaje, texto)))
+        finally:
+            conexion.close()
+        return resultados
+
+    def _enviar_correo(self, conexion, mensaje, texto):
+        email = mensaje.estudiante.email
+        if not email:
+            return {'success': False, 'mensaje_id': None, 'response': 'Estudiante sin email',
+                    'status_code': None, 'reintentable': False}, None
+
+        plantilla = mensaje.campana.plantilla
+        if plantilla.tiene_imagen and plantilla.url_imagen:
+            texto = f"{texto}\n\n{plantilla.url_imagen}"
+        mensaje_id = make_msgid(domain='eki.local')
+        correo = EmailMessage(
+            subject=mensaje.campana.nombre,
+            body=texto,
+            to=[email],
+            headers={'Message-ID': mensaje_id},
+            connection=conexion,
+        )
+
+        inicio = time.perf_counter()
+        try:
+            conexion.send_messages([correo])
+        except smtplib.SMTPRecipientsRefused as e:
+            codigo, respuesta = next(iter(e.recipients.values()))
+            resultado = {'success': False, 'mensaje_id': None, 'response': respuesta.decode(errors='replace'),
+                         'status_code': codigo, 'reintentable': 400 <= codigo < 500}
+        except smtplib.SMTPResponseException as e:
+            resultado = {'success': False, 'mensaje_id': None, 'response': str(e.smtp_error),
+                         'status_code': e.smtp_code, 'reintentable': 400 <= e.smtp_code < 500}
+        except Exception as e:
+            # Conexión caída a mitad del grupo: reintentable
+            return None, e
+        else:
+            resultado = {'success': True, 'mensaje_id': mensaje_id, 'response': 'OK', 'status_code': 250}
+        resultado['latencia_ms'] = _milisegundos(inicio)
+        return resultado, None
+
+
+class _CanalHTTP(Canal):
+    """Sesión HTTP keep-alive compartida por los hilos del canal."""
+    url_setting = None
+    token_setting = None
+
+    def __init__(self):
+        self._sesion = None
+        self._lock = threading.Lock()
+
+    def sesion(self) -> requests.Session:
+        with self._lock:
+            if self._sesion is None:
+                self._sesion = requests.Session()
+                token = getattr(settings, self.token_setting, '')
+                if token:
+                    self._sesion.headers['Authorization'] = f'Bearer {token}'
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.concurrencia(), 10))
+                self._sesion.mount('http://', adapter)
+                self._sesion.mount('https://', adapter)
+            return self._sesion
+
+    def url(self):
+        return getattr(settings, self.url_setting, '')
+
+    @staticmethod
+    def _leer(resp):
+        try:
+            return resp.json()
+        except ValueError:
+            return {'raw': resp.text}
+
+
+class CanalSMS(_CanalHTTP):
+    """
+    SMS por el endpoint masivo del proveedor (SMS_API_URL), SMS_LOTE mensajes por petición:
+
+        POST {"from": "EKI", "messages": [{"to": "57300...", "text": "..."}, ...]}
+        200  {"messages": [{"id": "...", "status": "accepted" | "rejected", "error": "..."}, ...]}
+
+    La respuesta trae un resultado por mensaje, en el mismo orden.
+    """
+    nombre = 'sms'
+    url_setting = 'SMS_API_URL'
+    token_setting = 'SMS_API_TOKEN'
+
+    def enviar_lote(self, envios, buffer=None, concurrencia=None):
+        grupos = _en_grupos(envios, getattr(settings, 'SMS_LOTE', 100))
+        for grupo, resultados, error in despachar(grupos, self._enviar_grupo, concurrencia or self.concurrencia()):
+            if error is not None:
+                for mensaje, _ in grupo:
+                    yield mensaje, None, error
+            else:
+                yield from resultados
+
+    def _enviar_grupo(self, grupo):
+        if not self.url():
+            sin_credenciales = {'success': False, 'mensaje_id': None, 'response': 'Credentials not set', 'status_code': None}
+            return [(mensaje, dict(sin_credenciales), None) for mensaje, _ in grupo]
+
+        payload = {
+            'from': getattr(settings, 'SMS_REMITENTE', 'EKI'),
+            'messages': [{'to': mensaje.estudiante.telefono, 'text': texto} for mensaje, texto in grupo],
+        }
+        inicio = time.perf_counter()
+        resp = self.sesion().post(self.url(), json=payload, timeout=30)
+        latencia_ms = _milisegundos(inicio)
+        data = self._leer(resp)
+
+        if resp.status_code not in (200, 201, 202):
+            # La petición completa falló (auth, 5xx, 429): mismo resultado para todo el grupo
+            error = data.get('error', data)
+            return [(mensaje, {'success': False, 'mensaje_id': None, 'response': error,
+                               'status_code': resp.status_code, 'latencia_ms': latencia_ms}, None)
+                    for mensaje, _ in grupo]
+
+        resultados = []
+        for (mensaje, _), item in zip_longest(grupo, data.get('messages', [])[:len(grupo)]):
+            item = item or {'status': 'rejected', 'error': 'Sin resultado del proveedor'}
+            aceptado = item.get('status') in ('accepted', 'queued', 'sent')
+            resultados.append((mensaje, {
+                'success': aceptado,
+                'mensaje_id': item.get('id') if aceptado else None,
+                'response': item if aceptado else item.get('error', item),
+                'status_code': resp.status_code,
+                'latencia_ms': latencia_ms,
+            }, None))
+        return resultados
+
+
+class CanalVoz(_CanalHTTP):
+    """
+    Llamada de texto a voz (VOZ_API_URL), una petición por destinatario:
+
+        POST {"to": "57300...", "text": "..."}  →  {"id": "..."}
+    """
+    nombre = 'voz'
+    url_setting = 'VOZ_API_URL'
+    token_setting = 'VOZ_API_TOKEN'
+
+    def enviar_lote(self, envios, buffer=None, concurrencia=None):
+        for (mensaje, _), resultado, error in despachar(envios, self._llamar, concurrencia or self.concurrencia()):
+            yield mensaje, resultado, error
+
+    def _llamar(self, envio):
+        mensaje, texto = envio
+        if not self.url():
+            return {'success': False, 'mensaje_id': None, 'response': 'Credentials not set', 'status_code': None}
+        inicio = time.perf_counter()
+        resp = self.sesion().post(self.url(), json={'to': mensaje.estudiante.telefono, 'text': texto}, timeout=30)
+        data = self._leer(resp)
+        exito = resp.status_code in (200, 201, 202) and 'id' in data
+        return {
+            'success': exito,
+            'mensaje_id': data.get('id') if exito else None,
+            'response': data if exito else data.get('error', data),
+            'status_code': resp.status_code,
+            'latencia_ms': _milisegundos(inicio),
+        }
+
+
+_canales = {}
+_canales_lock = threading.Lock()
+
+
+def obtener_canal(nombre: str = None) -> Canal:
+    """Instancia (compartida por proceso) del backend configurado para el canal `nombre`."""
+    nombre = nombre or CANAL_POR_DEFECTO
+    with _canales_lock:
+        if nombre not in _canales:
+            backends = getattr(settings, 'CANALES_ENVIO', {})
+            if nombre not in backends:
+                raise ValueError(f"Canal de envío desconocido: {nombre}")
+            _canales[nombre] = import_string(backends[nombre])()
+        return _canales[nombre]
@@ -0,0 +1,27 @@
+"""
+Chequeos de configuración (`python manage.py check`, y al arrancar cada comando del Procfile).
+
+El circuit breaker, el progreso de campañas, los avisos al programador y el
+contexto del bot se coordinan entre procesos a través del cache. Un LocMemCache vive dentro de cada
+proceso: el web (con varios workers de gunicorn), el worker, el scheduler y el
+consumidor del webhook tendrían cada uno el suyo y nada de eso se cumpliría. En
+producción (DEBUG=False) es un error; en desarrollo, un aviso.
+"""
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@register()
+def revisar_cache_compartido(app_configs, **kwargs):
+    locales = sorted(alias for alias, config in settings.CACHES.items() if config.get('BACKEND') == LOCMEM)
+    if not locales:
+        return []
+    mensaje = (f"El cache {', '.join(repr(alias) for alias in locales)} es LocMemCache: cada proceso tiene el suyo "
+               "y el límite por línea, el circuito y el progreso no se comparten entre workers.")
+    sugerencia = ("Usa un backend compartido: CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache "
+                  "(y `python manage.py createcachetable`) o Redis/Memcached.")
+    if settings.DEBUG:
+        return [Warning(mensaje, hint=sugerencia, id='core.W001')]
+    return [Error(mensaje, hint=sugerencia, id='core.E001')]
@@ -0,0 +1,184 @@
+"""
+Circuit breaker por línea de WhatsApp (phone_id) frente a la Graph API.
+
+Cuando Meta tiene una caída, cada envío espera su timeout y termina en error.
+Si en los últimos CIRCUITO_VENTANA_SEG la tasa de errores del lado de Meta
+(sin respuesta HTTP o 5xx) supera CIRCUITO_UMBRAL_ERROR, el circuito se abre:
+los envíos por esa línea fallan al instante sin llamar a la API y los mensajes
+de campaña vuelven a la cola sin gastar intentos. Pasados CIRCUITO_ESPERA_SEG el
+circuito queda semiabierto y deja pasar CIRCUITO_SONDEOS envíos de prueba: si uno
+funciona se cierra; si falla se vuelve a abrir con el doble de espera (hasta
+CIRCUITO_ESPERA_MAX_SEG). El estado (abierto/semiabierto) vive en el cache
+compartido (DatabaseCache por defecto, ver CACHES en settings), así que todos los
+hilos y procesos ven el mismo circuito. La tasa de errores la cuenta cada proceso
+en memoria bajo un lock (el incr del DatabaseCache no es atómico y perdería
+sumas); el primero que supera el umbral abre el circuito para todos. Los turnos
+de sondeo se toman con `cache.add`, que es atómico en todos los backends: nunca
+salen más de CIRCUITO_SONDEOS sondeos por apertura.
+"""
+import time
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Linea
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+# Mientras los sondeos están en curso, los demás envíos se reprograman con esta espera
+ESPERA_SONDEO = 2
+
+# Cada cuánto se vuelve a mirar qué líneas están en pausa (reclamar_lote lo consulta por lote)
+REVISAR_PAUSAS_SEG = 1
+
+_pausas = {'hasta': 0.0, 'lineas': set(), 'reabre': 0.0}
+_pausas_lock = threading.Lock()
+
+# Resultados por segundo de cada circuito en este proceso: {clave: {segundo: [total, errores]}}
+_ventanas = defaultdict(dict)
+_ventanas_lock = threading.Lock()
+
+
+def _config(nombre: str, defecto: float) -> float:
+    return getattr(settings, nombre, defecto)
+
+
+class Circuito:
+    """Estado del circuito de una línea. `permitir()` antes de llamar a la API y `registrar()` después."""
+
+    def __init__(self, clave: str):
+        self.clave = clave
+        self._clave_estado = f'circuito:{clave}:estado'
+
+    def _apertura(self):
+        # None = cerrado; {'hasta': ts, 'aperturas': n} = abierto (semiabierto una vez pasado 'hasta')
+        return cache.get(self._clave_estado)
+
+    def estado(self) -> str:
+        apertura = self._apertura()
+        if apertura is None:
+            return CERRADO
+        return ABIERTO if time.time() < apertura['hasta'] else SEMIABIERTO
+
+    def permitir(self) -> bool:
+        """True si el envío puede llamar a la API (circuito cerrado o sondeo del semiabierto)."""
+        apertura = self._apertura()
+        if apertura is None:
+            return True
+        if time.time() < apertura['hasta']:
+            return False
+        # Semiabierto: solo CIRCUITO_SONDEOS envíos de prueba por apertura, uno por turno libre
+        timeout = int(_config('CIRCUITO_ESPERA_MAX_SEG', 300)) + 60
+        return any(
+            cache.add(f"{self._clave_estado}:sondeo:{apertura['hasta']}:{turno}", 1, timeout=timeout)
+            for turno in range(int(_config('CIRCUITO_SONDEOS', 3)))
+        )
+
+    def registrar(self, exito: bool):
+        """
+        Resultado de un envío que llegó a la API. `exito` es False solo para errores
+        del lado de Meta (sin respuesta o 5xx); un 4xx es un problema del mensaje.
+        """
+        apertura = self._apertura()
+        if apertura is not None:
+            if time.time() >= apertura['hasta']:
+                # Resultado de un sondeo
+                if exito:
+                    self.cerrar()
+                else:
+                    self.abrir(apertura['aperturas'] + 1)
+            # Si sigue abierto, es un envío que salió antes de abrirse: no cuenta
+            return
+
+        ventana = int(_config('CIRCUITO_VENTANA_SEG', 30))
+        segundo = int(time.time())
+        with _ventanas_lock:
+            conteos = _ventanas[self.clave]
+            if segundo not in conteos:
+                # Segundo nuevo: descartamos los que ya salieron de la ventana
+                for viejo in [s for s in conteos if s <= segundo - ventana]:
+                    del conteos[viejo]
+                conteos[segundo] = [0, 0]
+            conteos[segundo][0] += 1
+            if exito:
+                return
+            conteos[segundo][1] += 1
+            conteos = dict(conteos)
+
+        total, errores = self._ventana(conteos, segundo, ventana)
+        if total >= _config('CIRCUITO_MIN_PETICIONES', 20) and errores / total >= _config('CIRCUITO_UMBRAL_ERROR', 0.5):
+            self.abrir(1)
+
+    def _ventana(self, conteos: dict, segundo: int, ventana: int):
+        # Los segundos anteriores al último cierre (en cualquier proceso) no cuentan:
+        # fueron los errores que lo abrieron
+        desde = max(segundo - ventana + 1, cache.get(f'circuito:{self.clave}:reinicio', 0))
+        en_ventana = [conteo for s, conteo in conteos.items() if s >= desde]
+        return sum(total for total, _ in en_ventana), sum(errores for _, errores in en_ventana)
+
+    def abrir(self, aperturas: int = 1):
+        espera = min(_config('CIRCUITO_ESPERA_MAX_SEG', 300), _config('CIRCUITO_ESPERA_SEG', 30) * 2 ** (aperturas - 1))
+        cache.set(self._clave_estado, {'hasta': time.time() + espera, 'aperturas': aperturas}, timeout=None)
+        print(f"⛔ Circuito abierto para {self.clave}: la API falla, se pausa {espera:.0f}s (apertura {aperturas})")
+
+    def cerrar(self):
+        cache.set(f'circuito:{self.clave}:reinicio', int(time.time()) + 1, timeout=None)
+        cache.delete(self._clave_estado)
+        print(f"✅ Circuito cerrado para {self.clave}: la API respondió, se reanudan los envíos")
+
+    def reanudar_en(self) -> float:
+        """Segundos hasta que vale la pena reintentar un envío rechazado por el circuito."""
+        apertura = self._apertura()
+        if apertura is None:
+            return 0.0
+        return max(ESPERA_SONDEO, apertura['hasta'] - time.time())
+
+
+def obtener_circuito(phone_id: str) -> Circuito:
+    return Circuito(f'whatsapp:{phone_id}')
+
+
+def es_fallo_de_api(status_code) -> bool:
+    """Errores que cuentan para el circuito: sin respuesta HTTP (timeout, conexión) o 5xx."""
+    return status_code is None or status_code >= 500
+
+
+def lineas_en_pausa() -> set:
+    """
+    Ids de Linea con el circuito abierto; None representa las credenciales globales
+    (mensajes sin línea). Se recalcula como mucho cada REVISAR_PAUSAS_SEG.
+    """
+    with _pausas_lock:
+        if time.monotonic() < _pausas['hasta']:
+            return _pausas['lineas']
+
+    global_phone_id = getattr(settings, 'WHATSAPP_PHONE_ID', None)
+    lineas = {None: global_phone_id}
+    for linea_id, phone_id in Linea.objects.values_list('id', 'phone_id'):
+        lineas[linea_id] = phone_id or global_phone_id
+    circuitos = {clave: obtener_circuito(phone_id) for clave, phone_id in lineas.items() if phone_id}
+    estados = cache.get_many([circuito._clave_estado for circuito in circuitos.values()])
+    ahora = time.time()
+    pausadas, reabre = set(), []
+    for clave, circuito in circuitos.items():
+        apertura = estados.get(circuito._clave_estado)
+        if apertura is not None and ahora < apertura['hasta']:
+            pausadas.add(clave)
+            reabre.append(apertura['hasta'])
+    with _pausas_lock:
+        _pausas['hasta'] = time.monotonic() + REVISAR_PAUSAS_SEG
+        _pausas['lineas'] = pausadas
+        _pausas['reabre'] = min(reabre, default=0.0)
+    return pausadas
+
+
+def segundos_hasta_reanudar() -> float:
+    """Segundos hasta que la primera línea en pausa se pruebe de nuevo (0.0 si no hay ninguna)."""
+    lineas_en_pausa()
+    with _pausas_lock:
+        reabre = _pausas['reabre']
+    return max(0.0, reabre - time.time())
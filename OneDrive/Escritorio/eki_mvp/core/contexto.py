@@ -0,0 +1,149 @@
+"""
+Contexto de conversación de cada estudiante para las respuestas del bot:
+nombre, progreso, siguiente tarea y módulo actual.
+
+Vive en el cache 'webhook', una entrada por teléfono. Se arma la primera vez
+que el estudiante escribe (con las mismas consultas para uno o cien estudiantes)
+y desde ahí responderle no toca la base. Los envíos de campaña, que escriben
+sus EnvioLog en bloque (BufferLogs), lo actualizan en el sitio sumando cada
+envío al progreso; cualquier otro cambio de EnvioLog o del estudiante lo
+invalida (señales de models.py y los borrados desde el admin).
+Como red de seguridad cada entrada vence a los WEBHOOK_CONTEXTO_TTL segundos.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import EnvioLog, Estudiante
+
+MODULO_ACTUAL = 'Introducción a la Plataforma'
+SIN_TAREAS = "No hay tareas pendientes"
+
+
+def _cache():
+    return caches['webhook']
+
+
+def _clave(telefono: str) -> str:
+    return f'contexto:{telefono}'
+
+
+def _ttl() -> int:
+    return getattr(settings, 'WEBHOOK_CONTEXTO_TTL', 900)
+
+
+def construir(telefonos) -> dict:
+    """
+    Contexto {telefono: contexto} de los estudiantes con esos teléfonos, leído de la
+    base con tres consultas: estudiantes, conteos de EnvioLog y siguiente tarea.
+    Los teléfonos que no son de un estudiante no aparecen.
+    """
+    estudiantes = list(Estudiante.objects.filter(telefono__in=telefonos).only('id', 'nombre', 'telefono'))
+    if not estudiantes:
+        return {}
+    ids = [estudiante.pk for estudiante in estudiantes]
+
+    conteos = {
+        fila['estudiante_id']: fila
+        for fila in EnvioLog.objects.filter(estudiante_id__in=ids).values('estudiante_id').annotate(
+            total=Count('id'), exitosos=Count('id', filter=Q(estado='ENVIADO'))
+        )
+    }
+    siguientes = {}
+    for estudiante_id, campana in (
+        EnvioLog.objects.filter(estudiante_id__in=ids, estado='PENDIENTE')
+        .order_by('estudiante_id', 'fecha_envio').values_list('estudiante_id', 'campana__nombre')
+    ):
+        siguientes.setdefault(estudiante_id, campana)
+
+    contextos = {}
+    for estudiante in estudiantes:
+        conteo = conteos.get(estudiante.pk, {'total': 0, 'exitosos': 0})
+        contextos[estudiante.telefono] = {
+            'estudiante_id': estudiante.pk,
+            'nombre': estudiante.nombre,
+            'total': conteo['total'],
+            'exitosos': conteo['exitosos'],
+            'siguiente_tarea': siguientes.get(estudiante.pk, SIN_TAREAS),
+        }
+    return contextos
+
+
+def obtener(telefonos) -> dict:
+    """
+    Contexto {telefono: contexto} de los estudiantes que escriben: del cache (un
+    get_many) y, para los que falten, de la base (construir) guardándolo para la próxima.
+    """
+    telefonos = set(telefonos)
+    encontrados = _cache().get_many([_clave(telefono) for telefono in telefonos])
+    contextos = {telefono: encontrados[_clave(telefono)] for telefono in telefonos if _clave(telefono) in encontrados}
+
+    faltan = telefonos - contextos.keys()
+    if faltan:
+        nuevos = construir(faltan)
+        _cache().set_many({_clave(telefono): contexto for telefono, contexto in nuevos.items()}, timeout=_ttl())
+        contextos.update(nuevos)
+    return contextos
+
+
+def datos_respuesta(contexto: dict) -> dict:
+    """Los datos que usan las plantillas de respuesta (core.response_templates)."""
+    total = contexto['total']
+    progreso_porcentaje = int((contexto['exitosos'] / total * 100) if total > 0 else 0)
+    return {
+        'progreso': f'{progreso_porcentaje}%',
+        'modulo_actual': MODULO_ACTUAL,
+        'siguiente_tarea': contexto['siguiente_tarea'],
+        'fecha_vence': 'hoy'
+    }
+
+
+def registrar_envios(logs):
+    """
+    Suma EnvioLog recién guardados al contexto de sus estudiantes (solo a los que
+    están en el cache; el resto se arma cuando escriban). Un log PENDIENTE puede
+    cambiar la siguiente tarea, así que ese contexto se invalida.
+    """
+    sumas = {}
+    invalidar_ids = set()
+    for log in logs:
+        if log.estado == 'PENDIENTE' or not EnvioLog.estudiante.is_cached(log):
+            invalidar_ids.add(log.estudiante_id)
+            continue
+        suma = sumas.setdefault(log.estudiante.telefono, {'total': 0, 'exitosos': 0})
+        suma['total'] += 1
+        suma['exitosos'] += log.estado == 'ENVIADO'
+
+    if sumas:
+        actuales = _cache().get_many([_clave(telefono) for telefono in sumas])
+        actualizados = {}
+        for telefono, suma in sumas.items():
+            contexto = actuales.get(_clave(telefono))
+            if contexto is None:
+                continue
+            contexto['total'] += suma['total']
+            contexto['exitosos'] += suma['exitosos']
+            actualizados[_clave(telefono)] = contexto
+        if actualizados:
+            _cache().set_many(actualizados, timeout=_ttl())
+    if invalidar_ids:
+        invalidar_estudiantes(invalidar_ids)
+
+
+def invalidar(telefonos):
+    """
+    Borra el contexto de estos teléfonos al confirmarse la transacción en curso (o ya,
+    fuera de una): si se borrara antes, otra respuesta podría volver a leer de la base
+    el estado anterior y guardarlo de nuevo.
+    """
+    claves = [_clave(telefono) for telefono in telefonos if telefono]
+    if claves:
+        transaction.on_commit(lambda: _cache().delete_many(claves))
+
+
+def invalidar_estudiantes(estudiante_ids):
+    """Invalida el contexto de estos estudiantes (una consulta para sus teléfonos)."""
+    estudiante_ids = [estudiante_id for estudiante_id in estudiante_ids if estudiante_id is not None]
+    if estudiante_ids:
+        invalidar(Estudiante.objects.filter(pk__in=estudiante_ids).values_list('telefono', flat=True))
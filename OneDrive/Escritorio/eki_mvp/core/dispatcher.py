@@ -0,0 +1,130 @@
+"""
+Despachador concurrente de envíos.
+Reparte los destinatarios de una campaña sobre un pool de hilos con un límite
+de mensajes en vuelo, y entrega los resultados al hilo que llama para que los
+registros (EnvioLog) se sigan escribiendo en un solo lugar.
+"""
+import queue
+import threading
+
+from django.db import connection
+
+_FIN = object()
+
+
+def _llamar(funcion, item):
+    """Ejecuta `funcion(item)` y devuelve (resultado, error) sin propagar excepciones."""
+    try:
+        return funcion(item), None
+    except Exception as e:
+        return None, e
+
+
+def _trabajador(funcion, entrada, salida):
+    try:
+        while True:
+            item = entrada.get()
+            if item is _FIN:
+                break
+            salida.put((item, *_llamar(funcion, item)))
+    finally:
+        # Cada hilo abre su propia conexión a la BD (p.ej. WhatsappLog): la cerramos al salir
+        connection.close()
+
+
+def despachar(items, funcion, concurrencia: int = 1, max_en_vuelo: int = None):
+    """
+    Ejecuta `funcion(item)` para cada item y produce tuplas (item, resultado, error).
+
+    Args:
+        items: iterable de trabajos (p.ej. estudiantes)
+        funcion: callable que realiza el envío de un item
+        concurrencia: número de hilos; 1 ejecuta en el hilo actual, en orden
+        max_en_vuelo: máximo de trabajos encolados o enviándose a la vez
+                      (por defecto 2 × concurrencia)
+
+    Con concurrencia > 1 los resultados llegan en orden de finalización.
+    `error` es la excepción lanzada por `funcion` (o None).
+    """
+    if concurrencia <= 1:
+        for item in items:
+            yield (item, *_llamar(funcion, item))
+        return
+
+    max_en_vuelo = max_en_vuelo or concurrencia * 2
+    entrada = queue.Queue()
+    salida = queue.Queue()
+    hilos = [
+        threading.Thread(target=_trabajador, args=(funcion, entrada, salida), name=f'despacho-{i}', daemon=True)
+        for i in range(concurrencia)
+    ]
+    for hilo in hilos:
+        hilo.start()
+
+    en_vuelo = 0
+    try:
+        for item in items:
+            if en_vuelo >= max_en_vuelo:
+                yield salida.get()
+                en_vuelo -= 1
+            entrada.put(item)
+            en_vuelo += 1
+
+        while en_vuelo:
+            yield salida.get()
+            en_vuelo -= 1
+    finally:
+        # Si el consumidor abandona el generador, descartamos lo que no empezó a enviarse
+        while True:
+            try:
+                entrada.get_nowait()
+            except queue.Empty:
+                break
+        for _ in hilos:
+            entrada.put(_FIN)
+        for hilo in hilos:
+            hilo.join()
+
+
+def combinar(flujos):
+    """
+    Consume varios generadores de resultados a la vez (p.ej. uno por canal, cada
+    uno con su propia concurrencia) y produce sus items según van llegando.
+    Un solo flujo se consume en el hilo actual.
+    """
+    flujos = list(flujos)
+    if len(flujos) == 1:
+        yield from flujos[0]
+        return
+
+    salida = queue.Queue()
+
+    def consumir(flujo):
+        try:
+            for item in flujo:
+                salida.put(item)
+        except Exception as e:
+            salida.put((_FIN, e))
+        finally:
+            salida.put(_FIN)
+            connection.close()
+
+    hilos = [threading.Thread(target=consumir, args=(flujo,), name=f'canal-{i}', daemon=True)
+             for i, flujo in enumerate(flujos)]
+    for hilo in hilos:
+        hilo.start()
+
+    errores = []
+    activos = len(hilos)
+    while activos:
+        item = salida.get()
+        if item is _FIN:
+            activos -= 1
+        elif item[0] is _FIN:
+            errores.append(item[1])
+        else:
+            yield item
+    for hilo in hilos:
+        hilo.join()
+    if errores:
+        raise errores[0]
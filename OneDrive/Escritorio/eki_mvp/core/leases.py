@@ -0,0 +1,41 @@
+"""
+Leases (arrendamientos) con expiración guardados en la base de datos.
+Sirven para elegir un líder entre varias instancias del mismo proceso:
+quien tiene el lease vigente trabaja, los demás esperan a que expire.
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Arrendamiento
+
+
+def adquirir_lease(nombre: str, titular: str, segundos: float) -> bool:
+    """
+    Toma o renueva el lease `nombre` para `titular` durante `segundos`.
+    Retorna False si otro titular lo tiene vigente.
+    """
+    ahora = timezone.now()
+    expira = ahora + timedelta(seconds=segundos)
+
+    # UPDATE condicionado: solo gana quien ya era titular o si el lease expiró
+    renovado = Arrendamiento.objects.filter(nombre=nombre).filter(
+        Q(titular=titular) | Q(expira__lte=ahora)
+    ).update(titular=titular, expira=expira)
+    if renovado:
+        return True
+
+    try:
+        with transaction.atomic():
+            Arrendamiento.objects.create(nombre=nombre, titular=titular, expira=expira)
+        return True
+    except IntegrityError:
+        # Ya existe y lo tiene otro
+        return False
+
+
+def liberar_lease(nombre: str, titular: str):
+    """Suelta el lease (al apagar) para que otra instancia lo tome sin esperar la expiración."""
+    Arrendamiento.objects.filter(nombre=nombre, titular=titular).update(expira=timezone.now())
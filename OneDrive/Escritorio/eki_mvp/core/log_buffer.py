@@ -0,0 +1,112 @@
+"""
+Escritura en bloque de los registros de envío.
+En lugar de 3 escrituras síncronas por mensaje (WhatsappLog PENDING, su save()
+y el EnvioLog), el envío de campañas acumula las filas y las guarda con
+bulk_create / bulk_update en una sola transacción cada N filas o T milisegundos.
+Con SQLite esto reduce drásticamente el tiempo que se pasa esperando el lock de escritura.
+"""
+import time
+import atexit
+import threading
+import weakref
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import EnvioLog, WhatsappLog, MensajeSaliente
+from . import contexto
+
+CAMPOS_MENSAJE = ['estado', 'intentos', 'proximo_intento', 'ultimo_error', 'latencia_ms', 'lote', 'lease_hasta', 'fecha_actualizacion']
+
+_buffers_activos = weakref.WeakSet()
+
+
+class BufferLogs:
+    """
+    Acumula EnvioLog / WhatsappLog nuevos y MensajeSaliente modificados.
+
+    Los `agregar_*` son seguros desde varios hilos; `vaciar()` y
+    `vaciar_si_toca()` deben llamarse desde el hilo dueño del buffer
+    (el que recoge los resultados del despachador).
+    Usar como context manager garantiza el vaciado final.
+    """
+
+    def __init__(self, max_filas: int = None, max_ms: int = None):
+        self.max_filas = max_filas or getattr(settings, 'LOG_BUFFER_FILAS', 500)
+        self.max_ms = max_ms or getattr(settings, 'LOG_BUFFER_MS', 1000)
+        self._envios = []
+        self._whatsapp = []
+        self._mensajes = {}
+        self._lock = threading.Lock()
+        self._ultimo_vaciado = time.monotonic()
+        self.filas_escritas = 0
+        self.vaciados = 0
+        _buffers_activos.add(self)
+
+    def agregar_envio(self, log: EnvioLog):
+        with self._lock:
+            self._envios.append(log)
+
+    def agregar_whatsapp(self, log: WhatsappLog):
+        with self._lock:
+            self._whatsapp.append(log)
+
+    def actualizar_mensaje(self, mensaje: MensajeSaliente):
+        with self._lock:
+            self._mensajes[mensaje.pk] = mensaje
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return len(self._envios) + len(self._whatsapp) + len(self._mensajes)
+
+    def vaciar_si_toca(self):
+        """Vacía si se alcanzó el máximo de filas o pasó el tiempo máximo desde el último vaciado."""
+        transcurrido_ms = (time.monotonic() - self._ultimo_vaciado) * 1000
+        if self.pendientes() >= self.max_filas or transcurrido_ms >= self.max_ms:
+            self.vaciar()
+
+    def vaciar(self) -> int:
+        """Escribe todo lo acumulado en una transacción. Retorna las filas escritas."""
+        with self._lock:
+            envios, self._envios = self._envios, []
+            whatsapp, self._whatsapp = self._whatsapp, []
+            mensajes, self._mensajes = list(self._mensajes.values()), {}
+        self._ultimo_vaciado = time.monotonic()
+
+        total = len(envios) + len(whatsapp) + len(mensajes)
+        if not total:
+            return 0
+
+        # EnvioLog y estado del mensaje se confirman juntos: al reanudar nunca quedan desalineados
+        with transaction.atomic():
+            if whatsapp:
+                WhatsappLog.objects.bulk_create(whatsapp, batch_size=500)
+            if envios:
+                EnvioLog.objects.bulk_create(envios, batch_size=500)
+            if mensajes:
+                MensajeSaliente.objects.bulk_update(mensajes, CAMPOS_MENSAJE, batch_size=500)
+        if envios:
+            # bulk_create no dispara señales: el contexto del bot se actualiza aquí
+            contexto.registrar_envios(envios)
+
+        self.filas_escritas += total
+        self.vaciados += 1
+        return total
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.vaciar()
+        _buffers_activos.discard(self)
+        return False
+
+
+@atexit.register
+def _vaciar_al_salir():
+    """Última oportunidad de persistir lo acumulado si el proceso termina sin cerrar el buffer."""
+    for buffer in list(_buffers_activos):
+        try:
+            buffer.vaciar()
+        except Exception:
+            pass
@@ -0,0 +1,78 @@
+"""
+Mock local de la WhatsApp Cloud API para pruebas de carga (ver core/mock_graph_api.py).
+Con WHATSAPP_DRY_RUN=True los envíos de campañas van a este servidor en vez de Meta.
+
+python manage.py mock_whatsapp --latencia-ms 120 --tasa-error 0.02 --tasa-429 0.01
+"""
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.mock_graph_api import MockGraphAPI, ConfigMock, DISTRIBUCIONES
+
+
+class Command(BaseCommand):
+    help = 'Levanta un mock local de la WhatsApp Cloud API con latencia, errores y webhooks de estado simulados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--puerto', type=int, default=8099)
+        parser.add_argument('--latencia-ms', type=float, default=80, help='Latencia mediana de la API')
+        parser.add_argument('--distribucion', choices=DISTRIBUCIONES, default='lognormal')
+        parser.add_argument('--dispersion', type=float, default=0.5,
+                            help='Sigma (lognormal) o ± fracción (uniforme) de la latencia')
+        parser.add_argument('--tasa-error', type=float, default=0.0, help='Fracción de errores temporales (503)')
+        parser.add_argument('--tasa-rechazo', type=float, default=0.0, help='Fracción de errores permanentes (400)')
+        parser.add_argument('--tasa-429', type=float, default=0.0, help='Fracción de respuestas 429 al azar')
+        parser.add_argument('--limite-mps', type=float, default=None,
+                            help='Mensajes/seg por phone_id antes de responder 429 (como Meta)')
+        parser.add_argument('--webhook-url', default='http://127.0.0.1:8000/webhook/whatsapp/',
+                            help="URL que recibe los estados sent/delivered/read ('' = sin webhooks)")
+        parser.add_argument('--tasa-lectura', type=float, default=0.7)
+        parser.add_argument('--tasa-respuesta', type=float, default=0.0,
+                            help='Fracción de mensajes leídos que el usuario responde')
+        parser.add_argument('--semilla', type=int, default=None)
+        parser.add_argument('--reporte', type=float, default=10, help='Segundos entre reportes (0 = sin reportes)')
+
+    def handle(self, *args, **options):
+        config = ConfigMock(
+            latencia_ms=options['latencia_ms'],
+            distribucion=options['distribucion'],
+            dispersion=options['dispersion'],
+            tasa_error=options['tasa_error'],
+            tasa_rechazo=options['tasa_rechazo'],
+            tasa_429=options['tasa_429'],
+            limite_mps=options['limite_mps'],
+            webhook_url=options['webhook_url'] or None,
+            tasa_lectura=options['tasa_lectura'],
+            tasa_respuesta=options['tasa_respuesta'],
+            semilla=options['semilla'],
+        )
+        mock = MockGraphAPI(config, host=options['host'], puerto=options['puerto']).iniciar()
+
+        self.stdout.write(f"🧪 Mock de WhatsApp Cloud API en {mock.url} "
+                          f"(latencia {config.latencia_ms:.0f} ms {config.distribucion}, "
+                          f"errores {config.tasa_error:.1%}, 429 {config.tasa_429:.1%})")
+        self.stdout.write(f"   Webhooks de estado → {config.webhook_url or 'desactivados'}")
+        if not getattr(settings, 'WHATSAPP_DRY_RUN', False):
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ WHATSAPP_DRY_RUN no está activo: los workers siguen enviando a {settings.WHATSAPP_API_URL}"
+            ))
+
+        detener = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: detener.set())
+        try:
+            while not detener.wait(options['reporte'] or None):
+                stats = mock.estadisticas()
+                self.stdout.write(
+                    f"📊 {stats.get('aceptados', 0)} aceptados, {stats.get('rechazados_429', 0)} 429, "
+                    f"{stats.get('errores_temporales', 0) + stats.get('rechazos_permanentes', 0)} errores, "
+                    f"{stats.get('webhooks_ok', 0)} webhooks ({stats['webhooks_pendientes']} pendientes)"
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            mock.detener()
+        self.stdout.write(self.style.SUCCESS("✅ Mock detenido"))
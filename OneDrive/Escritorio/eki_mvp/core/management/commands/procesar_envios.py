@@ -0,0 +1,172 @@
+"""
+Worker de la bandeja de salida.
+Reclama mensajes pendientes por lotes, los envía y registra los resultados.
+Se pueden correr varios procesos en paralelo sin enviar dos veces el mismo mensaje.
+
+La bandeja está dividida en CAMPANA_PARTICIONES particiones (estudiante_id % N).
+Cada worker arrienda una partición (core.leases) y solo reclama mensajes de ella;
+cuando la vacía la suelta y pasa a la siguiente libre. Si un worker muere, su
+partición queda libre al vencer el lease y los mensajes de su lote en curso
+vuelven a la cola al vencer su propio lease (MensajeSaliente.lease_hasta).
+El último worker que cierra una campaña escribe su resumen (Campana.resumen).
+
+python manage.py procesar_envios --concurrencia 16
+python manage.py procesar_envios --procesos 4     # 4 workers en procesos separados
+python manage.py procesar_envios --una-vez        # vacía la cola y termina
+"""
+import os
+import sys
+import time
+import uuid
+import signal
+import socket
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.leases import adquirir_lease, liberar_lease
+from core.models import MensajeSaliente
+from core.services import (
+    reclamar_lote, procesar_lote, liberar_mensajes_huerfanos, particiones, campanas_detenidas, TAMANO_LOTE,
+)
+
+# Duración del lease de una partición; se renueva antes de cada lote
+LEASE_PARTICION_SEG = 60
+
+
+class Command(BaseCommand):
+    help = 'Envía los mensajes pendientes de la bandeja de salida (MensajeSaliente).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Mensajes reclamados por lote')
+        parser.add_argument('--concurrencia', type=int, default=None,
+                            help='Envíos en paralelo de cada canal (por defecto CANAL_CONCURRENCIA)')
+        parser.add_argument('--espera', type=float, default=2.0,
+                            help='Segundos a esperar cuando la cola está vacía')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Terminar cuando la cola quede vacía (espera los envíos programados y reintentos)')
+        parser.add_argument('--huerfanos-min', type=int, default=10,
+                            help='Minutos tras los que se libera un mensaje reclamado sin lease '
+                                 '(los que tienen lease se liberan al vencer)')
+        parser.add_argument('--procesos', type=int, default=1,
+                            help='Lanzar N workers en procesos separados (cada uno arrienda sus particiones)')
+
+    def handle(self, *args, **options):
+        if options['procesos'] > 1:
+            return self._lanzar_procesos(options)
+
+        concurrencia = options['concurrencia']
+        maxima = concurrencia or max(getattr(settings, 'CANAL_CONCURRENCIA', {}).values(), default=1)
+        tamano = max(options['lote'], maxima * 4)
+        total = particiones()
+        self.titular = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.stdout.write(
+            f"📬 Worker de envíos iniciado (lote={tamano}, concurrencia={concurrencia or 'por canal'}, "
+            f"particiones={total})"
+        )
+
+        # SIGTERM (deploy / reinicio): terminamos el lote en curso, vaciamos sus logs y salimos
+        self.detener = False
+        signal.signal(signal.SIGTERM, self._pedir_detencion)
+
+        # Arrancar en una partición al azar reparte mejor a los workers que se inician juntos
+        siguiente = uuid.uuid4().int % total
+        particion = None
+        vacias = 0
+        try:
+            while not self.detener:
+                if particion is None:
+                    particion = self._arrendar_particion(siguiente, total)
+                    if particion is None:
+                        # Todas las particiones las tienen otros workers
+                        if options['una_vez']:
+                            break
+                        time.sleep(options['espera'])
+                        continue
+                elif not adquirir_lease(f'particion:{particion}', self.titular, LEASE_PARTICION_SEG):
+                    # El lease venció mientras procesábamos y otro worker tomó la partición
+                    particion = None
+                    continue
+
+                mensajes = reclamar_lote(tamano=tamano, particion=particion)
+                if not mensajes:
+                    # Partición vacía: la soltamos y probamos la siguiente
+                    liberar_lease(f'particion:{particion}', self.titular)
+                    siguiente = (particion + 1) % total
+                    particion = None
+                    vacias += 1
+                    if vacias < total:
+                        continue
+                    vacias = 0
+                    # Recuperar mensajes de workers que murieron a mitad de un lote
+                    if liberar_mensajes_huerfanos(minutos=options['huerfanos_min']):
+                        continue
+                    if options['una_vez'] and not self._quedan_programados():
+                        break
+                    time.sleep(options['espera'])
+                    continue
+
+                vacias = 0
+                resultados = procesar_lote(mensajes, concurrencia)
+                exitosos = sum(r['exitosos'] for r in resultados.values())
+                fallidos = sum(r['fallidos'] for r in resultados.values())
+                reintentos = sum(r['reintentos'] for r in resultados.values())
+                self.stdout.write(
+                    f"📦 Lote de {len(mensajes)} (partición {particion}): {exitosos} enviados, "
+                    f"{fallidos} errores, {reintentos} reprogramados"
+                )
+        except KeyboardInterrupt:
+            self.stdout.write("🛑 Worker detenido")
+        finally:
+            if particion is not None:
+                liberar_lease(f'particion:{particion}', self.titular)
+
+        self.stdout.write(self.style.SUCCESS("✅ Worker de envíos finalizado"))
+
+    def _quedan_programados(self) -> bool:
+        """Mensajes que aún no vencen (reintentos, envíos repartidos) de campañas que siguen en curso."""
+        return MensajeSaliente.objects.filter(estado='PENDIENTE').exclude(campana_id__in=campanas_detenidas()).exists()
+
+    def _arrendar_particion(self, desde: int, total: int):
+        """Primera partición libre a partir de `desde` (dando la vuelta), o None si están todas tomadas."""
+        for i in range(total):
+            particion = (desde + i) % total
+            if adquirir_lease(f'particion:{particion}', self.titular, LEASE_PARTICION_SEG):
+                return particion
+        return None
+
+    def _lanzar_procesos(self, options):
+        """Lanza N copias de este comando (un worker cada una) y les reenvía SIGTERM."""
+        comando = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'procesar_envios',
+                   '--lote', str(options['lote']), '--espera', str(options['espera']),
+                   '--huerfanos-min', str(options['huerfanos_min'])]
+        if options['concurrencia']:
+            comando += ['--concurrencia', str(options['concurrencia'])]
+        if options['una_vez']:
+            comando.append('--una-vez')
+
+        hijos = [subprocess.Popen(comando) for _ in range(options['procesos'])]
+        self.stdout.write(f"🧵 {len(hijos)} workers lanzados (pids {', '.join(str(h.pid) for h in hijos)})")
+
+        def reenviar(*args):
+            self.stdout.write("🛑 SIGTERM recibido: deteniendo los workers")
+            for hijo in hijos:
+                if hijo.poll() is None:
+                    hijo.send_signal(signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, reenviar)
+        try:
+            codigos = [hijo.wait() for hijo in hijos]
+        except KeyboardInterrupt:
+            # Ctrl+C ya llegó a todo el grupo de procesos; solo esperamos a que cierren su lote
+            codigos = [hijo.wait() for hijo in hijos]
+
+        if any(codigos):
+            self.stdout.write(self.style.WARNING(f"⚠️ Workers terminados con códigos {codigos}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("✅ Todos los workers finalizaron"))
+
+    def _pedir_detencion(self, *args):
+        self.stdout.write("🛑 SIGTERM recibido: terminando el lote en curso")
+        self.detener = True
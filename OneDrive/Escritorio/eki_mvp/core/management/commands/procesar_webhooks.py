@@ -0,0 +1,72 @@
+"""
+Consumidor de los eventos del webhook de WhatsApp (WebhookEvento).
+La vista guarda cada POST y responde al instante; este comando los reclama por
+lotes y un pool de hilos detecta la intención, responde y registra los estados.
+Se pueden correr varios procesos en paralelo sin procesar dos veces un evento.
+
+python manage.py procesar_webhooks --hilos 16
+python manage.py procesar_webhooks --una-vez      # vacía la cola y termina
+"""
+import time
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.webhook import (
+    reclamar_eventos, procesar_eventos, liberar_eventos_huerfanos, purgar_procesados, TAMANO_LOTE_EVENTOS,
+)
+
+# Cada cuánto se borran los eventos procesados más viejos que WEBHOOK_RETENCION_DIAS
+PURGAR_CADA_SEG = 3600
+
+
+class Command(BaseCommand):
+    help = 'Procesa los eventos recibidos por el webhook de WhatsApp (WebhookEvento).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=None,
+                            help='Eventos procesados en paralelo (por defecto WEBHOOK_HILOS)')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE_EVENTOS, help='Eventos reclamados por lote')
+        parser.add_argument('--espera', type=float, default=0.2,
+                            help='Segundos a esperar cuando no hay eventos')
+        parser.add_argument('--una-vez', action='store_true', help='Terminar cuando la cola quede vacía')
+        parser.add_argument('--huerfanos-min', type=int, default=5,
+                            help='Minutos tras los que un evento reclamado por un consumidor caído se libera')
+
+    def handle(self, *args, **options):
+        hilos = options['hilos'] or getattr(settings, 'WEBHOOK_HILOS', 8)
+        tamano = max(options['lote'], hilos * 2)
+        self.stdout.write(f"📨 Consumidor del webhook iniciado (lote={tamano}, hilos={hilos})")
+
+        # SIGTERM (deploy / reinicio): terminamos el lote en curso y salimos
+        self.detener = False
+        signal.signal(signal.SIGTERM, self._pedir_detencion)
+
+        proxima_purga = 0.0
+        try:
+            while not self.detener:
+                eventos = reclamar_eventos(tamano=tamano)
+                if not eventos:
+                    if liberar_eventos_huerfanos(minutos=options['huerfanos_min']):
+                        continue
+                    if options['una_vez']:
+                        break
+                    if time.monotonic() >= proxima_purga:
+                        purgar_procesados(getattr(settings, 'WEBHOOK_RETENCION_DIAS', 7))
+                        proxima_purga = time.monotonic() + PURGAR_CADA_SEG
+                    time.sleep(options['espera'])
+                    continue
+
+                conteo = procesar_eventos(eventos, hilos)
+                self.stdout.write(
+                    f"📨 Lote de {len(eventos)} eventos: {conteo['procesados']} procesados, {conteo['errores']} errores"
+                )
+        except KeyboardInterrupt:
+            self.stdout.write("🛑 Consumidor detenido")
+
+        self.stdout.write(self.style.SUCCESS("✅ Consumidor del webhook finalizado"))
+
+    def _pedir_detencion(self, *args):
+        self.stdout.write("🛑 SIGTERM recibido: terminando el lote en curso")
+        self.detener = True
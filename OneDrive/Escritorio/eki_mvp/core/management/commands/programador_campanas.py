@@ -0,0 +1,45 @@
+"""
+Programador de campañas: encola cada campaña al llegar su `fecha_programada`.
+Los envíos los hace el worker `procesar_envios`.
+Se pueden correr varias instancias: solo una (la que tiene el lease) dispara.
+
+python manage.py programador_campanas
+"""
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.scheduler import ProgramadorCampanas
+
+
+class Command(BaseCommand):
+    help = 'Lanza las campañas programadas (Campana.fecha_programada) cuando les llega la hora.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lease', type=float, default=30,
+                            help='Segundos de validez del lease de líder')
+        parser.add_argument('--resync', type=float, default=600,
+                            help='Segundos entre recargas completas desde la base')
+        parser.add_argument('--gracia', type=float, default=None,
+                            help='Minutos de retraso tras los que una campaña vencida ya no se lanza '
+                                 '(por defecto PROGRAMADOR_GRACIA_MINUTOS)')
+
+    def handle(self, *args, **options):
+        programador = ProgramadorCampanas(
+            lease_segundos=options['lease'],
+            resync_segundos=options['resync'],
+            gracia_minutos=options['gracia'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f"⏰ Programador de campañas iniciado ({programador.titular})")
+
+        # SIGTERM (deploy / reinicio): soltamos el lease para que otra instancia tome el control
+        signal.signal(signal.SIGTERM, lambda *args: programador.detener())
+
+        try:
+            programador.ejecutar()
+        except KeyboardInterrupt:
+            programador.detener()
+            self.stdout.write("🛑 Programador detenido")
+
+        self.stdout.write(self.style.SUCCESS("✅ Programador de campañas finalizado"))
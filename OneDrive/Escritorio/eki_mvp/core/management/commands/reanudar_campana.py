@@ -0,0 +1,43 @@
+"""
+Reanuda una campaña interrumpida (caída del proceso, deploy, reinicio de workers).
+Libera los mensajes que quedaron reclamados por un worker muerto, vuelve a encolar
+a quien falte y envía solo a los destinatarios sin EnvioLog terminal.
+
+python manage.py reanudar_campana 12
+python manage.py reanudar_campana 12 --solo-encolar   # deja el envío a procesar_envios
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Campana
+from core.services import ejecutar_campana_servicio, encolar_campana, liberar_mensajes_huerfanos
+
+
+class Command(BaseCommand):
+    help = 'Reanuda una campaña sin reenviar a quienes ya recibieron el mensaje.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campana_id', type=int)
+        parser.add_argument('--minutos', type=int, default=10,
+                            help='Libera mensajes reclamados hace más de N minutos (0 = todos)')
+        parser.add_argument('--solo-encolar', action='store_true',
+                            help='No enviar aquí: dejar los mensajes para el worker procesar_envios')
+        parser.add_argument('--concurrencia', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            campana = Campana.objects.select_related('plantilla').get(pk=options['campana_id'])
+        except Campana.DoesNotExist:
+            raise CommandError(f"Campaña {options['campana_id']} no existe")
+
+        liberados = liberar_mensajes_huerfanos(campana, minutos=options['minutos'])
+        self.stdout.write(f"🔓 {liberados} mensajes liberados de workers caídos")
+
+        if options['solo_encolar']:
+            encolados = encolar_campana(campana)
+            self.stdout.write(self.style.SUCCESS(f"📬 '{campana.nombre}': {encolados} mensajes en la bandeja"))
+            return
+
+        res = ejecutar_campana_servicio(campana, concurrencia=options['concurrencia'])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ '{campana.nombre}' reanudada: {res['exitosos']} enviados, {res['fallidos']} errores."
+        ))
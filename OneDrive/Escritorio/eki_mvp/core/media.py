@@ -0,0 +1,130 @@
+"""
+Caché de imágenes subidas a la Media API de WhatsApp.
+Con `image.link` Meta descarga la imagen de nuestra URL una vez por destinatario;
+con `image.id` la descarga una sola vez al subirla. Los media id se guardan en
+MediaWhatsapp por (URL, hash del contenido, phone_id), así que todos los workers
+los comparten, y se vuelven a subir al caducar o si la imagen de la URL cambia.
+
+El cache de Django guarda el id vigente de cada URL durante
+MEDIA_WHATSAPP_VERIFICAR_SEG: mientras tanto no se vuelve a descargar la imagen.
+"""
+import time
+import hashlib
+import threading
+from datetime import timedelta
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import MediaWhatsapp
+from .whatsapp_client import obtener_cliente
+
+# Errores de Meta al descargar/usar un media id (caducado, borrado o corrupto)
+CODIGOS_MEDIA_INVALIDA = (131052, 131053)
+
+LOCK_TIMEOUT = 60
+
+_locales = {}
+_locales_lock = threading.Lock()
+
+
+def _clave(url: str, phone_id: str) -> str:
+    return f"media:{phone_id}:{hashlib.sha1(url.encode()).hexdigest()}"
+
+
+def _descargar(url: str):
+    """Descarga la imagen y retorna (contenido, mime_type)."""
+    maximo = int(getattr(settings, 'MEDIA_WHATSAPP_MAX_MB', 5) * 1024 * 1024)
+    resp = requests.get(url, timeout=15)
+    resp.raise_for_status()
+    if len(resp.content) > maximo:
+        raise ValueError(f"La imagen pesa {len(resp.content) / 1024 / 1024:.1f} MB (máximo {maximo / 1024 / 1024:.0f} MB)")
+    mime_type = resp.headers.get('Content-Type', 'image/jpeg').split(';')[0].strip()
+    return resp.content, mime_type
+
+
+def _subir(url, phone_id, token, contenido, mime_type) -> str:
+    nombre = urlparse(url).path.rsplit('/', 1)[-1] or 'imagen'
+    resp = obtener_cliente().subir_media(phone_id, token, contenido, mime_type, nombre)
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {'raw': resp.text}
+    if resp.status_code not in (200, 201) or 'id' not in data:
+        raise RuntimeError(f"Error subiendo media ({resp.status_code}): {data.get('error', data)}")
+    return data['id']
+
+
+def _resolver(url: str, phone_id: str, token: str):
+    """Descarga la URL, busca su media id vigente por hash o la sube. Retorna (media_id, segundos_vigente)."""
+    contenido, mime_type = _descargar(url)
+    hash_contenido = hashlib.sha256(contenido).hexdigest()
+    ahora = timezone.now()
+
+    # Margen de un día para no enviar un id que caduque a mitad de campaña
+    registro = MediaWhatsapp.objects.filter(
+        url=url, hash_contenido=hash_contenido, phone_id=phone_id, expira__gt=ahora + timedelta(days=1)
+    ).first()
+    if registro is None:
+        media_id = _subir(url, phone_id, token, contenido, mime_type)
+        registro, _ = MediaWhatsapp.objects.update_or_create(
+            url=url, hash_contenido=hash_contenido, phone_id=phone_id,
+            defaults={
+                'media_id': media_id,
+                'mime_type': mime_type,
+                'tamano_bytes': len(contenido),
+                'subido_en': ahora,
+                'expira': ahora + timedelta(days=getattr(settings, 'MEDIA_WHATSAPP_VIGENCIA_DIAS', 29)),
+            },
+        )
+        print(f"🖼️ Imagen subida a WhatsApp ({phone_id}): {url} → {media_id}")
+    return registro.media_id, (registro.expira - ahora).total_seconds() - 86400
+
+
+def obtener_media_id(url: str, phone_id: str, token: str):
+    """
+    Media id vigente de la imagen `url` para la línea `phone_id`, subiéndola si hace falta.
+    Retorna None si no se pudo descargar o subir (el envío usa `image.link` como antes).
+    """
+    verificar = getattr(settings, 'MEDIA_WHATSAPP_VERIFICAR_SEG', 600)
+    with _locales_lock:
+        local = _locales.get((url, phone_id))
+    if local and local[1] > time.monotonic():
+        return local[0]
+
+    clave = _clave(url, phone_id)
+    media_id = cache.get(clave)
+    if media_id is None:
+        # Un solo worker descarga y sube; los demás esperan su resultado
+        lock = cache.add(f'{clave}:lock', 1, timeout=LOCK_TIMEOUT)
+        try:
+            if not lock:
+                limite = time.monotonic() + LOCK_TIMEOUT
+                while media_id is None and time.monotonic() < limite and cache.get(f'{clave}:lock'):
+                    time.sleep(0.2)
+                    media_id = cache.get(clave)
+            if media_id is None:
+                media_id, vigencia = _resolver(url, phone_id, token)
+                cache.set(clave, media_id, timeout=max(1, min(verificar, vigencia)))
+        except Exception as e:
+            print(f"⚠️ No se pudo subir la imagen {url}: {e}. Se enviará por link.")
+            return None
+        finally:
+            if lock:
+                cache.delete(f'{clave}:lock')
+
+    with _locales_lock:
+        _locales[(url, phone_id)] = (media_id, time.monotonic() + verificar)
+    return media_id
+
+
+def invalidar_media(media_id: str):
+    """Olvida un media id que Meta rechazó; el próximo envío vuelve a subir la imagen."""
+    for registro in MediaWhatsapp.objects.filter(media_id=media_id):
+        cache.delete(_clave(registro.url, registro.phone_id))
+        with _locales_lock:
+            _locales.pop((registro.url, registro.phone_id), None)
+    MediaWhatsapp.objects.filter(media_id=media_id).update(expira=timezone.now())
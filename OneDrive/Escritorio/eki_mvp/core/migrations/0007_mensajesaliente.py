@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 05:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_plantilla_tiene_imagen_plantilla_url_imagen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensajeSaliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('ENVIADO', 'Enviado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=20)),
+                ('lote', models.CharField(blank=True, db_index=True, max_length=32, null=True)),
+                ('reclamado_en', models.DateTimeField(blank=True, null=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('campana', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.campana')),
+                ('estudiante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.estudiante')),
+            ],
+            options={
+                'verbose_name': 'Mensaje en cola',
+                'verbose_name_plural': 'Bandeja de salida',
+                'indexes': [models.Index(fields=['estado', 'id'], name='mensaje_estado_idx')],
+                'constraints': [models.UniqueConstraint(fields=('campana', 'estudiante'), name='mensaje_unico_por_campana')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 05:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_mensajesaliente'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enviolog',
+            index=models.Index(fields=['campana', 'estado', 'estudiante'], name='enviolog_campana_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.9 on 2026-10-18 05:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_enviolog_campana_estado_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mensajesaliente',
+            name='mensaje_estado_idx',
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='intentos',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='latencia_ms',
+            field=models.PositiveIntegerField(blank=True, help_text='Duración del último intento', null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='proximo_intento',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='ultimo_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mensajesaliente',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('ENVIADO', 'Enviado'), ('FALLIDO', 'Fallido'), ('AGOTADO', 'Reintentos agotados')], default='PENDIENTE', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='mensajesaliente',
+            index=models.Index(fields=['estado', 'proximo_intento'], name='mensaje_estado_proximo_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_mensajesaliente_reintentos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Arrendamiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('titular', models.CharField(max_length=100)),
+                ('expira', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='campana',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
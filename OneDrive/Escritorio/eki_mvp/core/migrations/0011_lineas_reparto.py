@@ -0,0 +1,49 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_campana_fecha_modificacion_arrendamiento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campana',
+            name='lineas',
+            field=models.ManyToManyField(blank=True, help_text='Si eliges varias, el envío se reparte entre ellas', related_name='campanas_repartidas', to='core.linea'),
+        ),
+        migrations.AddField(
+            model_name='enviolog',
+            name='linea',
+            field=models.ForeignKey(blank=True, help_text='Línea que hizo el envío', null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.linea'),
+        ),
+        migrations.AddField(
+            model_name='linea',
+            name='activa',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='linea',
+            name='mensajes_por_segundo',
+            field=models.PositiveIntegerField(default=80, help_text='Throughput permitido por Meta para este número (define su parte del reparto)'),
+        ),
+        migrations.AddField(
+            model_name='linea',
+            name='phone_id',
+            field=models.CharField(blank=True, help_text='Phone number ID de la Cloud API', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='linea',
+            name='token',
+            field=models.TextField(blank=True, help_text='Token de acceso de la línea'),
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='linea',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.linea'),
+        ),
+    ]
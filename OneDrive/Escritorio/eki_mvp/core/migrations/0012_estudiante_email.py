@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_lineas_reparto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estudiante',
+            name='email',
+            field=models.EmailField(blank=True, help_text='Para campañas por email', max_length=254),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_estudiante_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estudiante',
+            name='datos_extra',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_estudiante_datos_extra'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaWhatsapp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500)),
+                ('hash_contenido', models.CharField(help_text='SHA-256 del archivo subido', max_length=64)),
+                ('phone_id', models.CharField(help_text='Los media id son válidos solo para la línea que los subió', max_length=50)),
+                ('media_id', models.CharField(db_index=True, max_length=100)),
+                ('mime_type', models.CharField(max_length=50)),
+                ('tamano_bytes', models.PositiveIntegerField()),
+                ('subido_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expira', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Imagen subida a WhatsApp',
+                'verbose_name_plural': 'Imágenes subidas a WhatsApp',
+                'constraints': [models.UniqueConstraint(fields=('url', 'hash_contenido', 'phone_id'), name='media_unica_por_linea')],
+            },
+        ),
+    ]
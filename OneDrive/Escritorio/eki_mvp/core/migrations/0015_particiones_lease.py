@@ -0,0 +1,37 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_mediawhatsapp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campana',
+            name='fecha_finalizacion',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='campana',
+            name='resumen',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='lease_hasta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mensajesaliente',
+            name='particion',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='mensajesaliente',
+            index=models.Index(fields=['particion', 'estado', 'proximo_intento'], name='mensaje_particion_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:44
+
+from django.db import migrations, models
+
+
+def estado_inicial(apps, schema_editor):
+    Campana = apps.get_model('core', 'Campana')
+    MensajeSaliente = apps.get_model('core', 'MensajeSaliente')
+    Campana.objects.filter(ejecutada=True).update(estado='COMPLETADA')
+    en_cola = MensajeSaliente.objects.values('campana_id')
+    Campana.objects.filter(ejecutada=False, pk__in=en_cola).update(estado='EN_CURSO')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_particiones_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campana',
+            name='estado',
+            field=models.CharField(choices=[('BORRADOR', 'Borrador'), ('EN_CURSO', 'En curso'), ('PAUSADA', 'Pausada'), ('CANCELADA', 'Cancelada'), ('COMPLETADA', 'Completada')], default='BORRADOR', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='mensajesaliente',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('ENVIADO', 'Enviado'), ('FALLIDO', 'Fallido'), ('AGOTADO', 'Reintentos agotados'), ('CANCELADO', 'Cancelado')], default='PENDIENTE', max_length=20),
+        ),
+        migrations.RunPython(estado_inicial, migrations.RunPython.noop),
+    ]
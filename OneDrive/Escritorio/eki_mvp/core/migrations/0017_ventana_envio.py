@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_estado_campana'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campana',
+            name='duracion_objetivo',
+            field=models.DurationField(blank=True, help_text='Tiempo de envío (dentro de la ventana) en el que repartir los mensajes, p.ej. 04:00:00. Vacío con ventana = lo que quede de la ventana del día', null=True),
+        ),
+        migrations.AddField(
+            model_name='campana',
+            name='ventana_fin',
+            field=models.TimeField(blank=True, help_text='Hora hasta la que se envía, p.ej. 18:00', null=True),
+        ),
+        migrations.AddField(
+            model_name='campana',
+            name='ventana_inicio',
+            field=models.TimeField(blank=True, help_text='Hora desde la que se envía, p.ej. 08:00', null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_webhook_evento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MensajeRecibido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mensaje_id', models.CharField(max_length=128, unique=True)),
+                ('recibido_en', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Mensaje recibido',
+                'verbose_name_plural': 'Mensajes recibidos',
+            },
+        ),
+    ]
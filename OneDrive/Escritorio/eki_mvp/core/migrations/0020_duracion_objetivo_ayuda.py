@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_webhook_mensaje_recibido'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='campana',
+            name='duracion_objetivo',
+            field=models.DurationField(blank=True, help_text='Tiempo de envío (dentro de la ventana) en el que repartir los mensajes, p.ej. 04:00:00. Vacío con ventana = una ventana completa (sigue al día siguiente si empieza a medias)', null=True),
+        ),
+    ]
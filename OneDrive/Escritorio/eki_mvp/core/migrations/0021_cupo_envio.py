@@ -0,0 +1,22 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_duracion_objetivo_ayuda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CupoEnvio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=100, unique=True)),
+                ('tokens', models.FloatField()),
+                ('actualizado', models.FloatField(help_text='time.time() del último descuento')),
+            ],
+        ),
+    ]
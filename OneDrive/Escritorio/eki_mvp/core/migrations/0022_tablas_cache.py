@@ -0,0 +1,19 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def crear_tablas_cache(apps, schema_editor):
+    # Las tablas del DatabaseCache por defecto (eki_cache, eki_webhook): así una base recién
+    # migrada funciona sin correr `createcachetable` aparte. Con Redis o Memcached no hace nada
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_cupo_envio'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_tablas_cache, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_tablas_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cupoenvio',
+            name='esperas',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cupoenvio',
+            name='ms_esperando',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cupoenvio',
+            name='ms_respuestas',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cupoenvio',
+            name='respuestas',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,311 @@
+"""
+Mock local de la WhatsApp Cloud API (Graph API) para pruebas de carga sin costo.
+
+Imita los endpoints que usa el proyecto:
+    POST /{version}/{phone_id}/messages    envío (con latencia, errores y 429 simulados)
+    POST /{version}/{phone_id}/media       subida de imágenes
+    GET  /{version}/me, /me/permissions, /{phone_id}   (validate_whatsapp_token.py)
+    GET  /__stats                          contadores del mock en JSON
+
+Por cada mensaje aceptado puede llamar al webhook (`/webhook/whatsapp/`) con los
+estados sent → delivered → read y, opcionalmente, una respuesta del usuario,
+para probar el ciclo completo de envío y recepción.
+
+Se levanta con `python manage.py mock_whatsapp` y se activa con WHATSAPP_DRY_RUN=True.
+"""
+import json
+import time
+import uuid
+import heapq
+import random
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+DISTRIBUCIONES = ('fija', 'uniforme', 'lognormal', 'exponencial')
+
+# Textos con los que "responden" los usuarios simulados (pasan por el detector de intents)
+RESPUESTAS_SIMULADAS = ('hola', 'cuál es mi progreso?', 'qué tarea sigue', 'gracias', 'ayuda')
+
+
+class ConfigMock:
+    """
+    Args:
+        latencia_ms: latencia mediana de la API
+        distribucion: 'fija', 'uniforme' (± dispersión), 'lognormal' (sigma = dispersión) o 'exponencial'
+        dispersion: ancho de la distribución (0.5 = colas de ~2-3x la mediana en lognormal)
+        tasa_error: fracción de envíos que fallan con un error temporal (503 / código 131016)
+        tasa_rechazo: fracción que falla con un error permanente (400 / código 131026)
+        tasa_429: fracción de envíos rechazados por rate limit (429 / código 130429)
+        limite_mps: mensajes/seg por phone_id; por encima responde 429 como Meta (None = sin límite)
+        webhook_url: URL a la que se envían los estados (None = sin callbacks)
+        demoras_estados_ms: demora de sent, delivered y read desde el envío
+        tasa_lectura: fracción de mensajes que llegan a 'read'
+        tasa_respuesta: fracción de mensajes que el usuario responde (mensaje entrante)
+        semilla: semilla del generador aleatorio (resultados reproducibles)
+    """
+
+    def __init__(self, latencia_ms: float = 80, distribucion: str = 'lognormal', dispersion: float = 0.5,
+                 tasa_error: float = 0.0, tasa_rechazo: float = 0.0, tasa_429: float = 0.0,
+                 limite_mps: float = None, webhook_url: str = None,
+                 demoras_estados_ms=(200, 1000, 5000), tasa_lectura: float = 0.7,
+                 tasa_respuesta: float = 0.0, semilla: int = None):
+        if distribucion not in DISTRIBUCIONES:
+            raise ValueError(f"Distribución desconocida: {distribucion} (opciones: {', '.join(DISTRIBUCIONES)})")
+        self.latencia_ms = latencia_ms
+        self.distribucion = distribucion
+        self.dispersion = dispersion
+        self.tasa_error = tasa_error
+        self.tasa_rechazo = tasa_rechazo
+        self.tasa_429 = tasa_429
+        self.limite_mps = limite_mps
+        self.webhook_url = webhook_url
+        self.demoras_estados_ms = tuple(demoras_estados_ms)
+        self.tasa_lectura = tasa_lectura
+        self.tasa_respuesta = tasa_respuesta
+        self.aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    def azar(self) -> float:
+        with self._lock:
+            return self.aleatorio.random()
+
+    def latencia(self) -> float:
+        """Segundos de latencia de una petición según la distribución configurada."""
+        mediana = self.latencia_ms / 1000
+        with self._lock:
+            if self.distribucion == 'uniforme':
+                return max(0.0, self.aleatorio.uniform(mediana * (1 - self.dispersion), mediana * (1 + self.dispersion)))
+            if self.distribucion == 'lognormal':
+                return mediana * self.aleatorio.lognormvariate(0, self.dispersion)
+            if self.distribucion == 'exponencial':
+                return self.aleatorio.expovariate(1 / mediana) if mediana > 0 else 0.0
+        return mediana
+
+
+def _error(codigo: int, mensaje: str, tipo: str = 'OAuthException', transitorio: bool = False) -> dict:
+    return {'error': {'message': mensaje, 'type': tipo, 'code': codigo, 'is_transient': transitorio,
+                      'fbtrace_id': uuid.uuid4().hex[:11]}}
+
+
+class MockGraphAPI:
+    """Servidor HTTP del mock más el hilo que entrega los webhooks programados."""
+
+    def __init__(self, config: ConfigMock = None, host: str = '127.0.0.1', puerto: int = 0):
+        self.config = config or ConfigMock()
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._ventanas = {}              # phone_id -> (segundo, envíos en ese segundo) para limite_mps
+        self._eventos = []               # heap de (momento, orden, phone_id, tipo, datos)
+        self._eventos_cond = threading.Condition()
+        self._orden = 0
+        self._detener = threading.Event()
+        self._sesion = requests.Session()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Sin Nagle: evita que cada respuesta keep-alive espere ~40 ms por el ACK retardado
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                mock._atender(self, 'GET')
+
+            def do_POST(self):
+                mock._atender(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        class Servidor(ThreadingHTTPServer):
+            # Backlog amplio: con concurrencia alta el valor por defecto (5) rechaza conexiones
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self.servidor = Servidor((host, puerto), Handler)
+        self._hilos = []
+
+    @property
+    def url(self) -> str:
+        host, puerto = self.servidor.server_address[:2]
+        return f'http://{host}:{puerto}'
+
+    def iniciar(self):
+        for destino, nombre in ((self.servidor.serve_forever, 'mock-http'), (self._entregar_webhooks, 'mock-webhooks')):
+            hilo = threading.Thread(target=destino, name=nombre, daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        return self
+
+    def detener(self):
+        self._detener.set()
+        with self._eventos_cond:
+            self._eventos_cond.notify_all()
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        for hilo in self._hilos:
+            hilo.join(timeout=5)
+
+    def estadisticas(self) -> dict:
+        with self._stats_lock:
+            datos = dict(self.stats)
+        with self._eventos_cond:
+            datos['webhooks_pendientes'] = len(self._eventos)
+        return datos
+
+    def _contar(self, clave: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[clave] += n
+
+    # ---------- HTTP ----------
+
+    def _responder(self, handler, codigo: int, datos: dict):
+        cuerpo = json.dumps(datos).encode()
+        handler.send_response(codigo)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(cuerpo)))
+        handler.end_headers()
+        handler.wfile.write(cuerpo)
+
+    def _atender(self, handler, metodo: str):
+        cuerpo = handler.rfile.read(int(handler.headers.get('Content-Length', 0) or 0))
+        partes = [p for p in handler.path.split('?', 1)[0].split('/') if p]
+
+        if metodo == 'GET' and partes == ['__stats']:
+            return self._responder(handler, 200, self.estadisticas())
+
+        # Todas las rutas de la Graph API empiezan con la versión (v19.0/...)
+        if partes and partes[0].startswith('v'):
+            partes = partes[1:]
+
+        if metodo == 'POST' and len(partes) == 2 and partes[1] == 'messages':
+            return self._enviar_mensaje(handler, partes[0], cuerpo)
+        if metodo == 'POST' and len(partes) == 2 and partes[1] == 'media':
+            return self._subir_media(handler, cuerpo)
+        if metodo == 'GET' and partes == ['me']:
+            return self._responder(handler, 200, {'id': '100000000000001', 'name': 'Mock WhatsApp App'})
+        if metodo == 'GET' and partes == ['me', 'permissions']:
+            return self._responder(handler, 200, {'data': [
+                {'permission': p, 'status': 'granted'}
+                for p in ('whatsapp_business_messaging', 'whatsapp_business_management', 'business_management')
+            ]})
+        if metodo == 'GET' and len(partes) == 1:
+            return self._responder(handler, 200, {
+                'id': partes[0], 'display_phone_number': '+57 300 0000000', 'phone_number': '+57 300 0000000',
+                'verified_name': 'Mock', 'quality_rating': 'GREEN', 'status': 'CONNECTED',
+            })
+        self._contar('rutas_desconocidas')
+        return self._responder(handler, 404, _error(100, f'Unknown path components: {handler.path}'))
+
+    def _excede_limite(self, phone_id: str) -> bool:
+        if not self.config.limite_mps:
+            return False
+        segundo = int(time.monotonic())
+        with self._stats_lock:
+            actual, enviados = self._ventanas.get(phone_id, (segundo, 0))
+            if actual != segundo:
+                actual, enviados = segundo, 0
+            self._ventanas[phone_id] = (actual, enviados + 1)
+        return enviados >= self.config.limite_mps
+
+    def _enviar_mensaje(self, handler, phone_id: str, cuerpo: bytes):
+        time.sleep(self.config.latencia())
+        try:
+            payload = json.loads(cuerpo or b'{}')
+        except ValueError:
+            self._contar('errores_json')
+            return self._responder(handler, 400, _error(100, 'Invalid JSON'))
+        self._contar('peticiones')
+
+        if self._excede_limite(phone_id) or self.config.azar() < self.config.tasa_429:
+            self._contar('rechazados_429')
+            return self._responder(handler, 429, _error(130429, 'Rate limit hit', transitorio=True))
+        azar = self.config.azar()
+        if azar < self.config.tasa_error:
+            self._contar('errores_temporales')
+            return self._responder(handler, 503, _error(131016, 'Service unavailable', transitorio=True))
+        if azar < self.config.tasa_error + self.config.tasa_rechazo:
+            self._contar('rechazos_permanentes')
+            return self._responder(handler, 400, _error(131026, 'Message undeliverable'))
+
+        destino = payload.get('to', '')
+        wamid = f'wamid.MOCK{uuid.uuid4().hex}'
+        self._contar('aceptados')
+        self._contar(f"tipo_{payload.get('type', 'text')}")
+        self._programar_estados(phone_id, destino, wamid)
+        return self._responder(handler, 200, {
+            'messaging_product': 'whatsapp',
+            'contacts': [{'input': destino, 'wa_id': destino}],
+            'messages': [{'id': wamid}],
+        })
+
+    def _subir_media(self, handler, cuerpo: bytes):
+        time.sleep(self.config.latencia())
+        tipo = handler.headers.get('Content-Type', '').split(';')[0].strip()
+        if tipo != 'multipart/form-data' or b'name="file"' not in cuerpo:
+            self._contar('media_invalida')
+            return self._responder(handler, 400, _error(100, 'Param file must be a file with one of the following types'))
+        self._contar('media_subidas')
+        return self._responder(handler, 200, {'id': str(random.randint(10 ** 15, 10 ** 16 - 1))})
+
+    # ---------- Webhooks ----------
+
+    def _programar(self, segundos: float, phone_id: str, tipo: str, datos: dict):
+        with self._eventos_cond:
+            self._orden += 1
+            heapq.heappush(self._eventos, (time.monotonic() + segundos, self._orden, phone_id, tipo, datos))
+            self._eventos_cond.notify()
+
+    def _programar_estados(self, phone_id: str, destino: str, wamid: str):
+        if not self.config.webhook_url:
+            return
+        enviado, entregado, leido = (ms / 1000 for ms in self.config.demoras_estados_ms)
+        self._programar(enviado, phone_id, 'status', {'id': wamid, 'status': 'sent', 'recipient_id': destino})
+        self._programar(entregado, phone_id, 'status', {'id': wamid, 'status': 'delivered', 'recipient_id': destino})
+        if self.config.azar() < self.config.tasa_lectura:
+            self._programar(leido, phone_id, 'status', {'id': wamid, 'status': 'read', 'recipient_id': destino})
+            if self.config.azar() < self.config.tasa_respuesta:
+                self._programar(leido + 1, phone_id, 'message', {
+                    'from': destino,
+                    'id': f'wamid.MOCKIN{uuid.uuid4().hex}',
+                    'type': 'text',
+                    'text': {'body': random.choice(RESPUESTAS_SIMULADAS)},
+                })
+
+    def _entregar_webhooks(self):
+        while not self._detener.is_set():
+            with self._eventos_cond:
+                while not self._detener.is_set():
+                    ahora = time.monotonic()
+                    if self._eventos and self._eventos[0][0] <= ahora:
+                        break
+                    espera = self._eventos[0][0] - ahora if self._eventos else None
+                    self._eventos_cond.wait(espera)
+                if self._detener.is_set():
+                    return
+                _, _, phone_id, tipo, datos = heapq.heappop(self._eventos)
+            self._llamar_webhook(phone_id, tipo, datos)
+
+    def _llamar_webhook(self, phone_id: str, tipo: str, datos: dict):
+        marca = str(int(time.time()))
+        valor = {
+            'messaging_product': 'whatsapp',
+            'metadata': {'display_phone_number': '573000000000', 'phone_number_id': phone_id},
+        }
+        if tipo == 'status':
+            valor['statuses'] = [{**datos, 'timestamp': marca}]
+        else:
+            valor['contacts'] = [{'profile': {'name': 'Usuario Mock'}, 'wa_id': datos['from']}]
+            valor['messages'] = [{**datos, 'timestamp': marca}]
+        payload = {
+            'object': 'whatsapp_business_account',
+            'entry': [{'id': 'WABA_MOCK', 'changes': [{'value': valor, 'field': 'messages'}]}],
+        }
+        try:
+            resp = self._sesion.post(self.config.webhook_url, json=payload, timeout=10)
+            self._contar('webhooks_ok' if resp.status_code < 400 else 'webhooks_error')
+        except requests.RequestException:
+            self._contar('webhooks_error')
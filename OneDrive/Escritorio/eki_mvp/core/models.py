@@ -1,16 +1,23 @@
 from django.db import models
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 import re
 import openpyxl # <--- Nueva librería
 import os
 from django.db import IntegrityError
+from django.utils import timezone
+from django.conf import settings
+from .plantillas import compilar as compilar_plantilla, invalidar as invalidar_plantilla, normalizar_campo
+from . import ventana
 
 # 1. ESTUDIANTE
 class Estudiante(models.Model):
     nombre = models.CharField(max_length=100)
     telefono = models.CharField(max_length=20, unique=True)
+    email = models.EmailField(blank=True, help_text="Para campañas por email")
+    # Columnas extra del Excel ({curso}, {fecha_pago}...) para personalizar plantillas
+    datos_extra = models.JSONField(default=dict, blank=True)
     activo = models.BooleanField(default=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
 
@@ -40,7 +47,15 @@ class Plantilla(models.Model):
     # Campos para mensajes con imágenes en WhatsApp
     tiene_imagen = models.BooleanField(default=False, help_text="¿Esta plantilla incluye una imagen?")
     url_imagen = models.URLField(max_length=500, blank=True, null=True, help_text="URL de la imagen a enviar")
-    
+
+    def clean(self):
+        # Marcadores mal escritos ({Nombre Completo}, llaves sin cerrar) se rechazan en el formulario
+        compilar_plantilla(self).validar()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidar_plantilla(self.pk)
+
     def __str__(self): return self.nombre_interno
 
 # 3. CAMPAÑA
@@ -67,14 +82,61 @@ class Campana(models.Model):
 
     # Línea de origen (opcional)
     linea_origen = models.ForeignKey('Linea', null=True, blank=True, on_delete=models.SET_NULL)
+    # Varias líneas: los destinatarios se reparten en proporción a la capacidad de cada una
+    lineas = models.ManyToManyField('Linea', blank=True, related_name='campanas_repartidas',
+                                    help_text="Si eliges varias, el envío se reparte entre ellas")
 
     # Envío programado
     fecha_programada = models.DateTimeField(blank=True, null=True)
 
+    # Ritmo de envío (core.ventana): solo dentro del horario y repartido a lo largo de la duración
+    ventana_inicio = models.TimeField(blank=True, null=True, help_text="Hora desde la que se envía, p.ej. 08:00")
+    ventana_fin = models.TimeField(blank=True, null=True, help_text="Hora hasta la que se envía, p.ej. 18:00")
+    duracion_objetivo = models.DurationField(
+        blank=True, null=True,
+        help_text="Tiempo de envío (dentro de la ventana) en el que repartir los mensajes, p.ej. 04:00:00. "
+                  "Vacío con ventana = una ventana completa (sigue al día siguiente si empieza a medias)"
+    )
+
     ejecutada = models.BooleanField(default=False)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_modificacion = models.DateTimeField(auto_now=True)
+
+    # Estado del envío: los workers no reclaman mensajes de campañas pausadas o canceladas
+    ESTADO_CHOICES = [
+        ('BORRADOR', 'Borrador'),
+        ('EN_CURSO', 'En curso'),
+        ('PAUSADA', 'Pausada'),
+        ('CANCELADA', 'Cancelada'),
+        ('COMPLETADA', 'Completada'),
+    ]
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='BORRADOR')
+
+    # Resumen que escribe el último worker al terminar la campaña (ver services.escribir_resumen)
+    fecha_finalizacion = models.DateTimeField(blank=True, null=True)
+    resumen = models.JSONField(blank=True, null=True)
 
     def __str__(self): return self.nombre
+
+    def clean(self):
+        if (self.ventana_inicio is None) != (self.ventana_fin is None):
+            raise ValidationError("La ventana de envío necesita hora de inicio y de fin.")
+        if self.ventana_inicio is not None and self.ventana_inicio == self.ventana_fin:
+            raise ValidationError("La ventana de envío no puede empezar y terminar a la misma hora.")
+
+    def ajustar_a_ventana(self, momento):
+        """`momento` si cae dentro de la ventana de envío; si no, su próxima apertura."""
+        return ventana.ajustar(momento, self.ventana_inicio, self.ventana_fin)
+
+    def lineas_envio(self) -> list:
+        """Líneas activas por las que sale la campaña (vacío = credenciales globales)."""
+        if self.canal_envio != 'whatsapp':
+            return []
+        lineas = [linea for linea in self.lineas.all() if linea.activa]
+        if not lineas and self.linea_origen_id and self.linea_origen.activa:
+            lineas = [self.linea_origen]
+        return lineas
+
     class Meta:
         verbose_name = 'Campaña'
         verbose_name_plural = 'Campañas'
@@ -85,6 +147,19 @@ class Linea(models.Model):
     nombre = models.CharField(max_length=100, help_text='Etiqueta de la línea, p.ej. FKWhatsapp')
     numero = models.CharField(max_length=30, help_text='Número de la línea, p.ej. +573208198063')
 
+    # Credenciales propias de la línea (vacías = WHATSAPP_PHONE_ID / WHATSAPP_TOKEN)
+    phone_id = models.CharField(max_length=50, blank=True, help_text='Phone number ID de la Cloud API')
+    token = models.TextField(blank=True, help_text='Token de acceso de la línea')
+    mensajes_por_segundo = models.PositiveIntegerField(
+        default=80, help_text='Throughput permitido por Meta para este número (define su parte del reparto)'
+    )
+    activa = models.BooleanField(default=True)
+
+    def credenciales(self):
+        """(phone_id, token) de la línea, con las globales como respaldo."""
+        return (self.phone_id or getattr(settings, 'WHATSAPP_PHONE_ID', None),
+                self.token or getattr(settings, 'WHATSAPP_TOKEN', None))
+
     def __str__(self):
         return f"{self.nombre} ({self.numero})"
 
@@ -93,6 +168,7 @@ class EnvioLog(models.Model):
     campana = models.ForeignKey(Campana, on_delete=models.CASCADE)
     estudiante = models.ForeignKey(Estudiante, on_delete=models.CASCADE)
     estado = models.CharField(max_length=20, default='PENDIENTE')
+    linea = models.ForeignKey(Linea, null=True, blank=True, on_delete=models.SET_NULL, help_text="Línea que hizo el envío")
     
     # 👇 ESTA ES LA LÍNEA QUE FALTABA, AGRÉGALA:
     respuesta_api = models.TextField(blank=True, null=True, help_text="Respuesta del servidor")
@@ -102,6 +178,112 @@ class EnvioLog(models.Model):
     def __str__(self):
         return f"{self.estudiante.nombre} - {self.estado}"
 
+    class Meta:
+        indexes = [
+            # Reanudar campañas: "¿a quién ya se le envió en esta campaña?"
+            models.Index(fields=['campana', 'estado', 'estudiante'], name='enviolog_campana_estado_idx'),
+        ]
+
+
+# 5. BANDEJA DE SALIDA (outbox): un registro por mensaje de campaña pendiente de enviar.
+# Se llena al lanzar la campaña y la vacía el comando `procesar_envios`.
+class MensajeSaliente(models.Model):
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('ENVIADO', 'Enviado'),
+        ('FALLIDO', 'Fallido'),
+        ('AGOTADO', 'Reintentos agotados'),  # dead-letter: se puede reencolar desde el admin
+        ('CANCELADO', 'Cancelado'),  # la campaña se canceló antes de enviarlo
+    ]
+    campana = models.ForeignKey(Campana, on_delete=models.CASCADE)
+    estudiante = models.ForeignKey(Estudiante, on_delete=models.CASCADE)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE')
+    # Línea asignada al encolar (null = credenciales globales)
+    linea = models.ForeignKey(Linea, null=True, blank=True, on_delete=models.SET_NULL)
+
+    # Reintentos: los workers solo reclaman mensajes con proximo_intento vencido
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True, null=True)
+    latencia_ms = models.PositiveIntegerField(blank=True, null=True, help_text="Duración del último intento")
+
+    # Partición (estudiante_id % CAMPANA_PARTICIONES): cada worker arrienda particiones y solo reclama de ellas
+    particion = models.PositiveSmallIntegerField(default=0)
+
+    # Token del lote que reclamó el mensaje (evita que dos workers lo envíen)
+    lote = models.CharField(max_length=32, blank=True, null=True, db_index=True)
+    reclamado_en = models.DateTimeField(blank=True, null=True)
+    # El worker renueva el lease mientras envía; si muere, al vencer otro worker retoma el mensaje
+    lease_hasta = models.DateTimeField(blank=True, null=True)
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.campana} → {self.estudiante} ({self.estado})"
+
+    class Meta:
+        verbose_name = 'Mensaje en cola'
+        verbose_name_plural = 'Bandeja de salida'
+        constraints = [
+            models.UniqueConstraint(fields=['campana', 'estudiante'], name='mensaje_unico_por_campana'),
+        ]
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='mensaje_estado_proximo_idx'),
+            models.Index(fields=['particion', 'estado', 'proximo_intento'], name='mensaje_particion_idx'),
+        ]
+
+
+# Lease (arrendamiento) con expiración: permite que un solo proceso de varios
+# desplegados actúe como líder, p.ej. el programador de campañas
+class Arrendamiento(models.Model):
+    nombre = models.CharField(max_length=100, unique=True)
+    titular = models.CharField(max_length=100)
+    expira = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.nombre} → {self.titular} (hasta {self.expira})"
+
+
+# Cupo (token bucket) de envío de una línea. core.rate_limiter lo descuenta con un UPDATE
+# condicionado sobre esta fila, atómico entre hilos y workers sin tomar locks aparte
+class CupoEnvio(models.Model):
+    clave = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    actualizado = models.FloatField(help_text='time.time() del último descuento')
+    # Totales de todos los workers (se suman con F(), sin perder incrementos)
+    esperas = models.BigIntegerField(default=0)
+    ms_esperando = models.BigIntegerField(default=0)
+    respuestas = models.BigIntegerField(default=0)
+    ms_respuestas = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave}: {self.tokens:.1f} tokens"
+
+
+# Imágenes de plantillas ya subidas a la Media API de WhatsApp: el envío usa `image.id`
+# en lugar de que Meta descargue la URL una vez por destinatario. Los ids caducan (~30 días).
+class MediaWhatsapp(models.Model):
+    url = models.URLField(max_length=500)
+    hash_contenido = models.CharField(max_length=64, help_text="SHA-256 del archivo subido")
+    phone_id = models.CharField(max_length=50, help_text="Los media id son válidos solo para la línea que los subió")
+    media_id = models.CharField(max_length=100, db_index=True)
+    mime_type = models.CharField(max_length=50)
+    tamano_bytes = models.PositiveIntegerField()
+    subido_en = models.DateTimeField(default=timezone.now)
+    expira = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.url} → {self.media_id} (hasta {self.expira:%Y-%m-%d})"
+
+    class Meta:
+        verbose_name = 'Imagen subida a WhatsApp'
+        verbose_name_plural = 'Imágenes subidas a WhatsApp'
+        constraints = [
+            models.UniqueConstraint(fields=['url', 'hash_contenido', 'phone_id'], name='media_unica_por_linea'),
+        ]
+
 
 # Registro de mensajes enviados/recibidos por WhatsApp
 class WhatsappLog(models.Model):
@@ -115,17 +297,61 @@ class WhatsappLog(models.Model):
         return f"{self.telefono} - {self.estado} ({self.mensaje_id})"
 
 
+# Cuerpo crudo de cada POST del webhook: la vista solo lo guarda y el comando procesar_webhooks lo procesa
+class WebhookEvento(models.Model):
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('PROCESADO', 'Procesado'),
+        ('ERROR', 'Error'),
+    ]
+    cuerpo = models.TextField()
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE')
+    # Token del lote que reclamó el evento (evita que dos consumidores lo procesen)
+    lote = models.CharField(max_length=32, blank=True, null=True, db_index=True)
+    reclamado_en = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    recibido_en = models.DateTimeField(auto_now_add=True)
+    procesado_en = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Webhook {self.pk} ({self.estado})"
+
+    class Meta:
+        verbose_name = 'Evento del webhook'
+        verbose_name_plural = 'Eventos del webhook'
+        indexes = [
+            models.Index(fields=['estado', 'id'], name='webhook_estado_idx'),
+        ]
+
+
+
+# Ids de los mensajes entrantes ya recibidos. Respaldo en la base de la deduplicación del
+# webhook (core.webhook): si el cache olvidó un id, el índice único igual frena el reintento
+class MensajeRecibido(models.Model):
+    mensaje_id = models.CharField(max_length=128, unique=True)
+    recibido_en = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.mensaje_id
+
+    class Meta:
+        verbose_name = 'Mensaje recibido'
+        verbose_name_plural = 'Mensajes recibidos'
+
 # Procesar Excel subido: crear Estudiantes y agregarlos a la campaña
 @receiver(post_save, sender=Campana)
 def procesar_excel_campana(sender, instance, created, **kwargs):
     # Si hay un archivo y no hay destinatarios, intentamos cargarlo
-    if instance.archivo_excel and instance.destinatarios.count() == 0:
+    if instance.archivo_excel and not instance.destinatarios.exists():
         try:
             file_path = instance.archivo_excel.path
             if os.path.exists(file_path):
                 wb = openpyxl.load_workbook(file_path)
                 sheet = wb.active
-                # Esperamos: columna A = Nombre, columna B = Telefono
+                # Esperamos: columna A = Nombre, columna B = Telefono; las demás columnas
+                # quedan en datos_extra con su encabezado normalizado ('Fecha de Pago' → {fecha_de_pago})
+                encabezados = [normalizar_campo(c) if c is not None else '' for c in next(sheet.iter_rows(max_row=1, values_only=True), ())]
                 for row in sheet.iter_rows(min_row=2, values_only=True):
                     if not row: 
                         continue
@@ -133,6 +359,11 @@ def procesar_excel_campana(sender, instance, created, **kwargs):
                     telefono = str(row[1]).strip() if len(row) > 1 and row[1] is not None else ''
                     if not telefono:
                         continue
+                    extra = {
+                        campo: str(valor).strip()
+                        for campo, valor in zip(encabezados[2:], row[2:])
+                        if campo and valor is not None
+                    }
                     # Normalizamos y creamos/obtenemos estudiante
                     try:
                         estudiante, created_est = Estudiante.objects.get_or_create(telefono=telefono, defaults={'nombre': nombre})
@@ -142,10 +373,53 @@ def procesar_excel_campana(sender, instance, created, **kwargs):
                         if len(telefono_clean) == 10:
                             telefono_clean = f"57{telefono_clean}"
                         estudiante, created_est = Estudiante.objects.get_or_create(telefono=telefono_clean, defaults={'nombre': nombre})
+                    if extra and any(estudiante.datos_extra.get(k) != v for k, v in extra.items()):
+                        estudiante.datos_extra = {**estudiante.datos_extra, **extra}
+                        estudiante.save(update_fields=['datos_extra'])
                     # Añadimos a destinatarios
                     instance.destinatarios.add(estudiante)
                 # Guardar para asegurar M2M
                 instance.save()
         except Exception:
             # Si falla la lectura del excel no queremos romper el flujo de guardado
-            pass
\ No newline at end of file
+            pass
+
+# Avisar al programador de campañas (core/scheduler.py) que hay cambios por sincronizar
+@receiver([post_save, post_delete], sender=Campana)
+def notificar_programador(sender, instance, **kwargs):
+    from .scheduler import notificar_cambio
+    notificar_cambio()
+
+# Contexto de conversación del bot (core/contexto.py): los cambios sueltos lo invalidan.
+# Los envíos en bloque (BufferLogs) lo actualizan por su cuenta; no hay post_delete de
+# EnvioLog para no perder el borrado rápido en cascada de campañas y estudiantes
+@receiver(post_save, sender=EnvioLog)
+def invalidar_contexto_envio(sender, instance, **kwargs):
+    from .contexto import invalidar, invalidar_estudiantes
+    if EnvioLog.estudiante.is_cached(instance):
+        invalidar([instance.estudiante.telefono])
+    else:
+        invalidar_estudiantes([instance.estudiante_id])
+
+
+@receiver([post_save, post_delete], sender=Estudiante)
+def invalidar_contexto_estudiante(sender, instance, **kwargs):
+    from .contexto import invalidar
+    invalidar([instance.telefono])
+
+
+@receiver(post_save, sender=Campana)
+def invalidar_contexto_campana(sender, instance, created, **kwargs):
+    # El nombre de la campaña es la "siguiente tarea" de quienes la tienen pendiente
+    if not created:
+        from .contexto import invalidar_estudiantes
+        invalidar_estudiantes(
+            EnvioLog.objects.filter(campana=instance, estado='PENDIENTE').values_list('estudiante_id', flat=True)
+        )
+
+
+@receiver(pre_delete, sender=Campana)
+def invalidar_contexto_campana_borrada(sender, instance, **kwargs):
+    # Sus EnvioLog se borran en cascada: los estudiantes pierden esos envíos en su progreso
+    from .contexto import invalidar_estudiantes
+    invalidar_estudiantes(EnvioLog.objects.filter(campana=instance).values_list('estudiante_id', flat=True).distinct())
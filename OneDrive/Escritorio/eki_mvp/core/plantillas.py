@@ -0,0 +1,139 @@
+"""
+Motor de plantillas de mensajes (Plantilla.cuerpo_mensaje).
+El cuerpo se compila una sola vez en una función de Python (una f-string con
+los campos del destinatario); renderizar un lote es una comprensión de lista.
+Las plantillas compiladas se guardan por proceso y se invalidan al guardar la Plantilla.
+
+Sintaxis:
+    {nombre}                   campo del estudiante (nombre, primer_nombre, telefono, email)
+    {curso}                    columna extra del destinatario (Estudiante.datos_extra)
+    {curso|sin asignar}        valor por defecto si el destinatario no lo tiene
+    {{ y }}                    llaves literales
+"""
+import re
+import threading
+import unicodedata
+
+from django.core.exceptions import ValidationError
+
+# Campos propios del estudiante; cualquier otro nombre se busca en datos_extra
+CAMPOS_ESTUDIANTE = ('nombre', 'primer_nombre', 'telefono', 'email')
+
+_TOKEN = re.compile(r'\{\{|\}\}|\{([^{}]*)\}|[{}]')
+_CAMPO_VALIDO = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+def normalizar_campo(nombre) -> str:
+    """'Fecha de Pago' → 'fecha_de_pago' (encabezados de Excel y marcadores)."""
+    texto = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+
+
+class PlantillaCompilada:
+    """
+    Cuerpo de plantilla ya analizado; `errores` lista los marcadores inválidos.
+
+    Se compila a una f-string (`f"{L1}{e.nombre}{L3}"`): los textos fijos, los
+    valores por defecto y las claves de datos_extra se pasan como variables, así
+    que el código generado solo contiene identificadores propios y nunca texto
+    de la plantilla.
+    """
+
+    def __init__(self, cuerpo: str):
+        self.cuerpo = cuerpo
+        self.campos = []
+        self.errores = []
+        variables = {'V': {}}
+        expresion = []
+        literal = []
+        posicion = 0
+
+        def cerrar_literal():
+            if literal:
+                nombre = f'L{len(variables)}'
+                variables[nombre] = ''.join(literal)
+                expresion.append(f'{{{nombre}}}')
+                literal.clear()
+
+        for coincidencia in _TOKEN.finditer(cuerpo):
+            literal.append(cuerpo[posicion:coincidencia.start()])
+            posicion = coincidencia.end()
+            token = coincidencia.group(0)
+
+            if token in ('{{', '}}'):
+                literal.append(token[0])
+                continue
+            if token in ('{', '}'):
+                # Llave suelta: se deja literal (las plantillas viejas pueden tenerlas)
+                self.errores.append(f"Llave sin cerrar o sin abrir en la posición {coincidencia.start()}")
+                literal.append(token)
+                continue
+
+            campo, _, defecto = coincidencia.group(1).partition('|')
+            campo, defecto = campo.strip(), defecto.strip()
+            if not _CAMPO_VALIDO.match(campo):
+                self.errores.append(f"Marcador inválido: {token} (usa minúsculas, números y _ , p.ej. {{nombre}})")
+                literal.append(token)
+                continue
+
+            cerrar_literal()
+            self.campos.append(campo)
+            i = len(variables)
+            variables[f'D{i}'] = defecto
+            if campo == 'primer_nombre':
+                valor = "(e.nombre or '').partition(' ')[0]"
+            elif campo in CAMPOS_ESTUDIANTE:
+                valor = f'e.{campo}'
+            else:
+                variables[f'K{i}'] = campo
+                valor = f'(e.datos_extra or V).get(K{i})'
+            expresion.append(f'{{{valor} or D{i}}}' if defecto or campo not in CAMPOS_ESTUDIANTE else f'{{{valor}}}')
+
+        literal.append(cuerpo[posicion:])
+        cerrar_literal()
+
+        fstring = 'f"' + ''.join(expresion) + '"'
+        codigo = (
+            f"def renderizar(e):\n    return {fstring}\n"
+            f"def renderizar_lote(estudiantes):\n    return [{fstring} for e in estudiantes]\n"
+        )
+        exec(compile(codigo, '<plantilla>', 'exec'), variables)
+        self._renderizar = variables['renderizar']
+        self._renderizar_lote = variables['renderizar_lote']
+
+    def renderizar(self, estudiante) -> str:
+        return self._renderizar(estudiante)
+
+    def renderizar_lote(self, estudiantes) -> list:
+        """Renderiza para muchos destinatarios en una sola pasada (sin llamadas por mensaje)."""
+        return self._renderizar_lote(estudiantes)
+
+    def validar(self):
+        if self.errores:
+            raise ValidationError({'cuerpo_mensaje': self.errores})
+
+
+_compiladas = {}
+_compiladas_lock = threading.Lock()
+
+
+def compilar(plantilla) -> PlantillaCompilada:
+    """PlantillaCompilada (cacheada por proceso) de una Plantilla."""
+    guardada = _compiladas.get(plantilla.pk)
+    # Comparamos el texto: otro proceso pudo editar la plantilla sin que este se enterara
+    if guardada is not None and guardada.cuerpo == plantilla.cuerpo_mensaje:
+        return guardada
+    compilada = PlantillaCompilada(plantilla.cuerpo_mensaje)
+    if plantilla.pk is not None:
+        with _compiladas_lock:
+            _compiladas[plantilla.pk] = compilada
+    return compilada
+
+
+def invalidar(plantilla_id):
+    with _compiladas_lock:
+        _compiladas.pop(plantilla_id, None)
+
+
+def renderizar(plantilla, estudiante) -> str:
+    return compilar(plantilla).renderizar(estudiante)
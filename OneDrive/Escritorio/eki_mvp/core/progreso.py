@@ -0,0 +1,117 @@
+"""
+Progreso en vivo de las campañas: encolados, enviados, fallidos, en reintento,
+mensajes/seg y tiempo estimado restante.
+
+Los contadores viven en el cache de Django: los workers los suman una vez por
+lote procesado y `encolar_campana` los resincroniza con la bandeja de salida,
+así que consultar el progreso (API y admin) no hace COUNT sobre EnvioLog ni
+toca la base, sin importar el tamaño de la campaña. El cache es compartido por
+todos los procesos (ver CACHES en settings); si los contadores de una campaña
+no están (cache vaciado, recortado o reiniciado) se vuelven a contar una vez
+desde la bandeja de salida (MensajeSaliente). Con DatabaseCache el incr no es
+atómico y dos workers pueden pisarse una suma: mientras corre el progreso es
+aproximado, y al vaciarse la bandeja (`finalizar_campana_si_completa`) se
+resincroniza con la cuenta exacta.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+# Segundos promediados para el ritmo (mensajes/seg) y el ETA
+VENTANA_RITMO = 10
+
+CONTADORES = ('encolados', 'enviados', 'fallidos', 'reintentando')
+
+
+def _clave(campana_id, campo: str) -> str:
+    return f'progreso:{campana_id}:{campo}'
+
+
+def _sumar(clave: str, valor: int, timeout=None):
+    if not valor:
+        return
+    cache.add(clave, 0, timeout=timeout)
+    try:
+        cache.incr(clave, valor)
+    except ValueError:
+        # La clave expiró entre add e incr
+        cache.set(clave, valor, timeout=timeout)
+
+
+def contar_bandeja(campana_id) -> dict:
+    """Los contadores de la campaña contados en la bandeja de salida (una consulta)."""
+    from .models import MensajeSaliente
+
+    return MensajeSaliente.objects.filter(campana_id=campana_id).aggregate(
+        total=Count('id', filter=~Q(estado='CANCELADO')),
+        enviados=Count('id', filter=Q(estado='ENVIADO')),
+        fallidos=Count('id', filter=Q(estado__in=['FALLIDO', 'AGOTADO'])),
+        reintentando=Count('id', filter=Q(estado='PENDIENTE', intentos__gt=0)),
+    )
+
+
+def sincronizar(campana_id, total: int, enviados: int, fallidos: int, reintentando: int):
+    """Fija los contadores con el estado real de la bandeja (al encolar o reanudar)."""
+    cache.set_many({
+        _clave(campana_id, 'encolados'): total,
+        _clave(campana_id, 'enviados'): enviados,
+        _clave(campana_id, 'fallidos'): fallidos,
+        _clave(campana_id, 'reintentando'): reintentando,
+    }, timeout=None)
+
+
+def registrar_lote(campana_id, exitosos: int = 0, fallidos: int = 0, reintentos: int = 0, retomados: int = 0):
+    """
+    Suma el resultado de un lote. `reintentos` son los mensajes reprogramados en el lote
+    y `retomados` los que venían de un reintento anterior (salen de 'reintentando').
+    """
+    _sumar(_clave(campana_id, 'enviados'), exitosos)
+    _sumar(_clave(campana_id, 'fallidos'), fallidos)
+    _sumar(_clave(campana_id, 'reintentando'), reintentos - retomados)
+    # Un contador por segundo para el ritmo; expiran solos
+    _sumar(_clave(campana_id, f's{int(time.time())}'), exitosos + fallidos, timeout=VENTANA_RITMO * 3)
+
+
+def registrar_reencolados(campana_id, cantidad: int):
+    """Los mensajes fallidos que se devuelven a la cola dejan de contar como fallidos."""
+    _sumar(_clave(campana_id, 'fallidos'), -cantidad)
+
+
+def registrar_cancelados(campana_id, cantidad: int):
+    """Los mensajes cancelados salen de la campaña: ya no cuentan como encolados."""
+    _sumar(_clave(campana_id, 'encolados'), -cantidad)
+
+
+def obtener(campana_id) -> dict:
+    """
+    Progreso de la campaña leído del cache (una llamada get_many). Si faltan los
+    contadores se cuentan en la bandeja y se guardan para las siguientes lecturas.
+    """
+    ahora = int(time.time())
+    segundos = [f's{s}' for s in range(ahora - VENTANA_RITMO, ahora)]
+    datos = cache.get_many([_clave(campana_id, campo) for campo in (*CONTADORES, *segundos)])
+    if _clave(campana_id, 'encolados') not in datos:
+        conteo = contar_bandeja(campana_id)
+        if conteo['total']:
+            sincronizar(campana_id, **conteo)
+            datos.update({_clave(campana_id, 'encolados'): conteo['total'],
+                          **{_clave(campana_id, campo): conteo[campo] for campo in CONTADORES[1:]}})
+
+    def valor(campo):
+        return datos.get(_clave(campana_id, campo)) or 0
+
+    encolados, enviados, fallidos = valor('encolados'), valor('enviados'), valor('fallidos')
+    pendientes = max(0, encolados - enviados - fallidos)
+    ritmo = sum(valor(s) for s in segundos) / VENTANA_RITMO
+    return {
+        'disponible': _clave(campana_id, 'encolados') in datos,
+        'encolados': encolados,
+        'enviados': enviados,
+        'fallidos': fallidos,
+        'reintentando': max(0, valor('reintentando')),
+        'pendientes': pendientes,
+        'porcentaje': round(100 * (enviados + fallidos) / encolados, 1) if encolados else 0.0,
+        'mensajes_por_segundo': round(ritmo, 1),
+        'eta_segundos': round(pendientes / ritmo) if ritmo and pendientes else None,
+    }
@@ -0,0 +1,192 @@
+"""
+Limitador de velocidad (token bucket) por línea de WhatsApp.
+Meta limita los mensajes por segundo de cada número según su tier; si lo
+superamos responde 429 / código 130429. El estado del bucket es una fila de la
+base de datos (CupoEnvio) que se descuenta con un solo UPDATE condicionado, así
+que se comparte entre hilos y workers sin locks que haya que sondear.
+
+Hay dos prioridades sobre el mismo cupo de la línea:
+- INTERACTIVA (respuestas del bot): reserva su turno de inmediato y solo espera
+  detrás de otras respuestas.
+- MASIVA (campañas): nunca reserva turnos a futuro y solo toma un token si el
+  bucket queda por encima de la reserva interactiva (WHATSAPP_RESERVA_INTERACTIVA),
+  así que una respuesta siempre pasa delante de la campaña.
+"""
+import time
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Least
+
+from .models import CupoEnvio
+
+INTERACTIVA = 'interactiva'
+MASIVA = 'masiva'
+
+
+def _metricas_vacias():
+    return {'adquisiciones': 0, 'esperas': 0, 'segundos_esperando': 0.0, 'espera_maxima': 0.0}
+
+
+_metricas_locales = defaultdict(_metricas_vacias)
+_metricas_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Bucket de `capacidad` tokens que se recarga a `tasa` tokens/seg.
+
+    `adquirir()` reserva un token y devuelve cuánto hay que esperar para usarlo:
+    los tokens pueden quedar en negativo, de modo que cada llamador obtiene su
+    turno con un solo UPDATE y duerme sin retener nada.
+    """
+
+    def __init__(self, clave: str, tasa: float, capacidad: float = None, reserva: float = 0.0):
+        self.clave = clave
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad or tasa)
+        # Tokens que el tráfico masivo deja siempre libres para respuestas interactivas
+        self.piso = self.capacidad * reserva
+        # Un solo hilo masivo por proceso sondea el bucket; los demás esperan su turno aquí
+        self._turno_masivo = threading.Lock()
+        # Segundos que los hilos masivos de este proceso llevan dormidos esperando tokens
+        self._dormido_masivo = 0.0
+
+    def _crear(self):
+        try:
+            with transaction.atomic():
+                CupoEnvio.objects.create(clave=self.clave, tokens=self.capacidad, actualizado=time.time())
+        except IntegrityError:
+            # Otro worker la creó al mismo tiempo
+            pass
+
+    def _reservar(self, tokens: float, minimo: float = None):
+        """
+        Descuenta `tokens` del bucket y retorna (True, segundos hasta poder usarlos).
+        Con `minimo` solo los descuenta si hay al menos esa cantidad disponible; si no,
+        retorna (False, segundos hasta que la haya) sin reservar nada.
+        """
+        ahora = time.time()
+        # Tokens tras la recarga desde el último descuento, calculados por la BD en el mismo UPDATE
+        recarga = Least(Value(self.capacidad), F('tokens') + (Value(ahora) - F('actualizado')) * Value(self.tasa))
+        cupo = CupoEnvio.objects.filter(clave=self.clave)
+        with transaction.atomic():
+            condicion = cupo.alias(disponibles=recarga)
+            if minimo is not None:
+                condicion = condicion.filter(disponibles__gte=minimo)
+            reservado = bool(condicion.update(tokens=recarga - tokens, actualizado=ahora))
+            # Dentro de la transacción la fila sigue bloqueada por nuestro UPDATE
+            estado = cupo.values_list('tokens', 'actualizado').first()
+        if estado is None:
+            self._crear()
+            return self._reservar(tokens, minimo)
+        disponibles, ultimo = estado
+        disponibles = min(self.capacidad, disponibles + (ahora - ultimo) * self.tasa)
+        if not reservado:
+            return False, (minimo - disponibles) / self.tasa
+        return True, max(0.0, -disponibles / self.tasa)
+
+    def adquirir(self, tokens: float = 1, prioridad: str = INTERACTIVA) -> float:
+        """Espera (bloqueando el hilo) hasta que haya tokens. Retorna los segundos esperados."""
+        if self.tasa <= 0:
+            return 0.0
+        if prioridad == MASIVA:
+            espera = self._adquirir_masivo(tokens)
+        else:
+            _, espera = self._reservar(tokens)
+            if espera > 0:
+                time.sleep(espera)
+        registrar_espera(self.clave, espera, prioridad)
+        return espera
+
+    def _adquirir_masivo(self, tokens: float) -> float:
+        # Sin reservas a futuro: si el bucket está por debajo de la reserva interactiva
+        # se duerme y se vuelve a mirar, así una respuesta que llegue mientras tanto pasa primero
+        # La espera es solo el tiempo dormido por falta de tokens: el propio y el de los hilos que
+        # tenían el turno delante. La latencia del UPDATE no cuenta como frenado
+        minimo = min(self.piso + tokens, self.capacidad)
+        antes = self._dormido_masivo
+        with self._turno_masivo:
+            dormido = self._dormido_masivo - antes
+            while True:
+                reservado, espera = self._reservar(tokens, minimo=minimo)
+                if reservado:
+                    break
+                time.sleep(espera)
+                self._dormido_masivo += espera
+                dormido += espera
+        return dormido
+
+    def penalizar(self, segundos: float = 1.0):
+        """Vacía el bucket tras un 429 de Meta para que todos los hilos/workers frenen."""
+        if self.tasa > 0:
+            self._reservar(self.capacidad + segundos * self.tasa)
+
+
+def registrar_espera(clave: str, segundos: float, prioridad: str = None):
+    with _metricas_lock:
+        for m in (_metricas_locales[clave], _metricas_locales[f'{clave}:{prioridad}']):
+            m['adquisiciones'] += 1
+            m['espera_maxima'] = max(m['espera_maxima'], segundos)
+            if segundos > 0:
+                m['esperas'] += 1
+                m['segundos_esperando'] += segundos
+    # Totales compartidos entre workers, en la fila del bucket (un UPDATE atómico)
+    totales = {}
+    if segundos > 0:
+        totales.update(esperas=F('esperas') + 1, ms_esperando=F('ms_esperando') + int(segundos * 1000))
+    if prioridad == INTERACTIVA:
+        # Demora de las respuestas del bot en la cola de la línea (todas, hayan esperado o no)
+        totales.update(respuestas=F('respuestas') + 1, ms_respuestas=F('ms_respuestas') + int(segundos * 1000))
+    if totales:
+        CupoEnvio.objects.filter(clave=clave).update(**totales)
+
+
+def metricas(clave: str) -> dict:
+    """Tiempo que los envíos de esta línea pasaron frenados por el limitador, total y por prioridad."""
+    with _metricas_lock:
+        locales = {
+            'proceso': dict(_metricas_locales.get(clave) or _metricas_vacias()),
+            INTERACTIVA: dict(_metricas_locales.get(f'{clave}:{INTERACTIVA}') or _metricas_vacias()),
+            MASIVA: dict(_metricas_locales.get(f'{clave}:{MASIVA}') or _metricas_vacias()),
+        }
+    totales = CupoEnvio.objects.filter(clave=clave).values(
+        'esperas', 'ms_esperando', 'respuestas', 'ms_respuestas'
+    ).first() or {'esperas': 0, 'ms_esperando': 0, 'respuestas': 0, 'ms_respuestas': 0}
+    respuestas = totales['respuestas']
+    return {
+        **locales,
+        'global': {
+            'esperas': totales['esperas'],
+            'segundos_esperando': totales['ms_esperando'] / 1000,
+            'respuestas': respuestas,
+            'espera_respuestas_ms': totales['ms_respuestas'] / respuestas if respuestas else 0.0,
+        },
+    }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def obtener_limitador(phone_id: str, tasa: float = None, capacidad: float = None) -> TokenBucket:
+    """
+    Bucket de la línea `phone_id` (por defecto con WHATSAPP_RATE_LIMIT / WHATSAPP_RATE_BURST).
+    Con una `tasa` propia de la línea, la ráfaga por defecto es un segundo de esa tasa.
+    La fracción reservada a respuestas interactivas es WHATSAPP_RESERVA_INTERACTIVA.
+    """
+    if tasa is None:
+        tasa = getattr(settings, 'WHATSAPP_RATE_LIMIT', 80)
+        if capacidad is None:
+            capacidad = getattr(settings, 'WHATSAPP_RATE_BURST', None)
+    if capacidad is None:
+        capacidad = tasa
+    clave = (phone_id, tasa, capacidad)
+    with _buckets_lock:
+        if clave not in _buckets:
+            _buckets[clave] = TokenBucket(f'whatsapp:{phone_id}', tasa, capacidad,
+                                          reserva=getattr(settings, 'WHATSAPP_RESERVA_INTERACTIVA', 0.2))
+        return _buckets[clave]
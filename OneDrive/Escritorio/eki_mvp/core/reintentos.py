@@ -0,0 +1,76 @@
+"""
+Política de reintentos para envíos de campaña.
+Clasifica el resultado de un envío (`enviar_whatsapp` o un canal de core.canales)
+en error reintentable o permanente y calcula el backoff exponencial con jitter del siguiente intento.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .utils import CODIGOS_RATE_LIMIT
+
+REINTENTABLE = 'reintentable'
+PERMANENTE = 'permanente'
+
+# Códigos de la Graph API que indican un fallo temporal del lado de Meta
+CODIGOS_TEMPORALES = (
+    1,       # API Unknown
+    2,       # API Service (temporal)
+    4,       # Demasiadas llamadas de la app
+    131000,  # Something went wrong
+    131016,  # Servicio no disponible
+    133004,  # Servidor temporalmente no disponible
+) + CODIGOS_RATE_LIMIT
+
+
+def clasificar_error(resultado: dict = None, error: Exception = None) -> str:
+    """
+    Decide si un envío fallido vale la pena reintentarlo.
+
+    - Excepciones, timeouts y errores de conexión (sin respuesta HTTP): reintentable
+    - HTTP 429 y 5xx, o códigos temporales de Meta / `is_transient`: reintentable
+    - Credenciales ausentes, número inválido, plantilla rechazada, etc.: permanente
+    """
+    if error is not None or resultado is None:
+        return REINTENTABLE
+
+    if resultado.get('reintentable') is not None:
+        # El canal ya lo decidió (p.ej. email: respuestas SMTP 4xx temporales, 5xx definitivas)
+        return REINTENTABLE if resultado['reintentable'] else PERMANENTE
+
+    respuesta = resultado.get('response')
+    status_code = resultado.get('status_code')
+
+    if respuesta == 'Credentials not set':
+        return PERMANENTE
+    if status_code is None:
+        return REINTENTABLE
+    if status_code == 429 or status_code >= 500:
+        return REINTENTABLE
+    if isinstance(respuesta, dict):
+        if respuesta.get('is_transient') or respuesta.get('code') in CODIGOS_TEMPORALES:
+            return REINTENTABLE
+    return PERMANENTE
+
+
+def calcular_espera(intento: int, base: float = None, maximo: float = None) -> float:
+    """
+    Segundos antes del intento número `intento` (1, 2, 3...): exponencial con
+    "equal jitter" (mitad fija + mitad aleatoria) para que los reintentos de
+    un corte masivo no lleguen todos a la vez.
+    """
+    base = base if base is not None else getattr(settings, 'CAMPANA_BACKOFF_BASE', 2)
+    maximo = maximo if maximo is not None else getattr(settings, 'CAMPANA_BACKOFF_MAX', 300)
+    tope = min(maximo, base * (2 ** (intento - 1)))
+    return tope / 2 + random.uniform(0, tope / 2)
+
+
+def programar_reintento(intento: int):
+    """Fecha del próximo intento tras `intento` fallos."""
+    return timezone.now() + timedelta(seconds=calcular_espera(intento))
+
+
+def max_intentos() -> int:
+    return getattr(settings, 'CAMPANA_MAX_INTENTOS', 5)
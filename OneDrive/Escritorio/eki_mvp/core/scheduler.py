@@ -0,0 +1,183 @@
+"""
+Programador de campañas (Campana.fecha_programada).
+Mantiene en memoria una cola ordenada por fecha de las campañas por lanzar y
+duerme exactamente hasta la siguiente, en lugar de consultar la tabla cada
+pocos segundos. Las altas y ediciones llegan por una marca de versión en el
+cache (la actualiza la señal post_save de Campana): solo entonces se consulta
+la base, y únicamente las campañas modificadas desde la última sincronización.
+Cada `resync_segundos` se recarga todo desde la base por si se perdió un aviso.
+
+Las campañas vencidas hace más de PROGRAMADOR_GRACIA_MINUTOS (p.ej. el
+programador estuvo caído o se programó una fecha pasada) no se disparan: se
+avisa en el log y quedan sin ejecutar para lanzarlas a mano o reprogramarlas.
+
+Se puede desplegar más de una instancia: solo la que tiene el lease
+`programador_campanas` dispara campañas; las demás esperan a que expire.
+"""
+import os
+import time
+import uuid
+import heapq
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Campana, MensajeSaliente
+from .leases import adquirir_lease, liberar_lease
+from .services import encolar_campana
+
+CLAVE_VERSION = 'programador:version'
+NOMBRE_LEASE = 'programador_campanas'
+
+
+def notificar_cambio():
+    """Marca que cambió alguna campaña para que el programador resincronice."""
+    cache.set(CLAVE_VERSION, uuid.uuid4().hex, timeout=None)
+
+
+class ProgramadorCampanas:
+    """
+    Args:
+        lease_segundos: duración del lease de líder (se renueva cada tercio)
+        chequeo_segundos: cada cuánto se mira la marca de versión en el cache
+        resync_segundos: cada cuánto se recarga todo desde la base (red de seguridad
+                         para cambios hechos con update() en bloque o un cache no compartido)
+        gracia_minutos: las campañas vencidas hace más que esto no se disparan
+                        (None = PROGRAMADOR_GRACIA_MINUTOS)
+        log: función para los mensajes de estado
+    """
+
+    def __init__(self, lease_segundos: float = 30, chequeo_segundos: float = 1.0,
+                 resync_segundos: float = 600, gracia_minutos: float = None, log=print):
+        self.titular = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_segundos = lease_segundos
+        self.chequeo_segundos = chequeo_segundos
+        self.resync_segundos = resync_segundos
+        if gracia_minutos is None:
+            gracia_minutos = getattr(settings, 'PROGRAMADOR_GRACIA_MINUTOS', 60)
+        self.gracia = timedelta(minutes=gracia_minutos)
+        self.log = log
+
+        self._heap = []            # (fecha_programada, campana_id)
+        self._programadas = {}     # campana_id -> fecha vigente (las entradas viejas del heap se ignoran)
+        self._version = None
+        self._ultima_sync = None
+        self._omitidas = set()     # (campana_id, fecha) vencidas ya avisadas en el log
+        self._detener = threading.Event()
+
+    def detener(self):
+        self._detener.set()
+
+    def _registrar(self, campana_id, fecha):
+        if fecha is None:
+            self._programadas.pop(campana_id, None)
+            return
+        if self._programadas.get(campana_id) == fecha:
+            return
+        self._programadas[campana_id] = fecha
+        heapq.heappush(self._heap, (fecha, campana_id))
+
+    def sincronizar(self, completa: bool = False):
+        """Carga las campañas programadas pendientes (todas, o solo las modificadas)."""
+        campanas = Campana.objects.filter(ejecutada=False).exclude(estado='CANCELADA').annotate(
+            en_cola=Exists(MensajeSaliente.objects.filter(campana=OuterRef('pk')))
+        )
+        marca = timezone.now()
+        if completa or self._ultima_sync is None:
+            campanas = campanas.filter(fecha_programada__isnull=False)
+            self._heap = []
+            self._programadas = {}
+        else:
+            # Margen de 1 s por relojes de distintos servidores
+            campanas = campanas.filter(fecha_modificacion__gte=self._ultima_sync - timedelta(seconds=1))
+
+        for campana_id, fecha, en_cola in campanas.values_list('id', 'fecha_programada', 'en_cola'):
+            # Las que ya están en la bandeja de salida no se vuelven a lanzar
+            self._registrar(campana_id, None if en_cola else fecha)
+        self._ultima_sync = marca
+
+    def _disparar(self, campana_id):
+        # Revalidamos en la base: pudo ejecutarse a mano, cancelarse, borrarse o reprogramarse
+        campana = Campana.objects.select_related('plantilla').filter(
+            pk=campana_id, ejecutada=False, fecha_programada__lte=timezone.now()
+        ).exclude(estado='CANCELADA').first()
+        if campana is None:
+            return
+        encolados = encolar_campana(campana)
+        self.log(f"⏰ Campaña '{campana.nombre}' lanzada: {encolados} mensajes en cola")
+
+    def _omitir(self, campana_id, fecha, ahora):
+        if (campana_id, fecha) in self._omitidas:
+            return
+        self._omitidas.add((campana_id, fecha))
+        nombre = Campana.objects.filter(pk=campana_id).values_list('nombre', flat=True).first()
+        minutos = int((ahora - fecha).total_seconds() // 60)
+        self.log(f"⚠️ Campaña '{nombre}' (id {campana_id}) venció hace {minutos} min, más que la gracia de "
+                 f"{self.gracia.total_seconds() / 60:g} min: no se lanza. Ejecútala a mano o reprográmala")
+
+    def disparar_vencidas(self):
+        ahora = timezone.now()
+        while self._heap and self._heap[0][0] <= ahora:
+            fecha, campana_id = heapq.heappop(self._heap)
+            if self._programadas.get(campana_id) != fecha:
+                continue
+            del self._programadas[campana_id]
+            if fecha < ahora - self.gracia:
+                self._omitir(campana_id, fecha, ahora)
+                continue
+            self._disparar(campana_id)
+
+    def segundos_hasta_proxima(self):
+        while self._heap and self._programadas.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, (self._heap[0][0] - timezone.now()).total_seconds())
+
+    def ejecutar(self):
+        """Bucle principal hasta que se llame a `detener()`."""
+        es_lider = False
+        proxima_renovacion = 0.0
+        proxima_resync = 0.0
+
+        try:
+            while not self._detener.is_set():
+                ahora = time.monotonic()
+                if ahora >= proxima_renovacion:
+                    lider = adquirir_lease(NOMBRE_LEASE, self.titular, self.lease_segundos)
+                    if lider and not es_lider:
+                        self.log(f"👑 {self.titular} es el programador activo")
+                        proxima_resync = ahora
+                    elif es_lider and not lider:
+                        self.log("⚠️ Se perdió el lease: otra instancia tomó el control")
+                    es_lider = lider
+                    proxima_renovacion = ahora + self.lease_segundos / 3
+
+                if not es_lider:
+                    self._detener.wait(proxima_renovacion - time.monotonic())
+                    continue
+
+                version = cache.get(CLAVE_VERSION)
+                if ahora >= proxima_resync:
+                    self.sincronizar(completa=True)
+                    proxima_resync = ahora + self.resync_segundos
+                elif version != self._version:
+                    self.sincronizar()
+                self._version = version
+
+                self.disparar_vencidas()
+
+                # Dormimos hasta la próxima campaña, la próxima renovación o el próximo chequeo
+                espera = min(self.chequeo_segundos, proxima_renovacion - time.monotonic())
+                siguiente = self.segundos_hasta_proxima()
+                if siguiente is not None:
+                    espera = min(espera, siguiente)
+                self._detener.wait(max(0.0, espera))
+        finally:
+            if es_lider:
+                liberar_lease(NOMBRE_LEASE, self.titular)
@@ -1,68 +1,635 @@
 import time
-from .models import EnvioLog
-from .utils import enviar_whatsapp
+import uuid
+import random
+import threading
+import contextlib
+import itertools
+from datetime import timedelta
+from collections import Counter
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q, Avg, Sum, Min
+from django.utils import timezone
+from .models import Campana, EnvioLog, MensajeSaliente
+from .dispatcher import combinar
+from .canales import obtener_canal, CANAL_POR_DEFECTO
+from .log_buffer import BufferLogs
+from .plantillas import compilar as compilar_plantilla
+from .reintentos import clasificar_error, programar_reintento, max_intentos, REINTENTABLE
+from .circuito import lineas_en_pausa, segundos_hasta_reanudar, REVISAR_PAUSAS_SEG
+from . import progreso, ventana
 
-def ejecutar_campana_servicio(campana):
+# Tamaño de lote que reclama cada worker de la bandeja de salida
+TAMANO_LOTE = 100
+
+# Segundos de lease de un lote reclamado; el worker lo renueva cada tercio mientras envía
+LEASE_LOTE_SEG = 60
+
+# Estados de EnvioLog que cierran el envío a un destinatario (no se reenvía)
+ESTADOS_TERMINALES = ('ENVIADO', 'FALLIDO')
+
+# Campañas cuyos mensajes los workers no reclaman; se revisan como mucho cada REVISAR_DETENIDAS_SEG
+ESTADOS_DETENIDOS = ('PAUSADA', 'CANCELADA')
+REVISAR_DETENIDAS_SEG = 1
+
+_detenidas = {'hasta': 0.0, 'campanas': set(), 'ventanas': {}}
+_detenidas_lock = threading.Lock()
+
+
+# Destinatarios leídos por consulta al encolar (paginación por id, memoria constante)
+TAMANO_PAGINA_DESTINATARIOS = 5000
+
+
+def ids_ya_enviados(campana_id, desde: int = None, hasta: int = None) -> set:
+    """
+    Ids de estudiantes con un EnvioLog terminal en la campaña (usa enviolog_campana_estado_idx),
+    opcionalmente solo entre los ids `desde` y `hasta` (inclusive).
+    """
+    logs = EnvioLog.objects.filter(campana_id=campana_id, estado__in=ESTADOS_TERMINALES)
+    if desde is not None:
+        logs = logs.filter(estudiante_id__gte=desde)
+    if hasta is not None:
+        logs = logs.filter(estudiante_id__lte=hasta)
+    return set(logs.values_list('estudiante_id', flat=True))
+
+
+def paginas_destinatarios(campana, campos=('id', 'nombre', 'telefono'), tamano: int = TAMANO_PAGINA_DESTINATARIOS):
+    """
+    Destinatarios activos de la campaña en páginas de `tamano` filas (tuplas con `campos`,
+    el primero debe ser 'id'), ordenados por id.
+
+    Pagina por clave (`id > último id de la página anterior`) en vez de OFFSET, así cada
+    consulta cuesta lo mismo y en memoria solo hay una página, sin importar el tamaño
+    de la audiencia (el queryset completo cachearía todas las instancias).
+    """
+    destinatarios = campana.destinatarios.filter(activo=True).order_by('id').values_list(*campos)
+    ultimo = 0
+    while True:
+        pagina = list(destinatarios.filter(id__gt=ultimo)[:tamano])
+        if not pagina:
+            return
+        yield pagina
+        ultimo = pagina[-1][0]
+
+
+def repartir_lineas(lineas):
+    """
+    Generador infinito de líneas en proporción a `mensajes_por_segundo`
+    (round-robin ponderado suave, como nginx): una línea de 80 msg/s recibe
+    el doble de mensajes que una de 40, intercaladas y no en bloques.
+    Sin líneas produce siempre None (credenciales globales).
+    """
+    pesos = [max(1, linea.mensajes_por_segundo) for linea in lineas]
+    total = sum(pesos)
+    actuales = [0] * len(lineas)
+    while True:
+        if not lineas:
+            yield None
+            continue
+        for i, peso in enumerate(pesos):
+            actuales[i] += peso
+        elegida = max(range(len(lineas)), key=actuales.__getitem__)
+        actuales[elegida] -= total
+        yield lineas[elegida]
+
+
+def encolar_campana(campana) -> int:
+    """
+    Crea un MensajeSaliente por destinatario activo de la campaña, asignando
+    a cada uno una de las líneas de la campaña (ver `repartir_lineas`).
+    Es idempotente: los destinatarios que ya están en cola o que ya tienen
+    un EnvioLog terminal en la campaña se ignoran.
+    Retorna el número de mensajes que quedaron en la bandeja para la campaña.
+
+    Los destinatarios se leen por páginas (`paginas_destinatarios`): la memoria
+    no crece con el tamaño de la audiencia.
+
+    Con ventana horaria o duración objetivo (core.ventana), cada mensaje nuevo
+    recibe su momento de envío en `proximo_intento`, repartidos a intervalos iguales.
+    """
+    # Una campaña pausada o cancelada conserva su estado; reanudarla es explícito (reanudar_envio)
+    Campana.objects.filter(pk=campana.pk).exclude(estado__in=ESTADOS_DETENIDOS).update(estado='EN_CURSO')
+    lineas = repartir_lineas(campana.lineas_envio())
+    total_particiones = particiones()
+    ahora = timezone.now()
+    en_cola = MensajeSaliente.objects.filter(campana=campana)
+    if campana.ventana_inicio is not None or campana.duracion_objetivo is not None:
+        # Solo se reparten los que faltan: los ya enviados o ya en cola no ocupan turno
+        faltan = campana.destinatarios.filter(activo=True).exclude(
+            pk__in=en_cola.values('estudiante_id')
+        ).exclude(
+            pk__in=EnvioLog.objects.filter(campana=campana, estado__in=ESTADOS_TERMINALES).values('estudiante_id')
+        ).count()
+        momentos = ventana.repartir(
+            faltan, ahora, campana.duracion_objetivo, campana.ventana_inicio, campana.ventana_fin,
+        )
+    else:
+        momentos = itertools.repeat(ahora)
+    for pagina in paginas_destinatarios(campana, campos=('id',)):
+        desde, hasta = pagina[0][0], pagina[-1][0]
+        omitir = ids_ya_enviados(campana.pk, desde=desde, hasta=hasta) | set(
+            en_cola.filter(estudiante_id__gte=desde, estudiante_id__lte=hasta).values_list('estudiante_id', flat=True)
+        )
+        MensajeSaliente.objects.bulk_create(
+            [MensajeSaliente(campana=campana, estudiante_id=estudiante_id, linea=next(lineas),
+                             particion=estudiante_id % total_particiones, proximo_intento=next(momentos))
+             for estudiante_id, in pagina if estudiante_id not in omitir],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    # Punto de resincronización de los contadores de progreso (core.progreso)
+    conteo = progreso.contar_bandeja(campana.pk)
+    progreso.sincronizar(campana.pk, **conteo)
+    return conteo['total']
+
+
+def particiones() -> int:
+    return max(1, getattr(settings, 'CAMPANA_PARTICIONES', 8))
+
+
+def campanas_detenidas() -> set:
+    """
+    Ids de campañas pausadas, canceladas o fuera de su ventana horaria de envío
+    (una consulta por proceso cada REVISAR_DETENIDAS_SEG).
+    """
+    with _detenidas_lock:
+        vigente = time.monotonic() < _detenidas['hasta']
+        campanas, ventanas = _detenidas['campanas'], _detenidas['ventanas']
+    if not vigente:
+        campanas, ventanas = set(), {}
+        filas = Campana.objects.filter(
+            Q(estado__in=ESTADOS_DETENIDOS) | Q(estado='EN_CURSO', ventana_inicio__isnull=False)
+        ).values_list('id', 'estado', 'ventana_inicio', 'ventana_fin')
+        for campana_id, estado, inicio, fin in filas:
+            if estado in ESTADOS_DETENIDOS:
+                campanas.add(campana_id)
+            else:
+                ventanas[campana_id] = (inicio, fin)
+        with _detenidas_lock:
+            _detenidas.update(hasta=time.monotonic() + REVISAR_DETENIDAS_SEG, campanas=campanas, ventanas=ventanas)
+
+    # Los que llegan tarde (workers atrasados, reintentos) tampoco salen fuera de horario
+    ahora = timezone.now()
+    return campanas | {c for c, (inicio, fin) in ventanas.items() if not ventana.en_ventana(ahora, inicio, fin)}
+
+
+def _olvidar_detenidas():
+    # El proceso que cambia el estado lo ve al instante; los demás, en menos de REVISAR_DETENIDAS_SEG
+    with _detenidas_lock:
+        _detenidas['hasta'] = 0.0
+
+
+def pausar_campana(campana_id) -> bool:
+    """
+    Deja de reclamar mensajes de la campaña. Los lotes ya reclamados terminan;
+    lo pendiente queda en la bandeja y `reanudar_envio` lo retoma sin reenviar nada.
+    """
+    pausada = Campana.objects.filter(pk=campana_id, estado='EN_CURSO').update(estado='PAUSADA') > 0
+    _olvidar_detenidas()
+    return pausada
+
+
+def reanudar_envio(campana_id) -> bool:
+    """Vuelve a poner en curso una campaña pausada."""
+    reanudada = Campana.objects.filter(pk=campana_id, estado='PAUSADA').update(estado='EN_CURSO') > 0
+    _olvidar_detenidas()
+    if reanudada:
+        # Si la pausa llegó cuando ya no quedaba nada en cola, se cierra ahora
+        finalizar_campana_si_completa(campana_id)
+    return reanudada
+
+
+def cancelar_campana(campana_id) -> int:
+    """
+    Cancela la campaña: sus mensajes pendientes pasan a CANCELADO y no se envían.
+    Los lotes en curso terminan. Retorna cuántos mensajes se cancelaron.
+    """
+    if not Campana.objects.filter(pk=campana_id).exclude(estado__in=['CANCELADA', 'COMPLETADA']).update(estado='CANCELADA'):
+        return 0
+    _olvidar_detenidas()
+    cancelados = MensajeSaliente.objects.filter(campana_id=campana_id, estado='PENDIENTE').update(
+        estado='CANCELADO', lote=None, lease_hasta=None
+    )
+    progreso.registrar_cancelados(campana_id, cancelados)
+    escribir_resumen(campana_id)
+    return cancelados
+
+
+def reclamar_lote(tamano: int = TAMANO_LOTE, campana=None, particion: int = None) -> list:
+    """
+    Marca como PROCESANDO hasta `tamano` mensajes pendientes (con un lease de
+    LEASE_LOTE_SEG) y los devuelve. También retoma los mensajes cuyo lease venció:
+    el worker que los tenía murió a mitad del lote.
+
+    En PostgreSQL los ids se eligen con SELECT ... FOR UPDATE SKIP LOCKED, así
+    que workers concurrentes nunca compiten por las mismas filas. En SQLite el
+    UPDATE condicionado al estado garantiza que, si dos workers eligen los mismos
+    ids, solo uno se los queda: nunca se envía dos veces.
+    """
+    ahora = timezone.now()
+    reclamables = Q(estado='PENDIENTE', proximo_intento__lte=ahora) | Q(estado='PROCESANDO', lease_hasta__lt=ahora)
+    pendientes = MensajeSaliente.objects.filter(reclamables)
+    if campana is not None:
+        pendientes = pendientes.filter(campana=campana)
+    if particion is not None:
+        pendientes = pendientes.filter(particion=particion)
+    # Campañas pausadas o canceladas desde el admin, o fuera de su horario: su capacidad queda para las demás
+    detenidas = campanas_detenidas()
+    if detenidas:
+        pendientes = pendientes.exclude(campana_id__in=detenidas)
+    # Las líneas con el circuito abierto (API de WhatsApp caída) quedan en pausa hasta que se pruebe
+    # de nuevo; los mensajes de SMS, email o voz no pasan por ellas y siguen saliendo
+    pausadas = lineas_en_pausa()
+    if pausadas:
+        en_pausa = Q(linea_id__in=[i for i in pausadas if i is not None])
+        if None in pausadas:
+            en_pausa |= Q(linea__isnull=True)
+        pendientes = pendientes.exclude(en_pausa & Q(campana__canal_envio='whatsapp'))
+    pendientes = pendientes.order_by('proximo_intento', 'id').values_list('id', flat=True)
+
+    lote = uuid.uuid4().hex
+    marcar = dict(estado='PROCESANDO', lote=lote, reclamado_en=ahora,
+                  lease_hasta=ahora + timedelta(seconds=LEASE_LOTE_SEG))
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(pendientes.select_for_update(skip_locked=True)[:tamano])
+            if not ids:
+                return []
+            MensajeSaliente.objects.filter(id__in=ids).update(**marcar)
+    else:
+        ids = list(pendientes[:tamano])
+        if not ids:
+            return []
+        MensajeSaliente.objects.filter(reclamables, id__in=ids).update(**marcar)
+    return list(
+        MensajeSaliente.objects.filter(lote=lote).select_related('campana__plantilla', 'estudiante', 'linea')
+    )
+
+
+def personalizar_mensajes(mensajes) -> dict:
+    """
+    Texto de la plantilla de la campaña con los datos de cada destinatario
+    (core.plantillas: compilada una vez por plantilla y renderizada en lote).
+    Retorna {mensaje.pk: texto}.
+    """
+    por_plantilla = {}
+    for mensaje in mensajes:
+        por_plantilla.setdefault(mensaje.campana.plantilla_id, []).append(mensaje)
+
+    textos = {}
+    for grupo in por_plantilla.values():
+        compilada = compilar_plantilla(grupo[0].campana.plantilla)
+        renderizados = compilada.renderizar_lote([mensaje.estudiante for mensaje in grupo])
+        textos.update(zip((mensaje.pk for mensaje in grupo), renderizados))
+    return textos
+
+
+def procesar_lote(mensajes, concurrencia: int = None) -> dict:
+    """
+    Envía un lote reclamado de la bandeja por el canal de cada campaña
+    (core.canales), registra cada resultado en EnvioLog y actualiza el MensajeSaliente.
+    `concurrencia` fija los envíos en paralelo de todos los canales
+    (por defecto cada canal usa la suya, settings.CANAL_CONCURRENCIA).
+
+    Los errores temporales (timeouts, 5xx, rate limit) no se registran como
+    FALLIDO: el mensaje vuelve a PENDIENTE con `proximo_intento` en el futuro
+    (backoff exponencial con jitter) y lo recoge un lote posterior, sin frenar
+    el resto del envío. Al agotar CAMPANA_MAX_INTENTOS pasa a AGOTADO.
+
+    Retorna {campana_id: {"exitosos": n, "fallidos": n, "reintentos": n}}.
+    """
+    resultados = {}
+
+    # Si un proceso murió tras registrar el EnvioLog pero antes de cerrar el mensaje,
+    # al reanudar no lo reenviamos: una sola consulta por lote con el estado ya registrado
+    ya_registrados = dict(
+        ((log['campana_id'], log['estudiante_id']), log['estado'])
+        for log in EnvioLog.objects.filter(
+            campana_id__in={m.campana_id for m in mensajes},
+            estudiante_id__in={m.estudiante_id for m in mensajes},
+            estado__in=ESTADOS_TERMINALES,
+        ).values('campana_id', 'estudiante_id', 'estado')
+    )
+    # Los registros se escriben en bloque; el `with` garantiza el vaciado al terminar el lote.
+    # Mientras tanto se renueva el lease para que otro worker no retome el lote
+    with mantener_lease({m.lote for m in mensajes if m.lote}), BufferLogs() as buffer:
+        por_enviar = []
+        for mensaje in mensajes:
+            estado = ya_registrados.get((mensaje.campana_id, mensaje.estudiante_id))
+            if estado:
+                mensaje.estado = estado
+                mensaje.fecha_actualizacion = timezone.now()
+                buffer.actualizar_mensaje(mensaje)
+            else:
+                por_enviar.append(mensaje)
+
+        # Mensajes que vuelven de un reintento: al cerrarse salen del contador 'reintentando'
+        retomados = Counter(m.campana_id for m in por_enviar if m.intentos > 0)
+
+        # Una tanda por canal (whatsapp, sms, email, voz); los canales corren a la vez
+        textos = personalizar_mensajes(por_enviar)
+        tandas = {}
+        for mensaje in por_enviar:
+            tandas.setdefault(mensaje.campana.canal_envio or CANAL_POR_DEFECTO, []).append(
+                (mensaje, textos[mensaje.pk])
+            )
+        flujos = [obtener_canal(canal).enviar_lote(envios, buffer, concurrencia) for canal, envios in tandas.items()]
+
+        for mensaje, resultado, error in combinar(flujos):
+            conteo = resultados.setdefault(mensaje.campana_id, {"exitosos": 0, "fallidos": 0, "reintentos": 0})
+            _registrar_resultado(mensaje, resultado, error, conteo, buffer)
+            buffer.vaciar_si_toca()
+
+    for campana_id, conteo in resultados.items():
+        progreso.registrar_lote(campana_id, **conteo, retomados=retomados[campana_id])
+    _cancelar_rezagados({m.campana_id for m in mensajes})
+    for campana_id in {m.campana_id for m in mensajes}:
+        finalizar_campana_si_completa(campana_id)
+    return resultados
+
+
+def _cancelar_rezagados(campana_ids):
+    """
+    Cancela los mensajes que volvieron a PENDIENTE (reintento o circuito abierto) en un
+    lote que estaba en curso cuando se canceló su campaña: `cancelar_campana` ya pasó
+    por ellos y ningún worker reclama mensajes de una campaña cancelada.
+    """
+    rezagados = list(MensajeSaliente.objects.filter(
+        campana_id__in=campana_ids, campana__estado='CANCELADA', estado='PENDIENTE'
+    ).values_list('id', 'campana_id'))
+    if not rezagados:
+        return
+    MensajeSaliente.objects.filter(pk__in=[pk for pk, _ in rezagados], estado='PENDIENTE').update(
+        estado='CANCELADO', lote=None, lease_hasta=None
+    )
+    for campana_id, cancelados in Counter(campana_id for _, campana_id in rezagados).items():
+        progreso.registrar_cancelados(campana_id, cancelados)
+        escribir_resumen(campana_id)
+
+
+def _registrar_resultado(mensaje, resultado, error, conteo, buffer):
+    """Cierra (ENVIADO/FALLIDO/AGOTADO) o reprograma un mensaje según el resultado del envío."""
+    estudiante = mensaje.estudiante
+    if resultado and resultado.get('circuito_abierto'):
+        # La API está caída para esta línea (core.circuito): el mensaje no llegó a salir,
+        # vuelve a la cola para cuando el circuito se pruebe de nuevo, sin gastar un intento
+        mensaje.estado = 'PENDIENTE'
+        mensaje.proximo_intento = mensaje.campana.ajustar_a_ventana(
+            timezone.now() + timedelta(seconds=resultado['reanudar_en'] + random.uniform(0, 5))
+        )
+        mensaje.ultimo_error = resultado['response']
+        mensaje.lote = None
+        mensaje.lease_hasta = None
+        mensaje.fecha_actualizacion = timezone.now()
+        buffer.actualizar_mensaje(mensaje)
+        return
+
+    mensaje.intentos += 1
+    mensaje.latencia_ms = resultado.get('latencia_ms') if resultado else None
+
+    if error is None and resultado['success']:
+        # 3. Guardar Log de Éxito
+        buffer.agregar_envio(EnvioLog(
+            campana=mensaje.campana,
+            estudiante=estudiante,
+            linea=mensaje.linea,
+            estado='ENVIADO',
+            respuesta_api=f"Message ID: {resultado.get('mensaje_id', 'N/A')}"
+        ))
+        mensaje.estado = 'ENVIADO'
+        mensaje.ultimo_error = None
+        conteo["exitosos"] += 1
+        print(f"✅ Enviado a {estudiante.nombre}")
+    else:
+        motivo = str(error) if error is not None else str(resultado.get('response', 'Error desconocido'))
+        mensaje.ultimo_error = motivo
+        reintentable = clasificar_error(resultado, error) == REINTENTABLE
+
+        if reintentable and mensaje.intentos < max_intentos():
+            # Reprogramar sin registrar fallo: otro lote lo tomará cuando venza el backoff
+            mensaje.estado = 'PENDIENTE'
+            mensaje.proximo_intento = mensaje.campana.ajustar_a_ventana(programar_reintento(mensaje.intentos))
+            conteo["reintentos"] += 1
+            print(f"🔁 Reintento {mensaje.intentos} para {estudiante.nombre}: {motivo}")
+        else:
+            # 4. Guardar Log de Fallo
+            mensaje.estado = 'AGOTADO' if reintentable else 'FALLIDO'
+            if mensaje.intentos > 1:
+                motivo = f"{motivo} (tras {mensaje.intentos} intentos)"
+            buffer.agregar_envio(EnvioLog(
+                campana=mensaje.campana,
+                estudiante=estudiante,
+                linea=mensaje.linea,
+                estado='FALLIDO',
+                respuesta_api=motivo
+            ))
+            conteo["fallidos"] += 1
+            print(f"❌ Falló {estudiante.nombre}: {motivo}")
+
+    mensaje.lote = None
+    mensaje.lease_hasta = None
+    mensaje.fecha_actualizacion = timezone.now()
+    buffer.actualizar_mensaje(mensaje)
+
+
+def reencolar_agotados(mensajes) -> int:
+    """
+    Devuelve a la cola mensajes AGOTADO/FALLIDO (dead-letter) para reenviarlos.
+    Sus EnvioLog FALLIDO pasan a REENCOLADO para que el chequeo de reanudación
+    no los descarte. Los de campañas canceladas se dejan como están, y una campaña
+    pausada sigue pausada: sus mensajes esperan a que se reanude.
+    Retorna cuántos mensajes se reencolaron.
+    """
+    mensajes = [m for m in mensajes if m.estado in ('AGOTADO', 'FALLIDO')]
+    canceladas = set(Campana.objects.filter(
+        pk__in={m.campana_id for m in mensajes}, estado='CANCELADA'
+    ).values_list('pk', flat=True))
+    mensajes = [m for m in mensajes if m.campana_id not in canceladas]
+    por_campana = {}
+    for mensaje in mensajes:
+        por_campana.setdefault(mensaje.campana_id, []).append(mensaje.estudiante_id)
+
+    for campana_id, estudiantes in por_campana.items():
+        EnvioLog.objects.filter(
+            campana_id=campana_id, estudiante_id__in=estudiantes, estado='FALLIDO'
+        ).update(estado='REENCOLADO')
+        progreso.registrar_reencolados(campana_id, len(estudiantes))
+    # Las completadas vuelven a estar en curso; las pausadas no se reactivan solas
+    Campana.objects.filter(pk__in=por_campana).exclude(estado__in=['CANCELADA', 'PAUSADA']).update(
+        ejecutada=False, estado='EN_CURSO'
+    )
+    _olvidar_detenidas()
+
+    return MensajeSaliente.objects.filter(pk__in=[m.pk for m in mensajes]).update(
+        estado='PENDIENTE', intentos=0, proximo_intento=timezone.now(), lote=None, reclamado_en=None,
+    )
+
+
+def renovar_lease(lotes, segundos: float = LEASE_LOTE_SEG) -> int:
+    """Extiende el lease de los mensajes de los lotes que siguen en PROCESANDO."""
+    return MensajeSaliente.objects.filter(lote__in=lotes, estado='PROCESANDO').update(
+        lease_hasta=timezone.now() + timedelta(seconds=segundos)
+    )
+
+
+@contextlib.contextmanager
+def mantener_lease(lotes, segundos: float = LEASE_LOTE_SEG):
+    """Renueva el lease de los lotes en un hilo aparte mientras dura el bloque `with`."""
+    terminado = threading.Event()
+    if not lotes:
+        yield
+        return
+
+    def latir():
+        try:
+            while not terminado.wait(segundos / 3):
+                renovar_lease(lotes, segundos)
+        finally:
+            connection.close()
+
+    hilo = threading.Thread(target=latir, name='lease-lote', daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        terminado.set()
+        hilo.join()
+
+
+def liberar_mensajes_huerfanos(campana=None, minutos: int = 10) -> int:
+    """
+    Devuelve a PENDIENTE los mensajes en PROCESANDO cuyo lease venció (el worker
+    que los reclamó murió). Un lote lento pero vivo renueva su lease
+    (`mantener_lease`) y no se toca, así que nunca se envía dos veces.
+    `minutos` solo aplica a filas sin lease. Retorna cuántos se liberaron.
+    """
+    ahora = timezone.now()
+    huerfanos = MensajeSaliente.objects.filter(
+        Q(lease_hasta__lt=ahora) | Q(lease_hasta__isnull=True, reclamado_en__lte=ahora - timedelta(minutes=minutos)),
+        estado='PROCESANDO',
+    )
+    if campana is not None:
+        huerfanos = huerfanos.filter(campana=campana)
+    return huerfanos.update(estado='PENDIENTE', lote=None, reclamado_en=None, lease_hasta=None)
+
+
+def finalizar_campana_si_completa(campana_id) -> bool:
+    """
+    Marca la campaña en curso como ejecutada (COMPLETADA) cuando ya no le quedan
+    mensajes en cola. Solo el worker que la marca escribe el resumen (`escribir_resumen`).
+    """
+    en_cola = MensajeSaliente.objects.filter(campana_id=campana_id, estado__in=['PENDIENTE', 'PROCESANDO'])
+    if en_cola.exists():
+        return False
+    if not Campana.objects.filter(pk=campana_id, estado='EN_CURSO').update(ejecutada=True, estado='COMPLETADA'):
+        # Pausada o cancelada con la bandeja vacía: igual dejamos el progreso con la cuenta real
+        progreso.sincronizar(campana_id, **progreso.contar_bandeja(campana_id))
+        return False
+    escribir_resumen(campana_id)
+    return True
+
+
+def escribir_resumen(campana_id) -> dict:
+    """
+    Reductor final: junta en Campana.resumen lo que hicieron todos los workers
+    (una consulta agregada sobre la bandeja de salida) y fija fecha_finalizacion.
+    """
+    mensajes = MensajeSaliente.objects.filter(campana_id=campana_id)
+    totales = mensajes.aggregate(
+        total=Count('id'),
+        enviados=Count('id', filter=Q(estado='ENVIADO')),
+        fallidos=Count('id', filter=Q(estado='FALLIDO')),
+        agotados=Count('id', filter=Q(estado='AGOTADO')),
+        cancelados=Count('id', filter=Q(estado='CANCELADO')),
+        intentos=Sum('intentos'),
+        latencia_media_ms=Avg('latencia_ms'),
+        inicio=Min('fecha_creacion'),
+    )
+    ahora = timezone.now()
+    inicio = totales.pop('inicio') or ahora
+    duracion = (ahora - inicio).total_seconds()
+    resumen = {
+        **totales,
+        'intentos': totales['intentos'] or 0,
+        'latencia_media_ms': round(totales['latencia_media_ms'] or 0),
+        'duracion_seg': round(duracion, 1),
+        'mensajes_por_segundo': round(totales['total'] / duracion, 2) if duracion > 0 else None,
+        'por_linea': {
+            str(fila['linea__nombre'] or 'global'): fila['n']
+            for fila in mensajes.filter(estado='ENVIADO').values('linea__nombre').annotate(n=Count('id'))
+        },
+    }
+    Campana.objects.filter(pk=campana_id).update(resumen=resumen, fecha_finalizacion=ahora)
+    # Las sumas por lote del cache pueden perder alguna en carreras entre workers (el incr del
+    # DatabaseCache no es atómico): al terminar el progreso queda con la cuenta exacta
+    progreso.sincronizar(
+        campana_id, total=totales['total'] - totales['cancelados'], enviados=totales['enviados'],
+        fallidos=totales['fallidos'] + totales['agotados'], reintentando=0,
+    )
+    print(f"🏁 Campaña {campana_id} terminada: {resumen['enviados']} enviados, "
+          f"{resumen['fallidos'] + resumen['agotados']} fallidos en {resumen['duracion_seg']:.0f}s")
+    return resumen
+
+
+def ejecutar_campana_servicio(campana, concurrencia: int = None):
     """
     Envía mensajes (con o sin imagen) y guarda el registro (Log).
+
+    Encola la campaña y vacía su bandeja de salida en este mismo proceso
+    (el admin solo encola y deja el envío al comando `procesar_envios`).
+    `concurrencia` indica cuántos envíos se hacen en paralelo
+    (por defecto la del canal de la campaña, settings.CANAL_CONCURRENCIA; 1 = secuencial).
     """
-    # Filtramos destinatarios activos
-    destinatarios = campana.destinatarios.filter(activo=True)
-    mensaje_base = campana.plantilla.cuerpo_mensaje
-    
-    # Obtener URL de imagen si la plantilla la tiene
-    url_imagen = None
-    if campana.plantilla.tiene_imagen and campana.plantilla.url_imagen:
-        url_imagen = campana.plantilla.url_imagen
-    
+    if concurrencia is None:
+        concurrencia = obtener_canal(campana.canal_envio).concurrencia()
+
+    encolar_campana(campana)
+
     resultados = {
-        "total": destinatarios.count(),
+        "total": campana.destinatarios.filter(activo=True).count(),  # audiencia de la campaña
         "exitosos": 0,
-        "fallidos": 0
+        "fallidos": 0,
+        "procesados": 0,  # enviados o fallidos en esta ejecución
     }
 
     print(f"🚀 INICIANDO CAMPAÑA: {campana.nombre}")
-    if url_imagen:
-        print(f"📸 Con imagen: {url_imagen}")
-    
-    for estudiante in destinatarios:
-        try:
-            # 1. Personalización del mensaje
-            mensaje_personalizado = mensaje_base.replace("{nombre}", estudiante.nombre)
-            
-            # 2. Enviar mensaje (con o sin imagen)
-            resultado = enviar_whatsapp(
-                telefono=estudiante.telefono,
-                texto=mensaje_personalizado,
-                url_imagen=url_imagen
-            )
-            
-            if resultado['success']:
-                # 3. Guardar Log de Éxito
-                EnvioLog.objects.create(
-                    campana=campana,
-                    estudiante=estudiante,
-                    estado='ENVIADO',
-                    respuesta_api=f"Message ID: {resultado.get('mensaje_id', 'N/A')}"
-                )
-                resultados["exitosos"] += 1
-                print(f"✅ Enviado a {estudiante.nombre}")
-            else:
-                raise Exception(str(resultado.get('response', 'Error desconocido')))
+    if campana.plantilla.tiene_imagen and campana.plantilla.url_imagen:
+        print(f"📸 Con imagen: {campana.plantilla.url_imagen}")
+    if concurrencia > 1:
+        print(f"⚡ Concurrencia: {concurrencia} envíos en paralelo")
 
-        except Exception as e:
-            # 4. Guardar Log de Fallo
-            EnvioLog.objects.create(
-                campana=campana,
-                estudiante=estudiante,
-                estado='FALLIDO',
-                respuesta_api=str(e)
+    while True:
+        mensajes = reclamar_lote(tamano=max(TAMANO_LOTE, concurrencia * 4), campana=campana)
+        if not mensajes and campana.pk in campanas_detenidas():
+            campana.refresh_from_db(fields=['estado'])
+            if campana.estado in ESTADOS_DETENIDOS:
+                print(f"⏸️ Campaña '{campana.nombre}' pausada o cancelada: se detiene el envío")
+                break
+        if not mensajes:
+            # Solo quedan reintentos o envíos repartidos en el tiempo: dormimos hasta el próximo
+            # que venza (y, fuera de la ventana horaria, hasta que abra)
+            siguiente = (
+                MensajeSaliente.objects.filter(campana=campana, estado='PENDIENTE')
+                .order_by('proximo_intento').values_list('proximo_intento', flat=True).first()
             )
-            resultados["fallidos"] += 1
-            print(f"❌ Falló {estudiante.nombre}: {str(e)}")
+            if siguiente is None:
+                break
+            siguiente = campana.ajustar_a_ventana(max(siguiente, timezone.now()))
+            espera = (siguiente - timezone.now()).total_seconds()
+            if espera <= 0:
+                # Ya vencieron pero no se pudieron reclamar: su línea tiene el circuito abierto
+                # (o los tomó otro worker). Esperamos a que se pruebe de nuevo en vez de girar
+                espera = (campana.canal_envio == 'whatsapp' and segundos_hasta_reanudar()) or REVISAR_PAUSAS_SEG
+            time.sleep(espera)
+            continue
+        conteo = procesar_lote(mensajes, concurrencia).get(campana.pk, {})
+        resultados["exitosos"] += conteo.get("exitosos", 0)
+        resultados["fallidos"] += conteo.get("fallidos", 0)
+    resultados["procesados"] = resultados["exitosos"] + resultados["fallidos"]
 
     # Marcar campaña como ejecutada
-    campana.ejecutada = True
-    campana.save()
-    
-    return resultados
\ No newline at end of file
+    finalizar_campana_si_completa(campana.pk)
+    campana.refresh_from_db(fields=['ejecutada', 'estado'])
+
+    return resultados
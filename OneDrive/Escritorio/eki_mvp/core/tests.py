@@ -1,3 +1,973 @@
-from django.test import TestCase
+import json
+import smtplib
+import time
+from collections import Counter
+from datetime import datetime, time as hora, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import canales, circuito, contexto, progreso, services, ventana, webhook
+from .circuito import ABIERTO, CERRADO, SEMIABIERTO, Circuito
+from .plantillas import PlantillaCompilada
+from .rate_limiter import INTERACTIVA, MASIVA, TokenBucket
+from .reintentos import PERMANENTE, REINTENTABLE, clasificar_error
+from .scheduler import CLAVE_VERSION, ProgramadorCampanas
+from .services import (cancelar_campana, encolar_campana, liberar_mensajes_huerfanos, pausar_campana, procesar_lote,
+                       reanudar_envio, reclamar_lote, reencolar_agotados, renovar_lease)
+from .log_buffer import BufferLogs
+from .models import (Campana, EnvioLog, Estudiante, Linea, MensajeRecibido, MensajeSaliente, Plantilla, WhatsappLog,
+                     WebhookEvento)
+from .webhook import aplicar_estados, procesar_eventos, procesar_payload
+
+# Los tests que cuentan consultas usan un cache en memoria: el DatabaseCache de
+# settings también consulta la base y se sumaría a la cuenta
+CACHE_LOCAL = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'webhook': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-webhook',
+                'KEY_PREFIX': 'webhook'},
+}
+
+
+def payload_entrante(cantidad: int) -> dict:
+    """Un POST del webhook con `cantidad` mensajes entrantes en un solo `messages`."""
+    return {'entry': [{'changes': [{'value': {
+        'metadata': {'phone_number_id': '000000000000000'},
+        'messages': [{'from': f'57300{i:07d}', 'id': f'wamid.in{i}', 'text': {'body': '¿Cuál es mi progreso?'}}
+                     for i in range(cantidad)],
+    }}]}]}
+
+
+class RespuestaFalsa:
+    status_code = 200
+    text = ''
+
+    def __init__(self, mensaje_id):
+        self.mensaje_id = mensaje_id
+
+    def json(self):
+        return {'messages': [{'id': self.mensaje_id}]}
+
+
+class ClienteFalso:
+    def __init__(self):
+        self.enviados = 0
+
+    def enviar_mensaje(self, phone_id, token, payload):
+        self.enviados += 1
+        return RespuestaFalsa(f'wamid.out{self.enviados}')
+
+
+class RespuestaCaida:
+    """Un 503 de Meta: error temporal, se reintenta."""
+    status_code = 503
+    text = ''
+
+    def json(self):
+        return {'error': {'code': 131000, 'message': 'Something went wrong'}}
+
+
+class ClienteCaido(ClienteFalso):
+    def enviar_mensaje(self, phone_id, token, payload):
+        self.enviados += 1
+        return RespuestaCaida()
+
+
+# Sin limitador: su cupo cuesta un UPDATE por envío y aquí se cuentan las consultas del webhook
+@override_settings(WHATSAPP_TOKEN='token-test', WHATSAPP_PHONE_ID='000000000000000', WHATSAPP_RATE_LIMIT=0,
+                   CACHES=CACHE_LOCAL)
+class WebhookPorLotesTests(TestCase):
+    """Un POST con muchos mensajes se resuelve con las mismas consultas que uno con pocos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        plantilla = Plantilla.objects.create(nombre_interno='Recordatorio', cuerpo_mensaje='Hola {nombre}')
+        campana = Campana.objects.create(nombre='Módulo 1', plantilla=plantilla)
+        estudiantes = Estudiante.objects.bulk_create([
+            Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}') for i in range(100)
+        ])
+        EnvioLog.objects.bulk_create(
+            [EnvioLog(campana=campana, estudiante=e, estado='ENVIADO') for e in estudiantes]
+            + [EnvioLog(campana=campana, estudiante=e, estado='PENDIENTE') for e in estudiantes[::2]]
+        )
+
+    def setUp(self):
+        caches['webhook'].clear()
+
+    def procesar(self, cantidad: int) -> ClienteFalso:
+        cliente = ClienteFalso()
+        with mock.patch('core.utils.obtener_cliente', return_value=cliente):
+            procesar_payload(payload_entrante(cantidad))
+        return cliente
+
+    def test_100_mensajes_con_consultas_constantes(self):
+        # Líneas, INSERT de entrantes, estudiantes, progreso (2, contexto aún fuera
+        # del cache) y la transacción del buffer con los logs de las respuestas
+        with self.assertNumQueries(8):
+            cliente = self.procesar(100)
+
+        self.assertEqual(cliente.enviados, 100)
+        self.assertEqual(WhatsappLog.objects.filter(estado='INCOMING').count(), 100)
+        self.assertEqual(WhatsappLog.objects.filter(estado='SENT').count(), 100)
+
+    def test_consultas_no_dependen_del_tamano_del_payload(self):
+        with self.assertNumQueries(8):
+            self.procesar(10)
+
+    def test_progreso_y_siguiente_tarea(self):
+        with self.assertNumQueries(3):
+            contextos = contexto.construir(['573000000000', '573000000001', '579999999999'])
+
+        self.assertEqual(set(contextos), {'573000000000', '573000000001'})
+        primero, segundo = contextos['573000000000'], contextos['573000000001']
+        self.assertEqual(contexto.datos_respuesta(primero)['progreso'], '50%')
+        self.assertEqual(primero['siguiente_tarea'], 'Módulo 1')
+        self.assertEqual(contexto.datos_respuesta(segundo)['progreso'], '100%')
+        self.assertEqual(segundo['siguiente_tarea'], 'No hay tareas pendientes')
+
+    def test_estados_de_entrega(self):
+        WhatsappLog.objects.bulk_create([
+            WhatsappLog(telefono='573000000000', mensaje='hola', mensaje_id=f'wamid.out{i}', estado='SENT')
+            for i in range(3)
+        ])
+        statuses = [{'id': 'wamid.out0', 'status': 'delivered'}, {'id': 'wamid.out1', 'status': 'delivered'},
+                    {'id': 'wamid.out2', 'status': 'read'}, {'id': 'wamid.out2', 'status': 'delivered'}]
+
+        # Un solo UPDATE para todos los recibos
+        with self.assertNumQueries(1):
+            procesar_payload({'entry': [{'changes': [{'value': {'statuses': statuses}}]}]})
+
+        self.assertEqual(
+            dict(WhatsappLog.objects.values_list('mensaje_id', 'estado')),
+            {'wamid.out0': 'delivered', 'wamid.out1': 'delivered', 'wamid.out2': 'read'},
+        )
+
+    def test_estado_atrasado_no_retrocede(self):
+        WhatsappLog.objects.create(telefono='573000000000', mensaje='hola', mensaje_id='wamid.out0', estado='read')
+        WhatsappLog.objects.create(telefono='573000000001', mensaje='hola', mensaje_id='wamid.out1', estado='sent')
+
+        actualizados = aplicar_estados({'wamid.out0': 'delivered', 'wamid.out1': 'delivered'})
+
+        self.assertEqual(actualizados, 1)
+        self.assertEqual(
+            dict(WhatsappLog.objects.values_list('mensaje_id', 'estado')),
+            {'wamid.out0': 'read', 'wamid.out1': 'delivered'},
+        )
+
+    def test_estado_desconocido_se_ignora(self):
+        WhatsappLog.objects.create(telefono='573000000000', mensaje='hola', mensaje_id='wamid.in0', estado='INCOMING')
+        WhatsappLog.objects.create(telefono='573000000001', mensaje='hola', mensaje_id='wamid.out1', estado='ERROR')
+
+        with self.assertNumQueries(0):
+            actualizados = aplicar_estados({'wamid.in0': None, 'wamid.out1': 'deleted'})
+
+        self.assertEqual(actualizados, 0)
+        self.assertEqual(
+            dict(WhatsappLog.objects.values_list('mensaje_id', 'estado')),
+            {'wamid.in0': 'INCOMING', 'wamid.out1': 'ERROR'},
+        )
+
+    def test_estados_de_un_lote_de_eventos(self):
+        WhatsappLog.objects.bulk_create([
+            WhatsappLog(telefono='573000000000', mensaje='hola', mensaje_id=f'wamid.out{i}', estado='SENT')
+            for i in range(20)
+        ])
+        # Un evento por recibo, como los manda Meta: sent, delivered y read de cada mensaje, desordenados
+        eventos = WebhookEvento.objects.bulk_create([
+            WebhookEvento(cuerpo=json.dumps({'entry': [{'changes': [{'value': {
+                'statuses': [{'id': f'wamid.out{i}', 'status': estado}]}}]}]}), estado='PROCESANDO')
+            for estado in ('read', 'sent', 'delivered') for i in range(20)
+        ])
+
+        with mock.patch('core.webhook.aplicar_estados', wraps=aplicar_estados) as aplicar:
+            conteo = procesar_eventos(eventos, hilos=4)
+
+        self.assertEqual(conteo, {'procesados': 60, 'errores': 0})
+        aplicar.assert_called_once()
+        self.assertEqual(set(WhatsappLog.objects.values_list('estado', flat=True)), {'read'})
+
+
+@override_settings(WHATSAPP_TOKEN='token-test', WHATSAPP_PHONE_ID='000000000000000', WHATSAPP_RATE_LIMIT=100000)
+class ContextoEstudianteTests(TestCase):
+    """Responder a un estudiante que ya escribió no lee EnvioLog ni Estudiante."""
+
+    @classmethod
+    def setUpTestData(cls):
+        plantilla = Plantilla.objects.create(nombre_interno='Recordatorio', cuerpo_mensaje='Hola {nombre}')
+        cls.campana = Campana.objects.create(nombre='Módulo 1', plantilla=plantilla)
+        cls.estudiante = Estudiante.objects.create(nombre='Ana', telefono='573000000000')
+        EnvioLog.objects.create(campana=cls.campana, estudiante=cls.estudiante, estado='ENVIADO')
+        EnvioLog.objects.create(campana=cls.campana, estudiante=cls.estudiante, estado='PENDIENTE')
+
+    def setUp(self):
+        caches['webhook'].clear()
+
+    def responder(self):
+        with mock.patch('core.utils.obtener_cliente', return_value=ClienteFalso()):
+            procesar_payload(payload_entrante(1))
+
+    def contexto(self) -> dict:
+        return caches['webhook'].get('contexto:573000000000')
+
+    def test_segunda_respuesta_sin_leer_la_base(self):
+        self.responder()
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.responder()
+
+        tablas = ' '.join(consulta['sql'] for consulta in consultas.captured_queries)
+        self.assertNotIn('core_enviolog', tablas)
+        self.assertNotIn('core_estudiante', tablas)
+        self.assertEqual(contexto.datos_respuesta(self.contexto())['progreso'], '50%')
+
+    def test_envios_en_bloque_actualizan_el_contexto(self):
+        self.responder()
+        estudiante = Estudiante.objects.get(pk=self.estudiante.pk)
+
+        with BufferLogs() as buffer:
+            buffer.agregar_envio(EnvioLog(campana=self.campana, estudiante=estudiante, estado='ENVIADO'))
+            buffer.agregar_envio(EnvioLog(campana=self.campana, estudiante=estudiante, estado='ENVIADO'))
+
+        # 3 de 4 envíos exitosos, sin volver a la base
+        self.assertEqual(contexto.datos_respuesta(self.contexto())['progreso'], '75%')
+        self.assertEqual(contexto.construir(['573000000000'])['573000000000'], self.contexto())
+
+    def test_cambios_sueltos_invalidan_el_contexto(self):
+        self.responder()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.campana.nombre = 'Módulo 2'
+            self.campana.save()
+        self.assertIsNone(self.contexto())
+
+        self.responder()
+        self.assertEqual(self.contexto()['siguiente_tarea'], 'Módulo 2')
+        with self.captureOnCommitCallbacks(execute=True):
+            EnvioLog.objects.create(campana=self.campana, estudiante=self.estudiante, estado='FALLIDO')
+        self.assertIsNone(self.contexto())
+
+        self.responder()
+        with self.captureOnCommitCallbacks(execute=True):
+            Estudiante.objects.get(pk=self.estudiante.pk).save()
+        self.assertIsNone(self.contexto())
+
+
+@override_settings(WEBHOOK_EN_LINEA=False)
+class WebhookDeduplicacionTests(TestCase):
+    """Los reintentos de Meta no vuelven a guardar ni a responder un mensaje ya recibido."""
+
+    def setUp(self):
+        webhook._vistos.clear()
+        caches['webhook'].clear()
+
+    def post(self, payload: dict):
+        return self.client.post('/webhook/whatsapp/', data=json.dumps(payload), content_type='application/json')
+
+    def test_reintento_se_descarta_sin_escribir(self):
+        self.assertEqual(self.post(payload_entrante(3)).status_code, 200)
+
+        with self.assertNumQueries(0):
+            respuesta = self.post(payload_entrante(3))
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(WebhookEvento.objects.count(), 1)
+
+    def test_repetido_en_otro_worker(self):
+        self.post(payload_entrante(1))
+        # Otro worker de gunicorn: no tiene el id en su LRU, lo frena el índice único
+        webhook._vistos.clear()
+
+        self.post(payload_entrante(1))
+
+        self.assertEqual(WebhookEvento.objects.count(), 1)
+        self.assertEqual(MensajeRecibido.objects.count(), 1)
+
+    def test_otro_worker_guarda_solo_los_nuevos(self):
+        self.post(payload_entrante(2))
+        webhook._vistos.clear()
+
+        self.assertEqual(self.post(payload_entrante(3)).status_code, 200)
+        self.assertEqual(self.post(payload_entrante(2)).status_code, 200)
+
+        self.assertEqual(WebhookEvento.objects.count(), 2)
+        cuerpo = json.loads(WebhookEvento.objects.latest('id').cuerpo)['entry'][0]['changes'][0]['value']
+        self.assertEqual([m['id'] for m in cuerpo['messages']], ['wamid.in2'])
+        self.assertEqual(MensajeRecibido.objects.count(), 3)
+
+    def test_se_guardan_los_nuevos_y_los_estados(self):
+        self.post(payload_entrante(2))
+        payload = payload_entrante(3)
+        payload['entry'][0]['changes'][0]['value']['statuses'] = [{'id': 'wamid.out0', 'status': 'read'}]
+
+        self.post(payload)
+
+        cuerpo = json.loads(WebhookEvento.objects.latest('id').cuerpo)['entry'][0]['changes'][0]['value']
+        self.assertEqual([m['id'] for m in cuerpo['messages']], ['wamid.in2'])
+        self.assertEqual(cuerpo['statuses'], [{'id': 'wamid.out0', 'status': 'read'}])
+
+    def test_si_no_se_guarda_el_reintento_se_acepta(self):
+        with mock.patch.object(WebhookEvento.objects, 'create', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                self.post(payload_entrante(1))
+
+        self.post(payload_entrante(1))
+
+        self.assertEqual(WebhookEvento.objects.count(), 1)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class ProgresoTests(TestCase):
+    """Sin los contadores en el cache el progreso se vuelve a contar desde la bandeja."""
+
+    @classmethod
+    def setUpTestData(cls):
+        plantilla = Plantilla.objects.create(nombre_interno='Recordatorio', cuerpo_mensaje='Hola {nombre}')
+        cls.campana = Campana.objects.create(nombre='Módulo 1', plantilla=plantilla)
+        estudiantes = Estudiante.objects.bulk_create([
+            Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}') for i in range(6)
+        ])
+        estados = ['ENVIADO', 'ENVIADO', 'FALLIDO', 'AGOTADO', 'PENDIENTE', 'CANCELADO']
+        MensajeSaliente.objects.bulk_create([
+            MensajeSaliente(campana=cls.campana, estudiante=e, estado=estado, intentos=1)
+            for e, estado in zip(estudiantes, estados)
+        ])
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_cache_vacio_cuenta_la_bandeja_una_vez(self):
+        with self.assertNumQueries(1):
+            datos = progreso.obtener(self.campana.pk)
+
+        self.assertTrue(datos['disponible'])
+        self.assertEqual((datos['encolados'], datos['enviados'], datos['fallidos'], datos['reintentando']),
+                         (5, 2, 2, 1))
+        self.assertEqual(datos['pendientes'], 1)
+
+        # Ya sincronizado: se lee del cache
+        with self.assertNumQueries(0):
+            self.assertEqual(progreso.obtener(self.campana.pk)['encolados'], 5)
+
+    def test_campana_sin_encolar_no_disponible(self):
+        otra = Campana.objects.create(nombre='Módulo 2', plantilla=self.campana.plantilla)
+        self.assertFalse(progreso.obtener(otra.pk)['disponible'])
+
+
+class ProgramadorTests(TestCase):
+    """El programador lanza las campañas a su hora, pero no las vencidas hace más de la gracia."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plantilla = Plantilla.objects.create(nombre_interno='Recordatorio', cuerpo_mensaje='Hola {nombre}')
+
+    def programar(self, nombre, hace):
+        return Campana.objects.create(nombre=nombre, plantilla=self.plantilla,
+                                      fecha_programada=timezone.now() - hace)
+
+    def test_vencidas_fuera_de_la_gracia_no_se_lanzan(self):
+        reciente = self.programar('Reciente', timedelta(minutes=5))
+        vieja = self.programar('Vieja', timedelta(days=2))
+        avisos = []
+        programador = ProgramadorCampanas(gracia_minutos=60, log=avisos.append)
+
+        def marcar_ejecutada(campana):
+            Campana.objects.filter(pk=campana.pk).update(ejecutada=True)
+            return 0
+
+        with mock.patch('core.scheduler.encolar_campana', side_effect=marcar_ejecutada) as encolar:
+            programador.sincronizar(completa=True)
+            programador.disparar_vencidas()
+            # La recarga completa no vuelve a avisar la misma campaña
+            programador.sincronizar(completa=True)
+            programador.disparar_vencidas()
+
+        self.assertEqual([llamada.args[0].pk for llamada in encolar.call_args_list], [reciente.pk])
+        self.assertEqual(len([aviso for aviso in avisos if 'Vieja' in aviso]), 1)
+        vieja.refresh_from_db()
+        self.assertFalse(vieja.ejecutada)
+
+    @override_settings(CACHES=CACHE_LOCAL)
+    def test_version_cambia_al_editar(self):
+        campana = self.programar('Módulo 1', timedelta(minutes=-30))
+        antes = cache.get(CLAVE_VERSION)
+        campana.fecha_programada += timedelta(hours=1)
+        campana.save()
+        self.assertNotEqual(cache.get(CLAVE_VERSION), antes)
+
+
+class LineaAdminTests(TestCase):
+    """La columna "En cola" de Líneas sale de la misma consulta que el resto de la lista."""
+
+    def test_en_cola_anotado(self):
+        plantilla = Plantilla.objects.create(nombre_interno='Recordatorio', cuerpo_mensaje='Hola {nombre}')
+        campana = Campana.objects.create(nombre='Módulo 1', plantilla=plantilla)
+        linea = Linea.objects.create(nombre='Principal', numero='+570000000000')
+        estudiantes = Estudiante.objects.bulk_create([
+            Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}') for i in range(4)
+        ])
+        MensajeSaliente.objects.bulk_create([
+            MensajeSaliente(campana=campana, estudiante=e, linea=linea, estado=estado)
+            for e, estado in zip(estudiantes, ['PENDIENTE', 'PROCESANDO', 'ENVIADO', 'PENDIENTE'])
+        ])
+        EnvioLog.objects.bulk_create([EnvioLog(campana=campana, estudiante=e, linea=linea, estado='ENVIADO')
+                                      for e in estudiantes[:2]])
+        modelo_admin = admin.site._registry[Linea]
+
+        with self.assertNumQueries(1):
+            fila = modelo_admin.get_queryset(RequestFactory().get('/')).get()
+            en_cola, enviados = modelo_admin.en_cola(fila), modelo_admin.enviados(fila)
+
+        self.assertEqual((en_cola, enviados), (3, 2))
+
+
+@override_settings(WHATSAPP_TOKEN='token-test', WHATSAPP_PHONE_ID='000000000000000', WHATSAPP_RATE_LIMIT=100000,
+                   CACHES=CACHE_LOCAL)
+class BandejaTestCase(TestCase):
+    """Una campaña con 10 destinatarios; sus envíos van a un cliente falso."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plantilla = Plantilla.objects.create(nombre_interno='Recordatorio', cuerpo_mensaje='Hola {nombre}')
+        cls.campana = Campana.objects.create(nombre='Módulo 1', plantilla=cls.plantilla)
+        cls.estudiantes = Estudiante.objects.bulk_create([
+            Estudiante(nombre=f'Estudiante {i}', telefono=f'57300{i:07d}') for i in range(10)
+        ])
+        cls.campana.destinatarios.set(cls.estudiantes)
+
+    def setUp(self):
+        caches['default'].clear()
+        services._olvidar_detenidas()
+        circuito._pausas['hasta'] = 0.0
+        circuito._ventanas.clear()
+
+    def enviar(self, cliente=None, tamano=100):
+        cliente = cliente or ClienteFalso()
+        with mock.patch('core.utils.obtener_cliente', return_value=cliente):
+            procesar_lote(reclamar_lote(tamano=tamano), concurrencia=1)
+        return cliente
+
+    def estados(self) -> dict:
+        return dict(Counter(MensajeSaliente.objects.values_list('estado', flat=True)))
+
+
+class ReclamarLoteTests(BandejaTestCase):
+    """Dos workers nunca reclaman el mismo mensaje."""
+
+    def test_lotes_sin_mensajes_repetidos(self):
+        encolar_campana(self.campana)
+
+        primero, segundo = reclamar_lote(tamano=6), reclamar_lote(tamano=6)
+
+        self.assertEqual((len(primero), len(segundo)), (6, 4))
+        self.assertFalse({m.pk for m in primero} & {m.pk for m in segundo})
+        self.assertNotEqual(primero[0].lote, segundo[0].lote)
+        self.assertEqual(reclamar_lote(), [])
+
+
+class LeaseTests(BandejaTestCase):
+    """Un lote cuyo worker murió se retoma al vencer su lease; uno que se renueva, no."""
+
+    def test_lease_vencido_se_retoma(self):
+        encolar_campana(self.campana)
+        muerto = reclamar_lote(tamano=4)
+        # El worker murió: nadie renovó el lease
+        MensajeSaliente.objects.filter(lote=muerto[0].lote).update(lease_hasta=timezone.now() - timedelta(seconds=1))
+
+        retomados = reclamar_lote(tamano=100)
+
+        self.assertEqual(len(retomados), 10)
+        self.assertTrue({m.pk for m in muerto} <= {m.pk for m in retomados})
+        # El worker muerto ya no puede renovar lo que otro retomó
+        self.assertEqual(renovar_lease([muerto[0].lote]), 0)
+
+    def test_lease_renovado_no_se_retoma(self):
+        encolar_campana(self.campana)
+        lote = reclamar_lote(tamano=10)[0].lote
+        MensajeSaliente.objects.update(lease_hasta=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(renovar_lease([lote]), 10)
+        self.assertEqual(reclamar_lote(), [])
+
+
+class ReanudacionTests(BandejaTestCase):
+    """Reanudar una campaña es idempotente y nunca reenvía."""
+
+    def test_encolar_dos_veces(self):
+        self.assertEqual(encolar_campana(self.campana), 10)
+        self.assertEqual(encolar_campana(self.campana), 10)
+        self.assertEqual(MensajeSaliente.objects.count(), 10)
+
+    def test_reanudar_tras_enviar_no_reenvia(self):
+        encolar_campana(self.campana)
+        self.enviar(tamano=4)
+
+        encolar_campana(self.campana)
+        cliente = self.enviar()
+
+        self.assertEqual(cliente.enviados, 6)
+        self.assertEqual(self.estados(), {'ENVIADO': 10})
+        self.assertEqual(EnvioLog.objects.filter(estado='ENVIADO').count(), 10)
+
+    def test_worker_muerto_tras_registrar_el_envio(self):
+        encolar_campana(self.campana)
+        lote = reclamar_lote(tamano=3)
+        # El worker guardó los EnvioLog pero murió antes de cerrar los mensajes
+        EnvioLog.objects.bulk_create([EnvioLog(campana=self.campana, estudiante=m.estudiante, estado='ENVIADO')
+                                      for m in lote])
+
+        # Mientras el lease siga vigente el lote es de un worker vivo
+        self.assertEqual(liberar_mensajes_huerfanos(self.campana, minutos=0), 0)
+        MensajeSaliente.objects.filter(lote=lote[0].lote).update(lease_hasta=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(liberar_mensajes_huerfanos(self.campana), 3)
+        cliente = self.enviar()
+
+        self.assertEqual(cliente.enviados, 7)
+        self.assertEqual(self.estados(), {'ENVIADO': 10})
+
+
+class ProgresoFinalTests(BandejaTestCase):
+    """Una suma perdida entre workers no deja la campaña con pendientes al terminar."""
+
+    def test_resincroniza_al_completar(self):
+        encolar_campana(self.campana)
+        self.enviar(tamano=4)
+        # Otro worker pisó la suma del lote
+        cache.set(f'progreso:{self.campana.pk}:enviados', 3, timeout=None)
+
+        self.enviar()
+
+        datos = progreso.obtener(self.campana.pk)
+        self.assertEqual((datos['enviados'], datos['pendientes'], datos['porcentaje']), (10, 0, 100.0))
+
+
+class ClasificarErrorTests(TestCase):
+    def test_clasificacion(self):
+        casos = [
+            ({'error': TimeoutError('timeout')}, REINTENTABLE),
+            ({}, REINTENTABLE),
+            ({'resultado': {'status_code': None, 'response': 'Connection reset'}}, REINTENTABLE),
+            ({'resultado': {'status_code': 429, 'response': {}}}, REINTENTABLE),
+            ({'resultado': {'status_code': 503, 'response': {}}}, REINTENTABLE),
+            ({'resultado': {'status_code': 400, 'response': {'code': 131000}}}, REINTENTABLE),
+            ({'resultado': {'status_code': 400, 'response': {'code': 130429}}}, REINTENTABLE),
+            ({'resultado': {'status_code': 400, 'response': {'code': 100, 'is_transient': True}}}, REINTENTABLE),
+            ({'resultado': {'status_code': 400, 'response': {'code': 131026}}}, PERMANENTE),
+            ({'resultado': {'status_code': None, 'response': 'Credentials not set'}}, PERMANENTE),
+            ({'resultado': {'status_code': 500, 'reintentable': False}}, PERMANENTE),
+            ({'resultado': {'status_code': 400, 'reintentable': True}}, REINTENTABLE),
+        ]
+        for argumentos, esperado in casos:
+            with self.subTest(**argumentos):
+                self.assertEqual(clasificar_error(**argumentos), esperado)
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class TokenBucketTests(TestCase):
+    """Las respuestas del bot pasan delante de las campañas en el cupo de la línea."""
+
+    def setUp(self):
+        caches['default'].clear()
+        # Recarga despreciable durante el test: el bucket solo baja
+        self.bucket = TokenBucket('test', tasa=0.001, capacidad=10, reserva=0.5)
+
+    def test_masiva_deja_libre_la_reserva_interactiva(self):
+        for _ in range(5):
+            # Hay tokens: no duerme y no cuenta como frenada
+            self.assertEqual(self.bucket.adquirir(prioridad=MASIVA), 0.0)
+
+        # Con el bucket en la reserva, la campaña ya no toma tokens...
+        reservado, espera = self.bucket._reservar(1, minimo=self.bucket.piso + 1)
+        self.assertFalse(reservado)
+        self.assertGreater(espera, 0)
+        # ...y las respuestas salen sin esperar
+        for _ in range(5):
+            self.assertEqual(self.bucket.adquirir(prioridad=INTERACTIVA), 0.0)
+
+    def test_masiva_frenada_cuenta_solo_lo_dormido(self):
+        bucket = TokenBucket('test-masiva', tasa=100, capacidad=1)
+        self.assertEqual(bucket.adquirir(prioridad=MASIVA), 0.0)
+
+        with mock.patch('core.rate_limiter.time.sleep') as dormir:
+            espera = bucket.adquirir(prioridad=MASIVA)
+
+        self.assertEqual(espera, sum(llamada.args[0] for llamada in dormir.call_args_list))
+        self.assertGreater(espera, 0)
+
+    def test_interactiva_reserva_turno_a_futuro(self):
+        for _ in range(10):
+            self.bucket.adquirir(prioridad=INTERACTIVA)
+
+        reservado, espera = self.bucket._reservar(1)
+
+        self.assertTrue(reservado)
+        self.assertGreater(espera, 0)
+
+
+@override_settings(CACHES=CACHE_LOCAL, CIRCUITO_MIN_PETICIONES=4, CIRCUITO_UMBRAL_ERROR=0.5,
+                   CIRCUITO_ESPERA_SEG=30, CIRCUITO_SONDEOS=2)
+class CircuitoTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        circuito._ventanas.clear()
+        self.circuito = Circuito('test')
+
+    def semiabrir(self):
+        apertura = cache.get(self.circuito._clave_estado)
+        cache.set(self.circuito._clave_estado, {**apertura, 'hasta': time.time() - 1}, timeout=None)
+
+    def test_abre_con_errores_de_meta(self):
+        for exito in (True, False, False, True):
+            self.circuito.registrar(exito)
+        self.assertEqual(self.circuito.estado(), CERRADO)
+
+        self.circuito.registrar(False)
+
+        self.assertEqual(self.circuito.estado(), ABIERTO)
+        self.assertFalse(self.circuito.permitir())
+        self.assertGreater(self.circuito.reanudar_en(), 25)
+
+    def test_semiabierto_deja_pasar_solo_los_sondeos(self):
+        self.circuito.abrir()
+        self.semiabrir()
+
+        self.assertEqual(self.circuito.estado(), SEMIABIERTO)
+        self.assertEqual([self.circuito.permitir() for _ in range(4)], [True, True, False, False])
+
+    def test_sondeo_exitoso_cierra(self):
+        for _ in range(4):
+            self.circuito.registrar(False)
+        self.semiabrir()
+        self.circuito.permitir()
+
+        self.circuito.registrar(True)
+
+        self.assertEqual(self.circuito.estado(), CERRADO)
+        # Los errores que lo abrieron no vuelven a contar
+        self.circuito.registrar(False)
+        self.assertEqual(self.circuito.estado(), CERRADO)
+
+    def test_sondeo_fallido_reabre_con_mas_espera(self):
+        self.circuito.abrir()
+        self.semiabrir()
+        self.circuito.permitir()
+
+        self.circuito.registrar(False)
+
+        self.assertEqual(self.circuito.estado(), ABIERTO)
+        self.assertEqual(cache.get(self.circuito._clave_estado)['aperturas'], 2)
+        self.assertGreater(self.circuito.reanudar_en(), 55)
+        # La nueva apertura tiene sus propios turnos de sondeo
+        self.semiabrir()
+        self.assertTrue(self.circuito.permitir())
+
+
+class PausaPorCircuitoTests(BandejaTestCase):
+    """Con el circuito de la línea abierto, sus mensajes esperan a que se pruebe de nuevo sin girar contra la BD."""
+
+    def test_espera_hasta_la_reapertura(self):
+        circuito.obtener_circuito('000000000000000').abrir()
+        esperas = []
+
+        def dormir(segundos):
+            esperas.append(segundos)
+            cache.delete(circuito.obtener_circuito('000000000000000')._clave_estado)
+            circuito._pausas['hasta'] = 0.0
+
+        with mock.patch('core.services.time.sleep', side_effect=dormir), \
+                mock.patch('core.utils.obtener_cliente', return_value=ClienteFalso()):
+            resultado = services.ejecutar_campana_servicio(self.campana, concurrencia=1)
+
+        self.assertEqual(len(esperas), 1)
+        self.assertGreater(esperas[0], 25)
+        self.assertEqual(resultado['exitosos'], 10)
+
+    def test_otros_canales_no_se_pausan(self):
+        circuito.obtener_circuito('000000000000000').abrir()
+        sms = Campana.objects.create(nombre='Aviso SMS', plantilla=self.plantilla, canal_envio='sms')
+        sms.destinatarios.set(self.estudiantes[:3])
+        encolar_campana(self.campana)
+        encolar_campana(sms)
+
+        reclamados = reclamar_lote()
+
+        self.assertEqual({m.campana_id for m in reclamados}, {sms.pk})
+        self.assertEqual(len(reclamados), 3)
+
+
+class PausaCancelacionTests(BandejaTestCase):
+    """Pausar, cancelar y reencolar agotados no reviven campañas ni dejan mensajes huérfanos."""
+
+    def agotar(self, cantidad):
+        ids = list(MensajeSaliente.objects.order_by('id').values_list('id', flat=True)[:cantidad])
+        MensajeSaliente.objects.filter(pk__in=ids).update(estado='AGOTADO', intentos=5)
+        return MensajeSaliente.objects.filter(pk__in=ids)
+
+    def test_pausar_y_reanudar(self):
+        encolar_campana(self.campana)
+        self.assertTrue(pausar_campana(self.campana.pk))
+        self.assertEqual(reclamar_lote(), [])
+
+        self.assertTrue(reanudar_envio(self.campana.pk))
+        self.assertEqual(len(reclamar_lote()), 10)
+
+    def test_cancelar(self):
+        encolar_campana(self.campana)
+        self.enviar(tamano=4)
+
+        self.assertEqual(cancelar_campana(self.campana.pk), 6)
+
+        self.assertEqual(self.estados(), {'ENVIADO': 4, 'CANCELADO': 6})
+        self.assertEqual(reclamar_lote(), [])
+        self.assertEqual(cancelar_campana(self.campana.pk), 0)
+
+    def test_reintento_de_un_lote_en_curso_al_cancelar(self):
+        encolar_campana(self.campana)
+        lote = reclamar_lote(tamano=3)
+        cancelar_campana(self.campana.pk)
+
+        # El lote estaba en vuelo: Meta falla y los mensajes se reprogramarían
+        with mock.patch('core.utils.obtener_cliente', return_value=ClienteCaido()):
+            procesar_lote(lote, concurrencia=1)
+
+        self.assertEqual(self.estados(), {'CANCELADO': 10})
+        self.assertEqual(Campana.objects.get(pk=self.campana.pk).resumen['cancelados'], 10)
+
+    def test_reencolar_en_campana_cancelada(self):
+        encolar_campana(self.campana)
+        agotados = self.agotar(2)
+        cancelar_campana(self.campana.pk)
+
+        self.assertEqual(reencolar_agotados(agotados), 0)
+
+        self.assertEqual(self.estados(), {'AGOTADO': 2, 'CANCELADO': 8})
+        self.assertEqual(Campana.objects.get(pk=self.campana.pk).estado, 'CANCELADA')
+
+    def test_reencolar_en_campana_pausada(self):
+        encolar_campana(self.campana)
+        agotados = self.agotar(2)
+        pausar_campana(self.campana.pk)
+
+        self.assertEqual(reencolar_agotados(agotados), 2)
+
+        self.assertEqual(Campana.objects.get(pk=self.campana.pk).estado, 'PAUSADA')
+        self.assertEqual(reclamar_lote(), [])
+        reanudar_envio(self.campana.pk)
+        self.assertEqual(len(reclamar_lote()), 10)
+
+    def test_reencolar_en_campana_completada(self):
+        encolar_campana(self.campana)
+        MensajeSaliente.objects.update(estado='AGOTADO')
+        Campana.objects.filter(pk=self.campana.pk).update(estado='COMPLETADA', ejecutada=True)
+
+        self.assertEqual(reencolar_agotados(MensajeSaliente.objects.all()), 10)
+
+        campana = Campana.objects.get(pk=self.campana.pk)
+        self.assertEqual((campana.estado, campana.ejecutada), ('EN_CURSO', False))
+        self.assertEqual(len(reclamar_lote()), 10)
+
+
+class PlantillaCompiladaTests(TestCase):
+    def renderizar(self, cuerpo, **datos):
+        estudiante = Estudiante(nombre='Ana María Pérez', telefono='573000000000', email='ana@example.com',
+                                datos_extra=datos)
+        return PlantillaCompilada(cuerpo).renderizar(estudiante)
+
+    def test_campos_y_valores_por_defecto(self):
+        self.assertEqual(self.renderizar('Hola {primer_nombre} ({telefono})'), 'Hola Ana (573000000000)')
+        self.assertEqual(self.renderizar('Curso: {curso|sin asignar}'), 'Curso: sin asignar')
+        self.assertEqual(self.renderizar('Curso: {curso|sin asignar}', curso='Python'), 'Curso: Python')
+
+    def test_llaves_literales(self):
+        compilada = PlantillaCompilada('{{nombre}} es {nombre} y }}{{')
+        self.assertEqual(compilada.errores, [])
+        self.assertEqual(self.renderizar('{{nombre}} es {nombre} y }}{{'), '{nombre} es Ana María Pérez y }{')
+
+    def test_texto_de_la_plantilla_no_se_ejecuta(self):
+        cuerpo = 'Hola "{nombre}" \\n {{__import__("os")}} {curso|{{x}}'
+        self.assertIn('__import__("os")', self.renderizar(cuerpo))
+
+    def test_marcadores_invalidos(self):
+        for cuerpo in ('Hola {Nombre Completo}', 'Hola {nombre', 'Hola nombre}', 'Hola {1curso}'):
+            with self.subTest(cuerpo=cuerpo):
+                compilada = PlantillaCompilada(cuerpo)
+                self.assertTrue(compilada.errores)
+                with self.assertRaises(ValidationError):
+                    compilada.validar()
+                # Se renderiza tal cual en vez de romper el envío
+                self.assertEqual(compilada.renderizar(Estudiante(nombre='Ana')), cuerpo)
+
+    def test_plantilla_invalida_se_rechaza_en_el_formulario(self):
+        plantilla = Plantilla(nombre_interno='Mala', cuerpo_mensaje='Hola {Nombre Completo}')
+        with self.assertRaises(ValidationError):
+            plantilla.full_clean()
+        # Guardar desde código no valida (solo invalida la plantilla compilada)
+        plantilla.save()
+        self.assertTrue(Plantilla.objects.filter(pk=plantilla.pk).exists())
+
+
+class VentanaTests(TestCase):
+    """Ventana 08:00–18:00 (y 22:00–06:00, que cruza la medianoche) en la zona del proyecto."""
+
+    def momento(self, dia, horas, minutos=0):
+        return datetime(2026, 10, dia, horas, minutos, tzinfo=timezone.get_current_timezone())
+
+    def horas(self, momentos):
+        return [timezone.localtime(m).strftime('%d %H:%M') for m in momentos]
+
+    def test_ajustar(self):
+        casos = [
+            (self.momento(19, 9, 30), hora(8), hora(18), self.momento(19, 9, 30)),
+            (self.momento(19, 6), hora(8), hora(18), self.momento(19, 8)),
+            (self.momento(19, 18), hora(8), hora(18), self.momento(20, 8)),
+            (self.momento(19, 23), hora(8), hora(18), self.momento(20, 8)),
+            (self.momento(19, 3), hora(22), hora(6), self.momento(19, 3)),
+            (self.momento(19, 12), hora(22), hora(6), self.momento(19, 22)),
+            (self.momento(19, 12), None, None, self.momento(19, 12)),
+        ]
+        for momento, inicio, fin, esperado in casos:
+            with self.subTest(momento=momento, inicio=inicio, fin=fin):
+                self.assertEqual(ventana.ajustar(momento, inicio, fin), esperado)
+
+    def test_repartir_con_duracion_cruza_al_dia_siguiente(self):
+        momentos = ventana.repartir(4, self.momento(19, 17), timedelta(hours=4), hora(8), hora(18))
+        self.assertEqual(self.horas(momentos), ['19 17:00', '20 08:00', '20 09:00', '20 10:00'])
+
+    def test_repartir_empezando_fuera_de_la_ventana(self):
+        momentos = ventana.repartir(2, self.momento(19, 20), timedelta(hours=2), hora(8), hora(18))
+        self.assertEqual(self.horas(momentos), ['20 08:00', '20 09:00'])
+
+    def test_repartir_sin_duracion_ocupa_una_ventana_completa(self):
+        momentos = self.horas(ventana.repartir(10, self.momento(19, 16), None, hora(8), hora(18)))
+        self.assertEqual(momentos[:3], ['19 16:00', '19 17:00', '20 08:00'])
+        self.assertEqual(momentos[-1], '20 15:00')
+
+        momentos = ventana.repartir(4, self.momento(19, 23), None, hora(22), hora(6))
+        self.assertEqual(self.horas(momentos), ['19 23:00', '20 01:00', '20 03:00', '20 05:00'])
+
+    def test_sin_ventana_ni_duracion_salen_juntos(self):
+        momentos = list(ventana.repartir(3, self.momento(19, 12)))
+        self.assertEqual(momentos, [self.momento(19, 12)] * 3)
+
+
+class ConexionSMTPFalsa:
+    """Conexión de correo: rechaza 'rechazado' (550) y 'temporal' (451), acepta el resto."""
+
+    def __init__(self):
+        self.aperturas = 0
+        self.enviados = []
+
+    def open(self):
+        self.aperturas += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, correos):
+        destinatario = correos[0].to[0]
+        for clave, codigo in (('rechazado', 550), ('temporal', 451)):
+            if clave in destinatario:
+                raise smtplib.SMTPRecipientsRefused({destinatario: (codigo, b'Rechazado')})
+        self.enviados.append(destinatario)
+        return 1
+
+
+class RespuestaHTTP:
+    status_code = 200
+    text = ''
+
+    def __init__(self, datos):
+        self.datos = datos
+
+    def json(self):
+        return self.datos
+
+
+class SesionFalsa:
+    """API masiva de SMS y de llamadas: rechaza los números terminados en 9."""
+
+    def __init__(self):
+        self.peticiones = []
+
+    def post(self, url, json, timeout):
+        self.peticiones.append(json)
+        if 'messages' in json:
+            return RespuestaHTTP({'messages': [
+                {'status': 'rejected', 'error': 'Número inválido'} if m['to'].endswith('9')
+                else {'id': f"sms-{m['to']}", 'status': 'accepted'}
+                for m in json['messages']
+            ]})
+        return RespuestaHTTP({'id': f"call-{json['to']}"})
+
+
+# Sin limitador: su cupo es una consulta, y con varios canales el de WhatsApp corre en otro hilo
+@override_settings(SMS_API_URL='http://sms.test/sms', VOZ_API_URL='http://voz.test/voz', SMS_LOTE=4, EMAIL_LOTE=4,
+                   WHATSAPP_RATE_LIMIT=0)
+class CanalesTests(BandejaTestCase):
+    """Cada canal agrupa sus envíos como le conviene al proveedor y clasifica sus errores."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Sin email, buzón inexistente, error temporal y el resto válidos
+        correos = ['', 'rechazado@prueba.local', 'temporal@prueba.local']
+        for i, estudiante in enumerate(cls.estudiantes):
+            estudiante.email = correos[i] if i < len(correos) else f'estudiante{i}@prueba.local'
+        Estudiante.objects.bulk_update(cls.estudiantes, ['email'])
+
+    def setUp(self):
+        super().setUp()
+        self.smtp = ConexionSMTPFalsa()
+        self.http = SesionFalsa()
+        for parche in (mock.patch('core.canales.get_connection', return_value=self.smtp),
+                       mock.patch.object(canales.CanalSMS, 'sesion', return_value=self.http),
+                       mock.patch.object(canales.CanalVoz, 'sesion', return_value=self.http)):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def encolar(self, canal):
+        campana = Campana.objects.create(nombre=f'Aviso {canal}', plantilla=self.plantilla, canal_envio=canal)
+        campana.destinatarios.set(self.estudiantes)
+        encolar_campana(campana)
+        return campana
+
+    def test_email_una_conexion_por_grupo(self):
+        self.encolar('email')
+
+        self.enviar()
+
+        self.assertEqual(self.smtp.aperturas, 3)
+        self.assertEqual(len(self.smtp.enviados), 7)
+        # El 451 se reintenta; sin email y el 550 no
+        self.assertEqual(self.estados(), {'ENVIADO': 7, 'FALLIDO': 2, 'PENDIENTE': 1})
+
+    def test_sms_por_el_endpoint_masivo(self):
+        self.encolar('sms')
+
+        self.enviar()
+
+        self.assertEqual([len(p['messages']) for p in self.http.peticiones], [4, 4, 2])
+        self.assertEqual(self.estados(), {'ENVIADO': 9, 'FALLIDO': 1})
+
+    def test_voz_una_llamada_por_destinatario(self):
+        self.encolar('voz')
+
+        self.enviar()
+
+        self.assertEqual(len(self.http.peticiones), 10)
+        self.assertEqual(self.estados(), {'ENVIADO': 10})
+
+    def test_todos_los_canales_en_un_lote(self):
+        for canal in ('whatsapp', 'sms', 'email', 'voz'):
+            self.encolar(canal)
+
+        cliente = self.enviar()
+
+        self.assertEqual(cliente.enviados, 10)
+        self.assertEqual(len(self.smtp.enviados), 7)
+        self.assertEqual(len(self.http.peticiones), 3 + 10)
+        self.assertEqual(MensajeSaliente.objects.filter(estado='ENVIADO').count(), 10 + 9 + 7 + 10)
@@ -1,40 +1,68 @@
-import requests
 from django.conf import settings
 from django.utils import timezone
 from .models import WhatsappLog
+from .whatsapp_client import obtener_cliente
+from .rate_limiter import obtener_limitador, INTERACTIVA
+from .circuito import obtener_circuito, es_fallo_de_api
+from .media import invalidar_media, CODIGOS_MEDIA_INVALIDA
 
+# Códigos de Meta que indican que superamos el throughput de la línea
+CODIGOS_RATE_LIMIT = (130429, 131056, 80007)
 
-def enviar_whatsapp(telefono: str, texto: str, url_imagen: str = None) -> dict:
-    """Enviar mensaje por WhatsApp Cloud API usando `requests` y registrar el intento.
+
+def credenciales_whatsapp(linea=None):
+    """(phone_id, token) de la línea, o los globales WHATSAPP_PHONE_ID / WHATSAPP_TOKEN."""
+    if linea is not None:
+        return linea.credenciales()
+    return getattr(settings, 'WHATSAPP_PHONE_ID', None), getattr(settings, 'WHATSAPP_TOKEN', None)
+
+
+def enviar_whatsapp(telefono: str, texto: str, url_imagen: str = None, buffer_logs=None, linea=None,
+                    media_id: str = None, prioridad: str = INTERACTIVA) -> dict:
+    """Enviar mensaje por WhatsApp Cloud API (cliente HTTP compartido) y registrar el intento.
 
     Parámetros:
     - telefono: número en formato internacional, p.ej. '57310...'
     - texto: cuerpo del mensaje
     - url_imagen: URL de la imagen a enviar (opcional)
+    - buffer_logs: BufferLogs (core.log_buffer) opcional; si se pasa, el WhatsappLog
+      se guarda solo con su estado final y en bloque, sin escrituras síncronas
+    - linea: Linea (core.models) opcional; usa sus credenciales y su límite de
+      mensajes por segundo en lugar de WHATSAPP_PHONE_ID / WHATSAPP_RATE_LIMIT
+    - media_id: id de la imagen ya subida a la Media API (core.media); si se pasa
+      se envía `image.id` en lugar de `image.link`
+    - prioridad: INTERACTIVA (respuestas, por defecto) o MASIVA (campañas); las
+      respuestas pasan delante de las campañas en el cupo de la línea (core.rate_limiter)
 
-    Retorna dict con keys: success(bool), mensaje_id (str|None), response (dict|str).
+    Retorna dict con keys: success(bool), mensaje_id (str|None), response (dict|str),
+    status_code (int|None: None si no hubo respuesta HTTP).
+    Si el circuito de la línea está abierto (core.circuito) retorna al instante sin
+    llamar a la API, con `circuito_abierto=True` y `reanudar_en` (segundos).
     """
-    token = getattr(settings, 'WHATSAPP_TOKEN', None)
-    phone_id = getattr(settings, 'WHATSAPP_PHONE_ID', None)
-    api_version = getattr(settings, 'WHATSAPP_API_VERSION', 'v19.0')
+    phone_id, token = credenciales_whatsapp(linea)
 
     if not token or not phone_id:
         # No configurado
-        return {'success': False, 'mensaje_id': None, 'response': 'Credentials not set'}
+        return {'success': False, 'mensaje_id': None, 'response': 'Credentials not set', 'status_code': None}
+
+    circuito = obtener_circuito(phone_id)
+    if not circuito.permitir():
+        # Meta está caída para esta línea: fallamos rápido en vez de esperar el timeout
+        return {'success': False, 'mensaje_id': None, 'response': 'Circuito abierto: API de WhatsApp no disponible',
+                'status_code': None, 'reintentable': True, 'circuito_abierto': True,
+                'reanudar_en': circuito.reanudar_en()}
 
-    url = f"https://graph.facebook.com/{api_version}/{phone_id}/messages"
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
-    
     # Si hay imagen, enviamos un mensaje tipo 'image' con caption
-    if url_imagen:
+    if media_id or url_imagen:
         payload = {
             'messaging_product': 'whatsapp',
             'to': telefono,
             'type': 'image',
             'image': {
+                # Con media id Meta no vuelve a descargar la imagen de nuestra URL
+                'id': media_id,
+                'caption': texto
+            } if media_id else {
                 'link': url_imagen,
                 'caption': texto
             }
@@ -48,17 +76,30 @@ def enviar_whatsapp(telefono: str, texto: str, url_imagen: str = None) -> dict:
             'text': {'body': texto}
         }
 
-    # Guardamos un log preliminar (estado=PENDING)
-    log = WhatsappLog.objects.create(
-        telefono=telefono,
-        mensaje=texto,
-        mensaje_id=None,
-        estado='PENDING',
-        fecha=timezone.now()
-    )
+    if buffer_logs is None:
+        # Guardamos un log preliminar (estado=PENDING)
+        log = WhatsappLog.objects.create(
+            telefono=telefono,
+            mensaje=texto,
+            mensaje_id=None,
+            estado='PENDING',
+            fecha=timezone.now()
+        )
+        guardar_log = log.save
+    else:
+        log = WhatsappLog(telefono=telefono, mensaje=texto, mensaje_id=None, estado='PENDING')
+        guardar_log = lambda: buffer_logs.agregar_whatsapp(log)
+
+    if linea is not None:
+        limitador = obtener_limitador(phone_id, tasa=linea.mensajes_por_segundo)
+    else:
+        limitador = obtener_limitador(phone_id)
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=10)
+        # Esperamos turno en el token bucket de la línea antes de llamar a la API
+        limitador.adquirir(prioridad=prioridad)
+        resp = obtener_cliente().enviar_mensaje(phone_id, token, payload)
+        circuito.registrar(exito=not es_fallo_de_api(resp.status_code))
         try:
             data = resp.json()
         except Exception:
@@ -68,17 +109,26 @@ def enviar_whatsapp(telefono: str, texto: str, url_imagen: str = None) -> dict:
             mensaje_id = data['messages'][0].get('id')
             log.mensaje_id = mensaje_id
             log.estado = 'SENT'
-            log.save()
-            return {'success': True, 'mensaje_id': mensaje_id, 'response': data}
+            guardar_log()
+            return {'success': True, 'mensaje_id': mensaje_id, 'response': data, 'status_code': resp.status_code}
         else:
             # Error desde la API
             err = data.get('error', data)
+            codigo = err.get('code') if isinstance(err, dict) else None
+            if resp.status_code == 429 or codigo in CODIGOS_RATE_LIMIT:
+                limitador.penalizar()
             log.estado = 'ERROR'
-            log.save()
-            return {'success': False, 'mensaje_id': None, 'response': err}
+            guardar_log()
+            resultado = {'success': False, 'mensaje_id': None, 'response': err, 'status_code': resp.status_code}
+            if media_id and codigo in CODIGOS_MEDIA_INVALIDA:
+                # El media id caducó o Meta lo borró: se vuelve a subir y el mensaje se reintenta
+                invalidar_media(media_id)
+                resultado['reintentable'] = True
+            return resultado
 
     except Exception as e:
         # Error de conexión u otra excepción
+        circuito.registrar(exito=False)
         log.estado = 'ERROR'
-        log.save()
-        return {'success': False, 'mensaje_id': None, 'response': str(e)}
+        guardar_log()
+        return {'success': False, 'mensaje_id': None, 'response': str(e), 'status_code': None}
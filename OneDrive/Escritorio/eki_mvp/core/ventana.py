@@ -0,0 +1,81 @@
+"""
+Ventana horaria y ritmo de envío de las campañas.
+
+Una campaña con ventana (p.ej. 08:00–18:00, en settings.TIME_ZONE) solo envía
+dentro de ese horario; lo que no cabe en el día pasa a la ventana siguiente.
+Con una duración objetivo, los mensajes se reparten a intervalos iguales a lo
+largo de ese tiempo de envío (contando solo horas dentro de la ventana) en
+vez de salir todos de golpe: las respuestas de los destinatarios llegan al
+webhook repartidas igual. El reparto se fija al encolar, en
+MensajeSaliente.proximo_intento; los workers no necesitan saber nada de esto.
+"""
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+
+def ventanas(desde: datetime, inicio=None, fin=None):
+    """
+    Genera los tramos (abre, cierra) en que se puede enviar a partir de `desde`,
+    en la zona horaria del proyecto. El primero se recorta en `desde`.
+    Sin ventana, un único tramo sin fin (cierra=None). Admite ventanas que cruzan
+    la medianoche (22:00–06:00).
+    """
+    if inicio is None or fin is None:
+        yield desde, None
+        return
+
+    zona = timezone.get_current_timezone()
+    dia = timezone.localtime(desde, zona).date() - timedelta(days=1)
+    while True:
+        abre = datetime.combine(dia, inicio, tzinfo=zona)
+        cierra = datetime.combine(dia + timedelta(days=1) if fin <= inicio else dia, fin, tzinfo=zona)
+        dia += timedelta(days=1)
+        if cierra <= desde:
+            continue
+        yield max(abre, desde), cierra
+
+
+def ajustar(momento: datetime, inicio=None, fin=None) -> datetime:
+    """`momento` si cae dentro de la ventana; si no, la próxima apertura."""
+    abre, _ = next(ventanas(momento, inicio, fin))
+    return abre
+
+
+def en_ventana(momento: datetime, inicio=None, fin=None) -> bool:
+    return ajustar(momento, inicio, fin) == momento
+
+
+def duracion_ventana(inicio, fin) -> float:
+    """Segundos de envío de una ventana completa (admite que cruce la medianoche)."""
+    dia = datetime(2000, 1, 1)
+    segundos = (datetime.combine(dia, fin) - datetime.combine(dia, inicio)).total_seconds()
+    return segundos if segundos > 0 else segundos + 24 * 3600
+
+
+def repartir(total: int, desde: datetime, duracion: timedelta = None, inicio=None, fin=None):
+    """
+    Genera `total` momentos de envío repartidos a intervalos iguales a lo largo de
+    `duracion` de tiempo dentro de la ventana, empezando en `desde`. Sin duración,
+    el reparto ocupa una ventana completa: si se encola con la ventana a medias,
+    lo que no cabe hoy sigue en la del día siguiente. Sin ventana ni duración,
+    todos salen en `desde` (ajustado a la ventana).
+    """
+    if duracion is not None:
+        segundos = duracion.total_seconds()
+    elif inicio is not None and fin is not None:
+        segundos = duracion_ventana(inicio, fin)
+    else:
+        segundos = 0.0
+    intervalo = segundos / total if total else 0.0
+
+    tramos = ventanas(desde, inicio, fin)
+    abre, cierra = next(tramos)
+    # Segundos de envío consumidos por los tramos ya recorridos
+    consumido = 0.0
+    for i in range(total):
+        objetivo = i * intervalo
+        while cierra is not None and objetivo - consumido >= (cierra - abre).total_seconds():
+            consumido += (cierra - abre).total_seconds()
+            abre, cierra = next(tramos)
+        yield abre + timedelta(seconds=objetivo - consumido)
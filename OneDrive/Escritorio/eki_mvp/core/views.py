@@ -3,15 +3,14 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse, JsonResponse
 from django.conf import settings
+from django.db import transaction
 from datetime import datetime, timedelta
 import json
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 
-from .models import Campana, EnvioLog, Estudiante, WhatsappLog
-from .utils import enviar_whatsapp
-from .intent_detector import detect_intent
-from .response_templates import get_response_for_intent
+from .models import Campana, EnvioLog, Estudiante, WhatsappLog, WebhookEvento, MensajeRecibido
+from .webhook import procesar_payload, descartar_repetidos, registrar_recibidos, sin_eventos, olvidar_vistos
 
 @staff_member_required
 def dashboard_view(request):
@@ -344,7 +343,8 @@ def importar_estudiantes(request):
 @csrf_exempt
 def whatsapp_webhook(request):
     """GET: Verificación del token (hub.verify_token).
-       POST: Procesa mensajes entrantes, detecta intención y responde dinámicamente.
+       POST: Guarda el evento y responde al instante; el comando procesar_webhooks
+       detecta la intención y responde (core.webhook).
     """
     if request.method == 'GET':
         verify_token = request.GET.get('hub.verify_token') or request.GET.get('hub.verify_token')
@@ -356,85 +356,37 @@ def whatsapp_webhook(request):
 
     if request.method == 'POST':
         try:
-            payload = json.loads(request.body.decode('utf-8'))
+            cuerpo = request.body.decode('utf-8')
+            payload = json.loads(cuerpo)
         except Exception:
             return JsonResponse({'ok': False, 'error': 'invalid_json'}, status=400)
 
-        entries = payload.get('entry', []) or payload.get('entry', [])
+        # Reintentos de Meta: los que este proceso ya vio se descartan sin tocar la base; los que
+        # recibió otro worker los frena el índice único de MensajeRecibido al registrarlos
+        nuevos, repetidos = descartar_repetidos(payload)
+        if repetidos:
+            print(f"♻️ Webhook: {repetidos} mensajes repetidos descartados")
+            if sin_eventos(payload):
+                return JsonResponse({'ok': True})
+            cuerpo = json.dumps(payload)
 
-        for entry in entries:
-            changes = entry.get('changes', [])
-            for change in changes:
-                value = change.get('value', {})
-
-                # Mensajes entrantes
-                messages = value.get('messages', [])
-                for m in messages:
-                    phone = m.get('from')
-                    msg_id = m.get('id')
-                    text = ''
-                    if 'text' in m and isinstance(m['text'], dict):
-                        text = m['text'].get('body', '')
-                    
-                    # 1. Guardar registro entrante
-                    WhatsappLog.objects.create(
-                        telefono=phone,
-                        mensaje=text,
-                        mensaje_id=msg_id,
-                        estado='INCOMING'
-                    )
-                    
-                    # 2. Detectar intención
-                    intent = detect_intent(text)
-                    
-                    # 3. Obtener datos del estudiante (por teléfono)
-                    try:
-                        estudiante = Estudiante.objects.get(telefono=phone)
-                        nombre_usuario = estudiante.nombre
-                        
-                        # 3a. Obtener progreso desde el modelo
-                        total_envios = EnvioLog.objects.filter(estudiante=estudiante).count()
-                        exitosos = EnvioLog.objects.filter(estudiante=estudiante, estado='ENVIADO').count()
-                        progreso_porcentaje = int((exitosos / total_envios * 100) if total_envios > 0 else 0)
-                        
-                        # 3b. Obtener siguiente tarea
-                        siguiente_tarea_obj = EnvioLog.objects.filter(
-                            estudiante=estudiante,
-                            estado='PENDIENTE'
-                        ).order_by('fecha_envio').first()
-                        siguiente_tarea = siguiente_tarea_obj.campana.nombre if siguiente_tarea_obj else "No hay tareas pendientes"
-                        
-                        datos_respuesta = {
-                            'progreso': f'{progreso_porcentaje}%',
-                            'modulo_actual': 'Introducción a la Plataforma',
-                            'siguiente_tarea': siguiente_tarea,
-                            'fecha_vence': 'hoy'
-                        }
-                    except Estudiante.DoesNotExist:
-                        nombre_usuario = 'Estudiante'
-                        datos_respuesta = {}
-                    
-                    # 4. Generar respuesta según intención
-                    texto_respuesta = get_response_for_intent(intent, nombre_usuario, **datos_respuesta)
-                    
-                    # 5. Enviar respuesta al usuario
-                    resultado_envio = enviar_whatsapp(phone, texto_respuesta)
-                    
-                    # Log de envío (respuesta generada)
-                    if resultado_envio.get('success'):
-                        WhatsappLog.objects.create(
-                            telefono=phone,
-                            mensaje=texto_respuesta,
-                            mensaje_id=resultado_envio.get('mensaje_id'),
-                            estado='SENT'
-                        )
-
-                # Estados (delivery receipts)
-                statuses = value.get('statuses', [])
-                for s in statuses:
-                    msg_id = s.get('id')
-                    status = s.get('status')
-                    if msg_id:
-                        WhatsappLog.objects.filter(mensaje_id=msg_id).update(estado=status)
+        en_linea = getattr(settings, 'WEBHOOK_EN_LINEA', False)
+        try:
+            # Los ids y el evento se guardan juntos: si uno falla, no queda ninguno
+            with transaction.atomic():
+                if len(registrar_recibidos(payload, nuevos)) < len(nuevos):
+                    cuerpo = json.dumps(payload)
+                if not en_linea and not sin_eventos(payload):
+                    # Un solo INSERT y respondemos: `procesar_webhooks` hace el resto (core/webhook.py)
+                    WebhookEvento.objects.create(cuerpo=cuerpo)
+            if en_linea and not sin_eventos(payload):
+                # Modo desarrollo: se procesa dentro de la petición, sin consumidor aparte
+                procesar_payload(payload)
+        except Exception:
+            # No quedó guardado: el reintento de Meta no debe tomarse como repetido
+            olvidar_vistos(nuevos)
+            if en_linea:
+                MensajeRecibido.objects.filter(mensaje_id__in=nuevos).delete()
+            raise
 
         return JsonResponse({'ok': True})
@@ -0,0 +1,343 @@
+"""
+Procesamiento de los eventos del webhook de WhatsApp.
+
+La vista `whatsapp_webhook` solo guarda el cuerpo crudo de cada POST en
+WebhookEvento (un INSERT) y responde 200 al instante: si Meta no recibe
+respuesta rápido reintenta el envío y multiplica la carga. El comando
+`procesar_webhooks` reclama los eventos por lotes y un pool de hilos hace
+lo lento: detectar la intención, buscar al estudiante, responder por la
+Graph API y registrar los estados de entrega.
+"""
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import WhatsappLog, Linea, WebhookEvento, MensajeRecibido
+from .utils import enviar_whatsapp
+from .rate_limiter import INTERACTIVA
+from .intent_detector import detect_intent
+from .response_templates import get_response_for_intent
+from .dispatcher import despachar
+from .log_buffer import BufferLogs
+from . import contexto
+
+# Eventos reclamados por lote del consumidor
+TAMANO_LOTE_EVENTOS = 50
+
+
+# Últimos ids de mensaje entrante vistos por este proceso (LRU): el reintento que llega
+# al mismo worker se descarta sin tocar la base. Entre workers deduplica la tabla
+# MensajeRecibido (índice único), que se escribe junto con el evento
+_vistos = OrderedDict()
+_vistos_lock = threading.Lock()
+
+# Orden de los estados de entrega: un mensaje solo avanza. Meta no garantiza el
+# orden de los recibos y un "delivered" atrasado no debe pisar un "read".
+# SENT es el log propio de enviar_whatsapp; un log en un estado que no está aquí
+# (INCOMING, PENDING, ERROR) cuenta como 0, y un recibo con uno así se ignora.
+ORDEN_ESTADOS = {'SENT': 1, 'sent': 1, 'delivered': 2, 'read': 3, 'failed': 3}
+
+# mensaje_ids por UPDATE al aplicar los estados (límite de variables de SQLite)
+TAMANO_LOTE_ESTADOS = 500
+
+
+class BufferEstados:
+    """
+    Estados de entrega pendientes de aplicar, {mensaje_id: estado}. De varios recibos
+    del mismo mensaje se queda con el más avanzado. Lo comparten los hilos que
+    procesan un lote de eventos; vaciar() los aplica con un UPDATE por cada
+    TAMANO_LOTE_ESTADOS mensajes en vez de uno por recibo.
+    """
+
+    def __init__(self):
+        self.estados = {}
+        self._lock = threading.Lock()
+
+    def agregar(self, mensaje_id: str, estado: str):
+        if estado not in ORDEN_ESTADOS:
+            # Estado desconocido o sin estado: no hay cómo ordenarlo, se ignora
+            return
+        with self._lock:
+            actual = self.estados.get(mensaje_id)
+            if actual is None or ORDEN_ESTADOS.get(estado, 0) > ORDEN_ESTADOS.get(actual, 0):
+                self.estados[mensaje_id] = estado
+
+    def vaciar(self) -> int:
+        with self._lock:
+            estados, self.estados = self.estados, {}
+        return aplicar_estados(estados)
+
+
+def _recordar(mensaje_id: str):
+    with _vistos_lock:
+        _vistos[mensaje_id] = True
+        _vistos.move_to_end(mensaje_id)
+        while len(_vistos) > getattr(settings, 'WEBHOOK_DEDUP_LRU', 10000):
+            _vistos.popitem(last=False)
+
+
+def marcar_visto(mensaje_id: str) -> bool:
+    """
+    Marca un mensaje entrante como visto por este proceso. True si es la primera
+    vez; False si ya estaba en el LRU. Lo que otro worker ya recibió lo descarta
+    después `registrar_recibidos`.
+    """
+    with _vistos_lock:
+        if mensaje_id in _vistos:
+            _vistos.move_to_end(mensaje_id)
+            return False
+    _recordar(mensaje_id)
+    return True
+
+
+def olvidar_vistos(mensaje_ids):
+    """Desmarca mensajes que no se llegaron a guardar, para aceptar el reintento de Meta."""
+    with _vistos_lock:
+        for mensaje_id in mensaje_ids:
+            _vistos.pop(mensaje_id, None)
+
+
+def descartar_repetidos(payload: dict):
+    """
+    Quita del payload los mensajes entrantes ya recibidos (Meta reintenta el POST si
+    no respondimos a tiempo) para no guardarlos ni responderlos dos veces.
+    Los estados de entrega se dejan: solo avanzan, aplicarlos de nuevo no cambia nada.
+    Retorna (ids nuevos marcados como vistos, cantidad de mensajes descartados).
+    """
+    nuevos = []
+
+    def es_nuevo(mensaje_id):
+        if mensaje_id is None:
+            # Sin id no hay cómo reconocer el reintento
+            return True
+        if marcar_visto(mensaje_id):
+            nuevos.append(mensaje_id)
+            return True
+        return False
+
+    repetidos = _filtrar_mensajes(payload, es_nuevo)
+    return nuevos, repetidos
+
+
+def _filtrar_mensajes(payload: dict, conservar) -> int:
+    """Deja en el payload los mensajes cuyo id cumple `conservar`. Retorna cuántos quitó."""
+    quitados = 0
+    for entry in payload.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            if not value.get('messages'):
+                continue
+            mensajes = [m for m in value['messages'] if conservar(m.get('id'))]
+            quitados += len(value['messages']) - len(mensajes)
+            value['messages'] = mensajes
+    return quitados
+
+
+def registrar_recibidos(payload: dict, nuevos: list) -> list:
+    """
+    Guarda los ids nuevos en MensajeRecibido: un solo INSERT que es la deduplicación
+    entre workers. Si alguno ya estaba (lo recibió otro worker o este proceso lo
+    olvidó) el índice único lo rechaza y se quita del payload. Retorna los ids que sí eran nuevos.
+    """
+    if not nuevos:
+        return nuevos
+    try:
+        with transaction.atomic():
+            MensajeRecibido.objects.bulk_create([MensajeRecibido(mensaje_id=mensaje_id) for mensaje_id in nuevos])
+        return nuevos
+    except IntegrityError:
+        ya_recibidos = set(
+            MensajeRecibido.objects.filter(mensaje_id__in=nuevos).values_list('mensaje_id', flat=True)
+        )
+        print(f"♻️ Webhook: {len(ya_recibidos)} mensajes repetidos descartados (ya recibidos)")
+        _filtrar_mensajes(payload, lambda mensaje_id: mensaje_id not in ya_recibidos)
+        restantes = [mensaje_id for mensaje_id in nuevos if mensaje_id not in ya_recibidos]
+        MensajeRecibido.objects.bulk_create([MensajeRecibido(mensaje_id=mensaje_id) for mensaje_id in restantes])
+        return restantes
+
+
+def sin_eventos(payload: dict) -> bool:
+    """True si el payload no trae mensajes ni estados de entrega."""
+    return not any(
+        change.get('value', {}).get('messages') or change.get('value', {}).get('statuses')
+        for entry in payload.get('entry', []) for change in entry.get('changes', [])
+    )
+
+
+def procesar_payload(payload: dict, estados: BufferEstados = None):
+    """
+    Procesa un POST del webhook: mensajes entrantes (se responden) y estados de entrega.
+
+    Un POST puede traer muchos `entry`/`changes`/`messages`/`statuses`: primero se
+    junta todo y luego se resuelve con un número fijo de consultas (líneas, un
+    INSERT de los entrantes, el contexto de los estudiantes que no está en el
+    cache (core.contexto) y un UPDATE de los estados),
+    sin importar cuántos mensajes traiga. Con `estados` (BufferEstados) los recibos
+    se acumulan ahí y los aplica quien vacíe el buffer.
+    """
+    entrantes = []
+    propio = estados is None
+    if propio:
+        estados = BufferEstados()
+
+    for entry in payload.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            # La respuesta sale por la línea que recibió el mensaje, con prioridad sobre sus campañas
+            phone_number_id = value.get('metadata', {}).get('phone_number_id')
+            for m in value.get('messages', []):
+                entrantes.append((m, phone_number_id))
+            for s in value.get('statuses', []):
+                if s.get('id'):
+                    estados.agregar(s['id'], s.get('status'))
+
+    if entrantes:
+        responder_mensajes(entrantes)
+    if propio:
+        estados.vaciar()
+
+
+def responder_mensajes(entrantes):
+    """Registra los mensajes entrantes [(mensaje, phone_number_id)] y responde a cada uno."""
+    phone_ids = {phone_number_id for _, phone_number_id in entrantes if phone_number_id}
+    lineas = {linea.phone_id: linea for linea in Linea.objects.filter(phone_id__in=phone_ids)} if phone_ids else {}
+
+    # 1. Guardar los registros entrantes (un solo INSERT)
+    mensajes = []
+    entrantes_log = []
+    for m, phone_number_id in entrantes:
+        phone = m.get('from')
+        text = ''
+        if 'text' in m and isinstance(m['text'], dict):
+            text = m['text'].get('body', '')
+        mensajes.append((phone, text, lineas.get(phone_number_id)))
+        entrantes_log.append(WhatsappLog(telefono=phone, mensaje=text, mensaje_id=m.get('id'), estado='INCOMING'))
+    WhatsappLog.objects.bulk_create(entrantes_log)
+
+    # 2. Contexto de los estudiantes (por teléfono): del cache, sin consultas si ya escribieron antes
+    contextos = contexto.obtener({phone for phone, _, _ in mensajes})
+
+    # 3. Detectar intención y responder. enviar_whatsapp deja el log de cada
+    # respuesta (SENT/ERROR) en el buffer y se guardan todos juntos al salir
+    with BufferLogs() as buffer:
+        for phone, text, linea in mensajes:
+            intent = detect_intent(text)
+            datos = contextos.get(phone)
+            if datos is not None:
+                texto_respuesta = get_response_for_intent(intent, datos['nombre'], **contexto.datos_respuesta(datos))
+            else:
+                texto_respuesta = get_response_for_intent(intent, 'Estudiante')
+            enviar_whatsapp(phone, texto_respuesta, linea=linea, prioridad=INTERACTIVA, buffer_logs=buffer)
+
+
+def aplicar_estados(estados: dict) -> int:
+    """
+    Aplica los estados de entrega {mensaje_id: estado} con un solo UPDATE (CASE por
+    estado) cada TAMANO_LOTE_ESTADOS mensajes. Solo cambian los logs cuyo estado
+    actual va antes en ORDEN_ESTADOS; los estados que no están en ORDEN_ESTADOS
+    (desconocidos o None) se descartan. Retorna cuántos logs cambiaron.
+    """
+    ids = [mensaje_id for mensaje_id, estado in estados.items() if estado in ORDEN_ESTADOS]
+    actualizados = 0
+    for i in range(0, len(ids), TAMANO_LOTE_ESTADOS):
+        por_estado = {}
+        for mensaje_id in ids[i:i + TAMANO_LOTE_ESTADOS]:
+            por_estado.setdefault(estados[mensaje_id], []).append(mensaje_id)
+
+        condiciones = {
+            estado: Q(mensaje_id__in=mensaje_ids) & ~Q(estado__in=[
+                e for e, orden in ORDEN_ESTADOS.items() if orden >= ORDEN_ESTADOS[estado]
+            ])
+            for estado, mensaje_ids in por_estado.items()
+        }
+        actualizados += WhatsappLog.objects.filter(reduce(or_, condiciones.values())).update(
+            estado=Case(*(When(condicion, then=Value(estado)) for estado, condicion in condiciones.items()),
+                        default=F('estado'))
+        )
+    return actualizados
+
+
+def reclamar_eventos(tamano: int = TAMANO_LOTE_EVENTOS) -> list:
+    """
+    Marca como PROCESANDO hasta `tamano` eventos pendientes (los más antiguos primero)
+    y los devuelve. Como en la bandeja de salida, el UPDATE condicionado al estado
+    garantiza que dos consumidores nunca procesan el mismo evento.
+    """
+    ids = list(
+        WebhookEvento.objects.filter(estado='PENDIENTE').order_by('id').values_list('id', flat=True)[:tamano]
+    )
+    if not ids:
+        return []
+
+    lote = uuid.uuid4().hex
+    WebhookEvento.objects.filter(id__in=ids, estado='PENDIENTE').update(
+        estado='PROCESANDO', lote=lote, reclamado_en=timezone.now()
+    )
+    return list(WebhookEvento.objects.filter(lote=lote).order_by('id'))
+
+
+def procesar_evento(evento: WebhookEvento, estados: BufferEstados = None):
+    procesar_payload(json.loads(evento.cuerpo), estados)
+
+
+def procesar_eventos(eventos, hilos: int = 1) -> dict:
+    """
+    Procesa un lote de eventos en `hilos` hilos y guarda cómo terminó cada uno.
+    Un evento que falla queda en ERROR (con el motivo) para revisarlo y
+    reprocesarlo desde el admin; no se reintenta solo porque pudo responder a medias.
+    Los estados de entrega de todo el lote se aplican juntos al final (BufferEstados).
+    Retorna {"procesados": n, "errores": n}.
+    """
+    conteo = {"procesados": 0, "errores": 0}
+    procesados = []
+    con_error = []
+    estados = BufferEstados()
+    for evento, _, error in despachar(eventos, lambda evento: procesar_evento(evento, estados), concurrencia=hilos):
+        if error is None:
+            procesados.append(evento.pk)
+            conteo["procesados"] += 1
+        else:
+            evento.lote = None
+            evento.procesado_en = timezone.now()
+            evento.estado = 'ERROR'
+            evento.error = f"{type(error).__name__}: {error}"
+            con_error.append(evento)
+            conteo["errores"] += 1
+            print(f"❌ Webhook {evento.pk}: {evento.error}")
+
+    # Si falla, los eventos siguen en PROCESANDO y vuelven a la cola como huérfanos
+    estados.vaciar()
+    # Los procesados terminan todos igual: un UPDATE (bulk_update arma un CASE por fila y campo)
+    WebhookEvento.objects.filter(pk__in=procesados).update(
+        estado='PROCESADO', lote=None, error=None, procesado_en=timezone.now()
+    )
+    if con_error:
+        WebhookEvento.objects.bulk_update(con_error, ['estado', 'lote', 'error', 'procesado_en'], batch_size=500)
+    return conteo
+
+
+def liberar_eventos_huerfanos(minutos: int = 5) -> int:
+    """Devuelve a PENDIENTE los eventos que un consumidor caído dejó en PROCESANDO."""
+    return WebhookEvento.objects.filter(
+        estado='PROCESANDO', reclamado_en__lte=timezone.now() - timedelta(minutes=minutos)
+    ).update(estado='PENDIENTE', lote=None, reclamado_en=None)
+
+
+def purgar_procesados(dias: int) -> int:
+    """
+    Borra los eventos procesados hace más de `dias` días, y los ids de mensajes
+    recibidos de esa antigüedad (Meta ya no los reintenta). Retorna cuántos eventos.
+    """
+    limite = timezone.now() - timedelta(days=dias)
+    borrados, _ = WebhookEvento.objects.filter(estado='PROCESADO', procesado_en__lte=limite).delete()
+    MensajeRecibido.objects.filter(recibido_en__lte=limite).delete()
+    return borrados
@@ -0,0 +1,133 @@
+"""
+Cliente HTTP compartido para la WhatsApp Cloud API.
+Mantiene una `requests.Session` con conexiones keep-alive por phone_id, para que
+cada envío reutilice la conexión TCP+TLS en lugar de abrir una nueva.
+Es seguro usarlo desde varios hilos (despachador de campañas y webhook).
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+
+class WhatsappClient:
+    """Pool de sesiones HTTP por (phone_id, token) con estadísticas de reutilización."""
+
+    def __init__(self, pool_size: int = None, timeout: float = 10):
+        self.pool_size = pool_size or max(getattr(settings, 'CAMPANA_CONCURRENCIA', 1), 10)
+        self.timeout = timeout
+        self._sesiones = {}
+        self._peticiones = {}
+        self._conexiones_retiradas = {}
+        self._lock = threading.Lock()
+
+    def _crear_adapter(self):
+        return HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+
+    def _sesion(self, phone_id: str, token: str) -> requests.Session:
+        clave = (phone_id, token)
+        sesion = self._sesiones.get(clave)
+        if sesion is not None:
+            return sesion
+        with self._lock:
+            if clave not in self._sesiones:
+                sesion = requests.Session()
+                sesion.headers.update({
+                    'Authorization': f'Bearer {token}',
+                    'Content-Type': 'application/json'
+                })
+                sesion.mount('http://', self._crear_adapter())
+                sesion.mount('https://', self._crear_adapter())
+                self._sesiones[clave] = sesion
+            return self._sesiones[clave]
+
+    def ajustar_pool(self, concurrencia: int):
+        """Amplía el pool de conexiones si el despachador va a usar más hilos que conexiones."""
+        with self._lock:
+            if concurrencia <= self.pool_size:
+                return
+            self.pool_size = concurrencia
+            for (phone_id, _), sesion in self._sesiones.items():
+                self._conexiones_retiradas[phone_id] = (
+                    self._conexiones_retiradas.get(phone_id, 0) + self._contar_conexiones(sesion)
+                )
+                sesion.mount('http://', self._crear_adapter())
+                sesion.mount('https://', self._crear_adapter())
+
+    def enviar_mensaje(self, phone_id: str, token: str, payload: dict) -> requests.Response:
+        """POST /{version}/{phone_id}/messages reutilizando la conexión del pool."""
+        api_url = getattr(settings, 'WHATSAPP_API_URL', 'https://graph.facebook.com')
+        api_version = getattr(settings, 'WHATSAPP_API_VERSION', 'v19.0')
+        url = f"{api_url}/{api_version}/{phone_id}/messages"
+
+        with self._lock:
+            self._peticiones[phone_id] = self._peticiones.get(phone_id, 0) + 1
+        return self._sesion(phone_id, token).post(url, json=payload, timeout=self.timeout)
+
+    def subir_media(self, phone_id: str, token: str, contenido: bytes, mime_type: str, nombre: str) -> requests.Response:
+        """POST /{version}/{phone_id}/media (multipart) con la misma sesión keep-alive."""
+        api_url = getattr(settings, 'WHATSAPP_API_URL', 'https://graph.facebook.com')
+        api_version = getattr(settings, 'WHATSAPP_API_VERSION', 'v19.0')
+        url = f"{api_url}/{api_version}/{phone_id}/media"
+
+        with self._lock:
+            self._peticiones[phone_id] = self._peticiones.get(phone_id, 0) + 1
+        return self._sesion(phone_id, token).post(
+            url,
+            data={'messaging_product': 'whatsapp', 'type': mime_type},
+            files={'file': (nombre, contenido, mime_type)},
+            # Quitamos el Content-Type JSON de la sesión para que requests ponga el de multipart
+            headers={'Content-Type': None},
+            timeout=max(self.timeout, 30),
+        )
+
+    @staticmethod
+    def _contar_conexiones(sesion) -> int:
+        total = 0
+        for adapter in sesion.adapters.values():
+            pools = adapter.poolmanager.pools
+            for clave in pools.keys():
+                total += pools[clave].num_connections
+        return total
+
+    def estadisticas(self) -> dict:
+        """
+        Retorna por phone_id: peticiones, conexiones abiertas (handshakes)
+        y cuántas peticiones reutilizaron una conexión existente.
+        """
+        with self._lock:
+            conexiones = dict(self._conexiones_retiradas)
+            for (phone_id, _), sesion in self._sesiones.items():
+                conexiones[phone_id] = conexiones.get(phone_id, 0) + self._contar_conexiones(sesion)
+
+            stats = {}
+            for phone_id, peticiones in self._peticiones.items():
+                abiertas = conexiones.get(phone_id, 0)
+                stats[phone_id] = {
+                    'peticiones': peticiones,
+                    'conexiones': abiertas,
+                    'reutilizadas': max(peticiones - abiertas, 0),
+                    'pool_size': self.pool_size,
+                }
+            return stats
+
+    def cerrar(self):
+        with self._lock:
+            for sesion in self._sesiones.values():
+                sesion.close()
+            self._sesiones.clear()
+
+
+_cliente = None
+_cliente_lock = threading.Lock()
+
+
+def obtener_cliente() -> WhatsappClient:
+    """Cliente único por proceso (cada worker de gunicorn tiene el suyo)."""
+    global _cliente
+    if _cliente is None:
+        with _cliente_lock:
+            if _cliente is None:
+                _cliente = WhatsappClient()
+    return _cliente
@@ -59,6 +59,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Los envíos concurrentes escriben desde varios hilos: esperamos el lock de SQLite.
+        # WAL: las lecturas no bloquean a quien escribe y cada commit es un append corto
+        # (el webhook guarda cada POST con un INSERT y responde, ver core/webhook.py)
+        'OPTIONS': {
+            'timeout': 20,
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
@@ -88,6 +96,28 @@ CSRF_TRUSTED_ORIGINS = os.environ.get('CSRF_TRUSTED_ORIGINS', 'http://localhost:
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache compartido entre todos los procesos del Procfile (web con varios workers de gunicorn,
+# worker, scheduler, webhooks): circuit breaker, progreso de campañas, avisos al programador y
+# contexto del bot (el limitador de velocidad de cada línea vive en la tabla CupoEnvio). Por defecto en la base (DatabaseCache; la migración
+# 0022 crea sus tablas); CACHE_BACKEND/CACHE_LOCATION permiten usar Redis o Memcached.
+# Un LocMemCache es de cada proceso: con él nada de lo anterior se comparte (ver core/checks.py)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'eki_cache'),
+        # El progreso escribe una clave por segundo: que el recorte no borre el de circuitos y campañas
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    # Contexto de cada estudiante para el bot (core/contexto.py). Va aparte para que las miles de claves no desplacen las del circuito y el
+    # progreso; con Redis, CACHE_WEBHOOK_LOCATION puede ser la misma URL que CACHE_LOCATION
+    'webhook': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_WEBHOOK_LOCATION', 'eki_webhook'),
+        'KEY_PREFIX': 'webhook',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 # ==========================================
 # 🎨 8. CONFIGURACIÓN VISUAL JAZZMIN
 # ==========================================
@@ -165,7 +195,110 @@ JAZZMIN_UI_TWEAKS = {
 # ==========================================
 # 🔌 CREDENCIALES WHATSAPP CLOUD API
 # ==========================================
+WHATSAPP_API_URL = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com')
 WHATSAPP_API_VERSION = os.environ.get('WHATSAPP_API_VERSION', 'v19.0')
 WHATSAPP_TOKEN = os.environ.get('WHATSAPP_TOKEN', '')
 WHATSAPP_PHONE_ID = os.environ.get('WHATSAPP_PHONE_ID', '')
 WHATSAPP_VERIFY_TOKEN = os.environ.get('WHATSAPP_VERIFY_TOKEN', 'eki_whatsapp_verify_token_2025')
+
+# El webhook solo guarda cada POST (WebhookEvento) y responde; `procesar_webhooks` lo procesa con
+# WEBHOOK_HILOS hilos. WEBHOOK_EN_LINEA=True procesa dentro de la petición (desarrollo, sin consumidor)
+WEBHOOK_EN_LINEA = os.environ.get('WEBHOOK_EN_LINEA', 'False') == 'True'
+WEBHOOK_HILOS = int(os.environ.get('WEBHOOK_HILOS', '8'))
+WEBHOOK_RETENCION_DIAS = int(os.environ.get('WEBHOOK_RETENCION_DIAS', '7'))
+# Meta reintenta un webhook sin respuesta durante días: los ids de mensaje recibidos quedan en
+# MensajeRecibido (WEBHOOK_RETENCION_DIAS) y los últimos WEBHOOK_DEDUP_LRU también en memoria
+WEBHOOK_DEDUP_LRU = int(os.environ.get('WEBHOOK_DEDUP_LRU', '10000'))
+# Contexto de cada estudiante para las respuestas del bot (cache 'webhook', core/contexto.py);
+# los envíos lo mantienen al día, el TTL solo acota lo que un cambio no previsto lo deja desfasado
+WEBHOOK_CONTEXTO_TTL = int(os.environ.get('WEBHOOK_CONTEXTO_TTL', '900'))
+
+# Modo de prueba: los envíos van al mock local de la Graph API (python manage.py mock_whatsapp)
+# en lugar de Meta. Sirve para pruebas de carga sin costo ni riesgo de escribir a números reales
+WHATSAPP_DRY_RUN = os.environ.get('WHATSAPP_DRY_RUN', 'False') == 'True'
+WHATSAPP_MOCK_URL = os.environ.get('WHATSAPP_MOCK_URL', 'http://127.0.0.1:8099')
+if WHATSAPP_DRY_RUN:
+    WHATSAPP_API_URL = WHATSAPP_MOCK_URL
+    WHATSAPP_TOKEN = WHATSAPP_TOKEN or 'token-dry-run'
+    WHATSAPP_PHONE_ID = WHATSAPP_PHONE_ID or '100000000000000'
+
+# ==========================================
+# 🚀 DESPACHO DE CAMPAÑAS
+# ==========================================
+# Número de hilos que envían en paralelo (1 = envío secuencial)
+CAMPANA_CONCURRENCIA = int(os.environ.get('CAMPANA_CONCURRENCIA', '1'))
+
+# Reintentos de errores temporales (timeouts, 5xx, rate limit): backoff exponencial con jitter
+CAMPANA_MAX_INTENTOS = int(os.environ.get('CAMPANA_MAX_INTENTOS', '5'))
+CAMPANA_BACKOFF_BASE = float(os.environ.get('CAMPANA_BACKOFF_BASE', '2'))   # segundos
+CAMPANA_BACKOFF_MAX = float(os.environ.get('CAMPANA_BACKOFF_MAX', '300'))   # segundos
+
+# Particiones de la bandeja (estudiante_id % N): cada worker de procesar_envios arrienda
+# particiones y solo reclama de ellas, así varios procesos no compiten por las mismas filas
+CAMPANA_PARTICIONES = int(os.environ.get('CAMPANA_PARTICIONES', '8'))
+
+# El programador no lanza campañas vencidas hace más de N minutos (p.ej. tras estar caído):
+# las avisa en el log y quedan sin ejecutar
+PROGRAMADOR_GRACIA_MINUTOS = float(os.environ.get('PROGRAMADOR_GRACIA_MINUTOS', '60'))
+
+# Escritura en bloque de EnvioLog/WhatsappLog: se vacía cada N filas o T milisegundos
+LOG_BUFFER_FILAS = int(os.environ.get('LOG_BUFFER_FILAS', '500'))
+LOG_BUFFER_MS = int(os.environ.get('LOG_BUFFER_MS', '1000'))
+
+# Límite de mensajes/seg por línea (token bucket). 80 mps es el throughput por defecto de Meta
+WHATSAPP_RATE_LIMIT = float(os.environ.get('WHATSAPP_RATE_LIMIT', '80'))
+WHATSAPP_RATE_BURST = float(os.environ.get('WHATSAPP_RATE_BURST', '80'))
+# Fracción del cupo de cada línea que las campañas dejan libre para las respuestas del bot
+WHATSAPP_RESERVA_INTERACTIVA = float(os.environ.get('WHATSAPP_RESERVA_INTERACTIVA', '0.2'))
+
+# Circuit breaker por línea: con más de CIRCUITO_UMBRAL_ERROR de errores de Meta (timeouts, 5xx)
+# en CIRCUITO_VENTANA_SEG se pausan los envíos de la línea y se prueba de nuevo tras CIRCUITO_ESPERA_SEG
+CIRCUITO_UMBRAL_ERROR = float(os.environ.get('CIRCUITO_UMBRAL_ERROR', '0.5'))
+CIRCUITO_MIN_PETICIONES = int(os.environ.get('CIRCUITO_MIN_PETICIONES', '20'))
+CIRCUITO_VENTANA_SEG = int(os.environ.get('CIRCUITO_VENTANA_SEG', '30'))
+CIRCUITO_ESPERA_SEG = float(os.environ.get('CIRCUITO_ESPERA_SEG', '30'))
+CIRCUITO_ESPERA_MAX_SEG = float(os.environ.get('CIRCUITO_ESPERA_MAX_SEG', '300'))
+CIRCUITO_SONDEOS = int(os.environ.get('CIRCUITO_SONDEOS', '3'))
+
+# ==========================================
+# 📡 CANALES DE ENVÍO (Campana.canal_envio)
+# ==========================================
+# Backend de cada canal (se puede reemplazar por uno propio, como EMAIL_BACKEND)
+CANALES_ENVIO = {
+    'whatsapp': 'core.canales.CanalWhatsapp',
+    'sms': 'core.canales.CanalSMS',
+    'email': 'core.canales.CanalEmail',
+    'voz': 'core.canales.CanalVoz',
+}
+
+# Envíos en paralelo de cada canal; los canales de una misma tanda corren a la vez
+CANAL_CONCURRENCIA = {
+    'whatsapp': CAMPANA_CONCURRENCIA,
+    'sms': int(os.environ.get('SMS_CONCURRENCIA', '2')),         # peticiones masivas en paralelo
+    'email': int(os.environ.get('EMAIL_CONCURRENCIA', '2')),     # conexiones SMTP en paralelo
+    'voz': int(os.environ.get('VOZ_CONCURRENCIA', '4')),         # llamadas en paralelo
+}
+
+# SMS: endpoint masivo del proveedor (hasta SMS_LOTE mensajes por petición)
+SMS_API_URL = os.environ.get('SMS_API_URL', '')
+SMS_API_TOKEN = os.environ.get('SMS_API_TOKEN', '')
+SMS_REMITENTE = os.environ.get('SMS_REMITENTE', 'EKI')
+SMS_LOTE = int(os.environ.get('SMS_LOTE', '100'))
+
+# Voz: una llamada (texto a voz) por destinatario
+VOZ_API_URL = os.environ.get('VOZ_API_URL', '')
+VOZ_API_TOKEN = os.environ.get('VOZ_API_TOKEN', '')
+
+# Email: una conexión SMTP reutilizada para hasta EMAIL_LOTE correos
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', '25'))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'False') == 'True'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'EKI <no-reply@eki.local>')
+EMAIL_LOTE = int(os.environ.get('EMAIL_LOTE', '100'))
+
+# Imágenes de plantillas: se suben una vez a la Media API y se envía el media id
+MEDIA_WHATSAPP_VIGENCIA_DIAS = int(os.environ.get('MEDIA_WHATSAPP_VIGENCIA_DIAS', '29'))   # Meta las borra a los 30
+MEDIA_WHATSAPP_VERIFICAR_SEG = int(os.environ.get('MEDIA_WHATSAPP_VERIFICAR_SEG', '600'))  # cada cuánto se revisa si la imagen cambió
+MEDIA_WHATSAPP_MAX_MB = float(os.environ.get('MEDIA_WHATSAPP_MAX_MB', '5'))
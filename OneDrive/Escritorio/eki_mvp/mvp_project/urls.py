@@ -4,7 +4,7 @@ from django.shortcuts import redirect
 from django.conf import settings
 from django.conf.urls.static import static
 from core.views import dashboard_view, whatsapp_webhook, descargar_reportes, importar_estudiantes
-from core.api import api_estudiante, api_estudiante_progreso, api_estudiante_siguiente_tarea
+from core.api import api_estudiante, api_estudiante_progreso, api_estudiante_siguiente_tarea, api_campanas_progreso
 
 
 def root_redirect(request):
@@ -28,6 +28,7 @@ urlpatterns = [
     path('api/estudiante/<str:telefono>/', api_estudiante, name='api_estudiante'),
     path('api/estudiante/<str:telefono>/progreso/', api_estudiante_progreso, name='api_estudiante_progreso'),
     path('api/estudiante/<str:telefono>/siguiente-tarea/', api_estudiante_siguiente_tarea, name='api_estudiante_siguiente_tarea'),
+    path('api/campanas/progreso/', api_campanas_progreso, name='api_campanas_progreso'),
     
     # Raíz
     path('', root_redirect),
@@ -60,6 +60,10 @@ response = client.post(
 print(f"   Status Code: {response.status_code}")
 print(f"   Response: {response.content.decode()}")
 
+# El webhook solo guarda el evento: lo procesamos aquí como haría `procesar_webhooks`
+from core.webhook import reclamar_eventos, procesar_eventos
+print(f"   Eventos procesados: {procesar_eventos(reclamar_eventos())}")
+
 # 4. Verificar que se creó el registro
 print("\n4️⃣  Verificando registros en WhatsappLog...")
 logs = WhatsappLog.objects.filter(telefono='573000000000').order_by('-fecha')
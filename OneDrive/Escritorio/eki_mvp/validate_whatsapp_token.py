@@ -35,7 +35,7 @@ print(f"   Verify Token: {verify_token}")
 print("\n🧪 Test 1: Validar Token")
 print("-" * 70)
 
-graph_url = f"https://graph.facebook.com/{api_version}"
+graph_url = f"{settings.WHATSAPP_API_URL}/{api_version}"
 
 try:
     # Obtener info del token